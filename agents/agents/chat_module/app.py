@@ -85,10 +85,12 @@ from google.genai.types import (
 )
 from typing import List
 from ui_utils import get_receipts_data
-import sqlite3
+from chat_component.tools.balances import get_member_balances
+from chat_component.tools.sqlite_engine import DB_PATH, enable_wal, get_connection
 from datetime import datetime
 
-DB_PATH = os.getenv("DB_PATH","/Users/rakshithhr/Documents/projects/agentic_day/chat_module/chat_component/mock_finance.db")
+# Once, before any request has a connection open
+enable_wal(DB_PATH)
 
 
 
@@ -96,7 +98,7 @@ def get_receipts_data(user_id=1):
     """
     Fetch receipt data from database and format it according to the desired structure
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH, readonly=True)
     cursor = conn.cursor()
     
     # Query to get expenses with group name, user name, and expense items
@@ -164,8 +166,6 @@ def get_receipts_data(user_id=1):
                 }
             ]
         receipts_list.append(receipt)
-    
-    conn.close()
     return receipts_list
 
 def format_date(date_str):
@@ -217,7 +217,7 @@ def get_groups():
     Endpoint to get all groups with group_id and group_name
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH, readonly=True)
         cursor = conn.cursor()
         
         query = """
@@ -245,8 +245,6 @@ def get_groups():
             }
             groups.append(group)
         
-        conn.close()
-        
         return {
             "groups": groups,
             "total_count": len(groups)
@@ -262,7 +260,7 @@ def get_group_by_id(group_id):
     Endpoint to get a specific group by ID
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH, readonly=True)
         cursor = conn.cursor()
         
         query = """
@@ -279,8 +277,6 @@ def get_group_by_id(group_id):
         cursor.execute(query, (group_id,))
         result = cursor.fetchone()
         
-        conn.close()
-        
         if result:
             group = {
                 "group_id": result[0],
@@ -305,7 +301,7 @@ def get_group_details(group_id):
     Endpoint to get group details including users, their debt/credit amounts, and receipt URLs
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = get_connection(DB_PATH, readonly=True)
         cursor = conn.cursor()
         
         # First, check if group exists
@@ -314,34 +310,14 @@ def get_group_details(group_id):
         group_result = cursor.fetchone()
         
         if not group_result:
-            conn.close()
             return {
                 "error": "Group not found"
             }, 404
         
         group_name, group_description = group_result
         
-        # Get all users in the group with their debt/credit calculations
-        users_query = """
-        SELECT 
-            u.user_id,
-            u.name as user_name,
-            u.email,
-            COALESCE(SUM(CASE WHEN e.payer_id = u.user_id THEN e.amount ELSE 0 END), 0) as total_paid,
-            COALESCE(SUM(CASE WHEN es.user_id = u.user_id THEN es.share_amount ELSE 0 END), 0) as total_owed,
-            (COALESCE(SUM(CASE WHEN e.payer_id = u.user_id THEN e.amount ELSE 0 END), 0) - 
-             COALESCE(SUM(CASE WHEN es.user_id = u.user_id THEN es.share_amount ELSE 0 END), 0)) as net_amount
-        FROM users u
-        JOIN user_groups ug ON u.user_id = ug.user_id
-        LEFT JOIN expenses e ON e.group_id = ug.group_id AND e.payer_id = u.user_id
-        LEFT JOIN expense_shares es ON es.expense_id = e.expense_id AND es.user_id = u.user_id
-        WHERE ug.group_id = ?
-        GROUP BY u.user_id, u.name, u.email
-        ORDER BY u.name
-        """
-        
-        cursor.execute(users_query, (group_id,))
-        users_results = cursor.fetchall()
+        # Each member's paid / owed / net, from the materialized balances
+        users_results = get_member_balances(conn, group_id)
         
         # Get all receipt URLs for the group
         receipts_query = """
@@ -397,8 +373,6 @@ def get_group_details(group_id):
         total_expenses = sum(user["total_paid"] for user in users)
         total_shares = sum(user["total_owed"] for user in users)
         
-        conn.close()
-        
         return {
             "group_id": group_id,
             "group_name": group_name,
@@ -0,0 +1,108 @@
+"""
+Per-query time of the agent tools' and UI endpoints' SQLite queries, with a
+connection opened and closed around every query as execute_query used to,
+against chat_component/tools/sqlite_engine.py's reused, WAL mode connections.
+
+Works on a copy of chat_component/mock_finance.db in a temporary directory,
+so the database itself is left alone. Run from chat_module/:
+
+    python benchmarks/sqlite_queries.py
+
+BENCH_QUERIES sets how many times each query runs each way.
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import statistics
+
+# The tool modules, not the chat_component package: importing that loads the
+# agent and its Google Wallet credentials.
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'chat_component', 'tools')
+sys.path.insert(0, TOOLS_DIR)
+
+from balances import MEMBER_BALANCES_QUERY
+from sqlite_engine import execute, enable_wal, close_connections
+
+SOURCE_DB = os.path.join(os.path.dirname(TOOLS_DIR), 'mock_finance.db')
+QUERIES = int(os.getenv('BENCH_QUERIES', 2000))
+
+# (name, SQL, params, read only): what validate_user_and_group,
+# get_group_details, get_member_balances, get_spending_summary, the receipts
+# endpoint and an expense write send.
+WORKLOAD = [
+    ('user lookup', "SELECT user_id, name FROM users WHERE user_id = 1", (), False),
+    ('group by name', """
+        SELECT g.group_id, g.name
+        FROM groups g
+        JOIN user_groups ug ON g.group_id = ug.group_id
+        WHERE LOWER(g.name) = LOWER('Account Group') AND ug.user_id = 2
+    """, (), False),
+    ('member balances', MEMBER_BALANCES_QUERY, (1,), False),
+    ('spending summary', """
+        SELECT s.month, s.category, ROUND(SUM(s.total), 2), SUM(s.expense_count)
+        FROM spending_monthly s
+        JOIN groups g ON g.group_id = s.group_id
+        WHERE s.user_id = ? AND s.month BETWEEN ? AND ?
+        GROUP BY s.month, s.category
+    """, (1, '2025-01', '2025-12'), False),
+    ('receipts (read only)', """
+        SELECT e.expense_id, e.amount, e.expense_date, g.name, ei.name, ei.unit_price
+        FROM expenses e
+        JOIN groups g ON e.group_id = g.group_id
+        LEFT JOIN expense_items ei ON e.expense_id = ei.expense_id
+        WHERE e.payer_id = ?
+        ORDER BY e.expense_date DESC, e.expense_id DESC
+    """, (1,), True),
+    ('update, committed', "UPDATE users SET created_at = created_at WHERE user_id = 1", (), False),
+]
+
+def connect_per_query(path: str, sql_query: str, params: tuple = ()):
+    # execute_query before sqlite_engine
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute(sql_query, params)
+    if sql_query.strip().upper().startswith(('INSERT', 'UPDATE')):
+        conn.commit()
+    results = cursor.fetchall()
+    conn.close()
+    return results
+
+def engine(path: str, sql_query: str, params: tuple = (), readonly: bool = False):
+    commit = sql_query.strip().upper().startswith(('INSERT', 'UPDATE'))
+    return execute(path, sql_query, params, readonly=readonly, commit=commit)
+
+def time_queries(run) -> list[float]:
+    timings = []
+    for _ in range(QUERIES):
+        started = time.perf_counter()
+        run()
+        timings.append(1e6 * (time.perf_counter() - started))
+    return timings
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        before_db = os.path.join(directory, 'before.db')
+        after_db = os.path.join(directory, 'after.db')
+        shutil.copy(SOURCE_DB, before_db)
+        shutil.copy(SOURCE_DB, after_db)
+        enable_wal(after_db)
+
+        print(f"{QUERIES} runs of each query, microseconds per query")
+        print(f"{'':22}{'before median':>15}{'p95':>8}{'after median':>15}{'p95':>8}{'speedup':>9}")
+        for name, sql_query, params, readonly in WORKLOAD:
+            assert connect_per_query(before_db, sql_query, params) == engine(after_db, sql_query, params, readonly)
+            before = time_queries(lambda: connect_per_query(before_db, sql_query, params))
+            after = time_queries(lambda: engine(after_db, sql_query, params, readonly))
+            print(
+                f"{name:22}"
+                f"{statistics.median(before):>15.1f}{statistics.quantiles(before, n=20)[-1]:>8.1f}"
+                f"{statistics.median(after):>15.1f}{statistics.quantiles(after, n=20)[-1]:>8.1f}"
+                f"{statistics.median(before) / statistics.median(after):>8.1f}x"
+            )
+        close_connections()
+
+if __name__ == '__main__':
+    main()
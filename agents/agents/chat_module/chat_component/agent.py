@@ -9,6 +9,8 @@ from google.genai import types
 from chat_component.tools.sql_execution import execute_query_fetch
 from google.adk.tools import FunctionTool
 execute_query_tool = FunctionTool(func=execute_query_fetch)
+from chat_component.tools.rollups import get_spending_summary
+spending_summary_tool = FunctionTool(func=get_spending_summary)
 from chat_component.tools.google_wallet import create_google_wallet_pass
 from chat_component.group_split import group_agent
 from google.adk.tools import google_search
@@ -30,7 +32,7 @@ InformationAgent = LlmAgent(
     #         thinking_budget=1024,
     #     )
     # ),
-    tools=[execute_query_tool]
+    tools=[execute_query_tool, spending_summary_tool]
 )
 
 AnalysisAgent = LlmAgent(
@@ -38,7 +40,7 @@ AnalysisAgent = LlmAgent(
     model="gemini-2.5-flash",
     description="Your Role is to act on analysis of the provided info and act as a financial analyzer and advisor. Do a thorough analysis, ask the Information agent on any required information that is further needed for fulfilling the request",
     instruction=prompts['prompts']['Analysis_prompt'],
-    tools=[agent_tool.AgentTool(agent=InformationAgent)]
+    tools=[spending_summary_tool, agent_tool.AgentTool(agent=InformationAgent)]
 )
 
 NeedCheckAgent = LlmAgent(
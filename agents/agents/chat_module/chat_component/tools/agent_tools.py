@@ -9,6 +9,9 @@ from chat_component.tools.utils import round_to_cents
 import json
 from datetime import datetime
 from chat_component.tools.group_wallet import create_google_wallet_pass_groups
+from chat_component.tools.balances import MEMBER_BALANCES_QUERY, apply_expense
+from chat_component.tools.rollups import apply_expense_spending
+from chat_component.tools.sqlite_engine import DB_PATH, get_connection
 
 
 
@@ -586,28 +589,14 @@ def get_group_balance_info(user_id: int, group_name: str) -> str:
 
         group_id = validation["group_id"]
 
-        # Get group balances directly
-        query = f"""
-            SELECT
-                u.user_id,
-                u.name,
-                COALESCE(SUM(CASE WHEN e.payer_id = u.user_id THEN e.amount ELSE 0 END), 0) as paid,
-                COALESCE(SUM(es.share_amount), 0) as owes
-            FROM users u
-            JOIN user_groups ug ON u.user_id = ug.user_id
-            LEFT JOIN expenses e ON e.group_id = ug.group_id
-            LEFT JOIN expense_shares es ON es.user_id = u.user_id AND es.expense_id = e.expense_id
-            WHERE ug.group_id = {group_id}
-            GROUP BY u.user_id, u.name
-            ORDER BY u.name
-        """
-
-        results = execute_query(query)
+        # Balances are kept up to date by persist_expense_and_shares, so this
+        # is a lookup rather than a sum over the group's history.
+        results = execute_query(MEMBER_BALANCES_QUERY, (group_id,))
 
         balances = {}
         for row in results:
-            user_id_bal, name, paid, owes = row
-            balance = round_to_cents(paid - owes)
+            user_id_bal, name, _, paid, owes, balance = row
+            balance = round_to_cents(balance)
 
             balances[user_id_bal] = {
                 'name': name,
@@ -658,13 +647,10 @@ def persist_expense_and_shares(group_id: int, payer_id: int, total_amount: float
     Returns:
         bool: True if successful, False otherwise
     """
-    import sqlite3
-    import os
-
     try:
-        # Use a single connection for the entire transaction
-        db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'database', 'mock_finance.db')
-        conn = sqlite3.connect(db_path)
+        # Use a single connection for the entire transaction, on the database
+        # the balances and rollups are read from
+        conn = get_connection(DB_PATH)
         cursor = conn.cursor()
 
         # Insert into expenses table
@@ -691,16 +677,25 @@ def persist_expense_and_shares(group_id: int, payer_id: int, total_amount: float
             """
             cursor.execute(share_insert)
             print(f"Inserted share: expense_id={expense_id}, user_id={user_id}, amount={share_amount}")
+
+        # Same transaction as the inserts above, so balances never disagree
+        # with the expense history.
+        apply_expense(
+            conn,
+            group_id=group_id,
+            payer_id=payer_id,
+            amount=total_amount,
+            shares={user_id: split_data['share_amount'] for user_id, split_data in splits.items()},
+        )
+        apply_expense_spending(conn, expense_id)
         #TODO: GROUP WALLET
         urls = create_google_wallet_pass_groups(group_id=group_id)
         # Commit all changes
         conn.commit()
-        conn.close()
 
         return urls[user_id]
     except Exception as e:
         print(f"Error persisting expense: {str(e)}")
         if 'conn' in locals():
             conn.rollback()
-            conn.close()
         return False
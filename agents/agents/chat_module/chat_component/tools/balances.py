@@ -0,0 +1,190 @@
+"""
+Materialized per-group member balances.
+
+group_member_balances keeps, for every (group, member), the total the member
+paid, the total of their shares (owed) and the difference (net), so reading a
+group's balances is a lookup by group_id instead of summing the group's whole
+expense history. Writers keep it current by calling apply_expense() in the
+same transaction as the expense and share inserts; a payment is an expense
+whose single share belongs to the payee, and is applied the same way.
+
+rebuild_balances() recomputes the table from expenses / expense_shares and
+verify_balances() reports rows that disagree with a recomputation. From
+chat_module/:
+
+    python chat_component/tools/balances.py rebuild [--group GROUP_ID]
+    python chat_component/tools/balances.py verify [--group GROUP_ID]
+"""
+import sys
+import sqlite3
+import argparse
+from typing import Dict, List, Union
+
+try:
+    from chat_component.tools.sqlite_engine import DB_PATH, enable_wal
+except ImportError:
+    # Run as a script, see above
+    from sqlite_engine import DB_PATH, enable_wal
+
+# Amounts are stored as REAL; differences below half a cent are rounding.
+TOLERANCE = 0.005
+
+CREATE_BALANCES_TABLE = """
+    CREATE TABLE IF NOT EXISTS group_member_balances (
+        group_id   INTEGER NOT NULL,
+        user_id    INTEGER NOT NULL,
+        paid       REAL NOT NULL DEFAULT 0,
+        owed       REAL NOT NULL DEFAULT 0,
+        net        REAL NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (group_id, user_id)
+    )
+"""
+
+APPLY_DELTA = """
+    INSERT INTO group_member_balances (group_id, user_id, paid, owed, net)
+    VALUES (?, ?, ROUND(?, 2), ROUND(?, 2), ROUND(? - ?, 2))
+    ON CONFLICT (group_id, user_id) DO UPDATE SET
+        paid = ROUND(paid + excluded.paid, 2),
+        owed = ROUND(owed + excluded.owed, 2),
+        net = ROUND(paid + excluded.paid - owed - excluded.owed, 2),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# paid / owed recomputed from the expense history, one row per group member
+# and per anyone who paid or holds a share without being a member.
+COMPUTED_BALANCES = """
+    SELECT group_id, user_id,
+           ROUND(SUM(paid), 2) AS paid,
+           ROUND(SUM(owed), 2) AS owed
+    FROM (
+        SELECT group_id, user_id, 0 AS paid, 0 AS owed
+        FROM user_groups
+        UNION ALL
+        SELECT group_id, payer_id, amount, 0
+        FROM expenses
+        UNION ALL
+        SELECT e.group_id, es.user_id, 0, es.share_amount
+        FROM expense_shares es
+        JOIN expenses e ON e.expense_id = es.expense_id
+    )
+    WHERE ? IS NULL OR group_id = ?
+    GROUP BY group_id, user_id
+"""
+
+# Every member of the group, with zeros for members nothing was recorded for.
+MEMBER_BALANCES_QUERY = """
+    SELECT u.user_id, u.name, u.email,
+           COALESCE(b.paid, 0), COALESCE(b.owed, 0), COALESCE(b.net, 0)
+    FROM user_groups ug
+    JOIN users u ON u.user_id = ug.user_id
+    LEFT JOIN group_member_balances b ON b.group_id = ug.group_id AND b.user_id = ug.user_id
+    WHERE ug.group_id = ?
+    ORDER BY u.name
+"""
+
+def ensure_balances_table(conn: sqlite3.Connection):
+    conn.execute(CREATE_BALANCES_TABLE)
+
+def apply_expense(conn: sqlite3.Connection, group_id: int, payer_id: int, amount: float,
+                  shares: Dict[int, float]):
+    """
+    Adds one expense (or payment) to the balances. `shares` maps user_id to
+    share_amount. Does not commit; call it inside the transaction that
+    inserts the expense so both land or neither does.
+    """
+    ensure_balances_table(conn)
+    deltas: Dict[int, List[float]] = {payer_id: [amount, 0.0]}
+    for user_id, share_amount in shares.items():
+        deltas.setdefault(user_id, [0.0, 0.0])[1] += share_amount
+
+    conn.executemany(APPLY_DELTA, [
+        (group_id, user_id, paid, owed, paid, owed)
+        for user_id, (paid, owed) in deltas.items()
+    ])
+
+def get_member_balances(conn: sqlite3.Connection, group_id: int) -> List[tuple]:
+    """
+    Returns (user_id, name, email, paid, owed, net) for every member of the
+    group, ordered by name.
+    """
+    ensure_balances_table(conn)
+    return conn.execute(MEMBER_BALANCES_QUERY, (group_id,)).fetchall()
+
+def rebuild_balances(conn: sqlite3.Connection, group_id: Union[int, None] = None) -> int:
+    """
+    Recomputes the balances of one group, or of every group, from the expense
+    history in a single transaction. Returns the number of rows written.
+    """
+    ensure_balances_table(conn)
+    with conn:
+        if group_id is None:
+            conn.execute("DELETE FROM group_member_balances")
+        else:
+            conn.execute("DELETE FROM group_member_balances WHERE group_id = ?", (group_id,))
+        cursor = conn.execute(f"""
+            INSERT INTO group_member_balances (group_id, user_id, paid, owed, net)
+            SELECT group_id, user_id, paid, owed, ROUND(paid - owed, 2)
+            FROM ({COMPUTED_BALANCES})
+        """, (group_id, group_id))
+        return cursor.rowcount
+
+def verify_balances(conn: sqlite3.Connection, group_id: Union[int, None] = None) -> List[Dict]:
+    """
+    Compares the stored balances with a recomputation. Returns one entry per
+    (group, user) that differs; an empty list means the table is consistent.
+    """
+    ensure_balances_table(conn)
+    computed = {
+        (row[0], row[1]): (row[2], row[3])
+        for row in conn.execute(COMPUTED_BALANCES, (group_id, group_id))
+    }
+    stored = {
+        (row[0], row[1]): (row[2], row[3], row[4])
+        for row in conn.execute(
+            "SELECT group_id, user_id, paid, owed, net FROM group_member_balances WHERE ? IS NULL OR group_id = ?",
+            (group_id, group_id),
+        )
+    }
+
+    mismatches = []
+    for key in sorted(computed.keys() | stored.keys()):
+        paid, owed = computed.get(key, (0.0, 0.0))
+        stored_paid, stored_owed, stored_net = stored.get(key, (0.0, 0.0, 0.0))
+        if (abs(paid - stored_paid) > TOLERANCE or abs(owed - stored_owed) > TOLERANCE
+                or abs((stored_paid - stored_owed) - stored_net) > TOLERANCE):
+            mismatches.append({
+                'group_id': key[0],
+                'user_id': key[1],
+                'expected': {'paid': paid, 'owed': owed, 'net': round(paid - owed, 2)},
+                'stored': {'paid': stored_paid, 'owed': stored_owed, 'net': stored_net},
+            })
+    return mismatches
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild or verify group_member_balances")
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--group', type=int, default=None, help="Only this group_id")
+    parser.add_argument('--db', default=DB_PATH, help="Path to the SQLite database")
+    args = parser.parse_args(argv)
+
+    if args.command == 'rebuild':
+        # The chat tools expect WAL, see sqlite_engine.py
+        enable_wal(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == 'rebuild':
+            print(f"Rebuilt {rebuild_balances(conn, args.group)} balance rows")
+            return 0
+
+        mismatches = verify_balances(conn, args.group)
+        for mismatch in mismatches:
+            print(f"group {mismatch['group_id']} user {mismatch['user_id']}: "
+                  f"stored {mismatch['stored']}, expected {mismatch['expected']}")
+        print(f"{len(mismatches)} mismatched balance rows" if mismatches else "Balances are consistent")
+        return 1 if mismatches else 0
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -58,10 +58,8 @@ def create_save_url_with_jwt(object_id: str):
 
 from google.adk.tools import ToolContext
 import os
-DB_PATH = os.environ.get("DB_URL",'/Users/rakshithhr/Documents/projects/agentic_day/chat_module/chat_component/mock_finance.db')
-import sqlite3
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
+from chat_component.tools.balances import get_member_balances
+from chat_component.tools.sqlite_engine import DB_PATH, get_connection
 
 def create_google_wallet_pass_groups(group_id):
 
@@ -169,6 +167,9 @@ def calculate_group_expense_shares(group_id: int) -> List[Dict]:
     - get_back_amount: Amount the user should get back from others
     """
     
+    conn = get_connection(DB_PATH, readonly=True)
+    cursor = conn.cursor()
+
     # Get group name
     cursor.execute("""
         SELECT name FROM groups WHERE group_id = ?
@@ -179,55 +180,15 @@ def calculate_group_expense_shares(group_id: int) -> List[Dict]:
     
     group_name = group_result[0]
     
-    # Get all users in the group
-    cursor.execute("""
-        SELECT DISTINCT ug.user_id, u.name, u.email
-        FROM user_groups ug
-        JOIN users u ON ug.user_id = u.user_id
-        WHERE ug.group_id = ?
-    """, (group_id,))
-    group_users = cursor.fetchall()
+    # paid / share / net per member, kept current by persist_expense_and_shares
+    group_users = get_member_balances(conn, group_id)
     
     if not group_users:
         raise HTTPException(status_code=404, detail=f"No users found in group {group_id}")
     
-    # Calculate total expenses in the group
-    cursor.execute("""
-        SELECT SUM(amount) FROM expenses WHERE group_id = ?
-    """, (group_id,))
-    total_group_expenses = cursor.fetchone()[0] or Decimal('0')
-    
-    # Calculate how much each user paid (as payer)
-    cursor.execute("""
-        SELECT payer_id, SUM(amount) as total_paid
-        FROM expenses 
-        WHERE group_id = ?
-        GROUP BY payer_id
-    """, (group_id,))
-    user_payments = dict(cursor.fetchall())
-    
-    # Calculate how much each user should pay (based on shares)
-    cursor.execute("""
-        SELECT es.user_id, SUM(es.share_amount) as total_share
-        FROM expense_shares es
-        JOIN expenses e ON es.expense_id = e.expense_id
-        WHERE e.group_id = ?
-        GROUP BY es.user_id
-    """, (group_id,))
-    user_shares = dict(cursor.fetchall())
-    
     results = []
     
-    for user_id, name, email in group_users:
-        # How much this user paid
-        paid_amount = user_payments.get(user_id, Decimal('0'))
-        
-        # How much this user should pay (their share)
-        share_amount = user_shares.get(user_id, Decimal('0'))
-        
-        # Calculate net position
-        net_amount = paid_amount - share_amount
-        
+    for user_id, name, email, paid_amount, share_amount, net_amount in group_users:
         # Determine owed_amount and get_back_amount
         if net_amount > 0:
             # User paid more than their share - they should get money back
@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import List, Dict
 from sql_execution import execute_query
 from utils import round_to_cents
+from balances import MEMBER_BALANCES_QUERY
 
 
 def get_group_members(group_id: int) -> List[Dict]:
@@ -119,28 +120,13 @@ def list_all_groups(self) -> List[Dict]:
 
 
 def get_group_balances(group_id: int) -> Dict:
-    """Calculate who owes what in a group"""
-    query = f"""
-        SELECT
-            u.user_id,
-            u.name,
-            COALESCE(SUM(CASE WHEN e.payer_id = u.user_id THEN e.amount ELSE 0 END), 0) as paid,
-            COALESCE(SUM(es.share_amount), 0) as owes
-        FROM users u
-        JOIN user_groups ug ON u.user_id = ug.user_id
-        LEFT JOIN expenses e ON e.group_id = ug.group_id
-        LEFT JOIN expense_shares es ON es.user_id = u.user_id AND es.expense_id = e.expense_id
-        WHERE ug.group_id = {group_id}
-        GROUP BY u.user_id, u.name
-        ORDER BY u.name
-    """
-
-    results = execute_query(query)
+    """Who owes what in a group, from the materialized group_member_balances"""
+    results = execute_query(MEMBER_BALANCES_QUERY, (group_id,))
     
     balances = {}
     for row in results:
-        user_id, name, paid, owes = row
-        balance = round_to_cents(paid - owes)
+        user_id, name, _, paid, owes, balance = row
+        balance = round_to_cents(balance)
         
         balances[user_id] = {
             'name': name,
@@ -0,0 +1,289 @@
+"""
+Pre-aggregated spending per member, group, category and day / month.
+
+spending_daily and spending_monthly hold, for every (user, group, category,
+period), the user's share of the expenses and how many expenses it came
+from, so a question like "how much did I spend on groceries each month this
+year" reads a few rows per month instead of every expense and item. Payments
+settle debts and are not spending, so they are left out.
+
+A member's spending is their share of an expense (expense_shares), whoever
+paid it: on a four way split bill each member spent a quarter, the payer
+included. An expense without shares is all the payer's. The share is spread
+over the categories of the expense's items (expense_items.category) pro
+rata; whatever the items do not account for (tax, tips, or an expense
+recorded without items) counts as 'uncategorized', so the members' rollups
+add up to the expense totals.
+
+Rollups written before spending followed the shares credited the payer
+with the whole expense; run `rebuild` once to recompute them.
+
+Writers call apply_expense_spending() in the transaction that inserts the
+expense, its shares and its items. rebuild_rollups() recomputes both tables
+and verify_rollups() checks them against a recomputation. From chat_module/:
+
+    python chat_component/tools/rollups.py rebuild
+    python chat_component/tools/rollups.py verify
+"""
+import sys
+import json
+import sqlite3
+import argparse
+from typing import Dict, List
+
+try:
+    from chat_component.tools.sqlite_engine import DB_PATH, enable_wal
+except ImportError:
+    # Run as a script, see above
+    from sqlite_engine import DB_PATH, enable_wal
+
+UNCATEGORIZED = 'uncategorized'
+
+# Amounts are stored as REAL; differences below half a cent are rounding.
+TOLERANCE = 0.005
+
+CREATE_ROLLUP_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS spending_daily (
+        user_id       INTEGER NOT NULL,
+        day           DATE NOT NULL,
+        group_id      INTEGER NOT NULL,
+        category      TEXT NOT NULL,
+        total         REAL NOT NULL DEFAULT 0,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, group_id, category)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS spending_monthly (
+        user_id       INTEGER NOT NULL,
+        month         TEXT NOT NULL,
+        group_id      INTEGER NOT NULL,
+        category      TEXT NOT NULL,
+        total         REAL NOT NULL DEFAULT 0,
+        expense_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month, group_id, category)
+    )
+    """,
+]
+
+# One row per (member, group, category, day) for the selected expenses.
+EXPENSE_CONTRIBUTIONS = f"""
+    WITH e AS (
+        SELECT expense_id, payer_id, group_id, DATE(expense_date) AS day, amount
+        FROM expenses
+        WHERE type != 'payment' AND (:expense_id IS NULL OR expense_id = :expense_id)
+    ), items AS (
+        SELECT ei.expense_id, COALESCE(ei.category, '{UNCATEGORIZED}') AS category,
+               SUM(COALESCE(ei.total_price, COALESCE(ei.quantity, 1) * ei.unit_price)) AS total
+        FROM expense_items ei
+        JOIN e ON e.expense_id = ei.expense_id
+        GROUP BY ei.expense_id, category
+    ), parts AS (
+        SELECT expense_id, category, total FROM items
+        UNION ALL
+        SELECT e.expense_id, '{UNCATEGORIZED}',
+               e.amount - COALESCE((SELECT SUM(total) FROM items WHERE items.expense_id = e.expense_id), 0)
+        FROM e
+    ), members AS (
+        SELECT s.expense_id, s.user_id, s.share_amount / e.amount AS fraction
+        FROM expense_shares s
+        JOIN e ON e.expense_id = s.expense_id
+        WHERE e.amount != 0
+        UNION ALL
+        SELECT e.expense_id, e.payer_id, 1.0
+        FROM e
+        WHERE e.amount = 0
+           OR NOT EXISTS (SELECT 1 FROM expense_shares s WHERE s.expense_id = e.expense_id)
+    )
+    SELECT members.user_id, e.day, e.group_id, parts.category,
+           ROUND(SUM(parts.total * members.fraction), 2) AS total,
+           COUNT(DISTINCT e.expense_id) AS expense_count
+    FROM parts
+    JOIN e ON e.expense_id = parts.expense_id
+    JOIN members ON members.expense_id = parts.expense_id
+    WHERE ABS(parts.total * members.fraction) >= {TOLERANCE}
+    GROUP BY members.user_id, e.day, e.group_id, parts.category
+"""
+
+ADD_DAILY = """
+    INSERT INTO spending_daily (user_id, day, group_id, category, total, expense_count)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, day, group_id, category) DO UPDATE SET
+        total = ROUND(total + excluded.total, 2),
+        expense_count = expense_count + excluded.expense_count
+"""
+
+ADD_MONTHLY = """
+    INSERT INTO spending_monthly (user_id, month, group_id, category, total, expense_count)
+    VALUES (?, strftime('%Y-%m', ?), ?, ?, ?, ?)
+    ON CONFLICT (user_id, month, group_id, category) DO UPDATE SET
+        total = ROUND(total + excluded.total, 2),
+        expense_count = expense_count + excluded.expense_count
+"""
+
+def ensure_rollup_tables(conn: sqlite3.Connection):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(expense_items)")}
+    if 'category' not in columns:
+        conn.execute(f"ALTER TABLE expense_items ADD COLUMN category TEXT NOT NULL DEFAULT '{UNCATEGORIZED}'")
+    for statement in CREATE_ROLLUP_TABLES:
+        conn.execute(statement)
+
+def apply_expense_spending(conn: sqlite3.Connection, expense_id: int, sign: int = 1):
+    """
+    Adds one expense, with the shares and items inserted so far, to the
+    rollups. Pass sign=-1 to take an expense out again before changing or
+    deleting it. Does not commit; call it inside the transaction that writes
+    the expense and its shares.
+    """
+    ensure_rollup_tables(conn)
+    rows = conn.execute(EXPENSE_CONTRIBUTIONS, {'expense_id': expense_id}).fetchall()
+    deltas = [
+        (user_id, day, group_id, category, sign * total, sign * expense_count)
+        for user_id, day, group_id, category, total, expense_count in rows
+    ]
+    conn.executemany(ADD_DAILY, deltas)
+    conn.executemany(ADD_MONTHLY, deltas)
+    # Rows that went back to nothing would only pad the scans.
+    conn.execute("DELETE FROM spending_daily WHERE expense_count <= 0 AND ABS(total) < ?", (TOLERANCE,))
+    conn.execute("DELETE FROM spending_monthly WHERE expense_count <= 0 AND ABS(total) < ?", (TOLERANCE,))
+
+def rebuild_rollups(conn: sqlite3.Connection) -> int:
+    """
+    Recomputes both rollup tables from the expense history in a single
+    transaction. Returns the number of daily rows written.
+    """
+    ensure_rollup_tables(conn)
+    with conn:
+        conn.execute("DELETE FROM spending_daily")
+        conn.execute("DELETE FROM spending_monthly")
+        written = conn.execute(f"""
+            INSERT INTO spending_daily (user_id, day, group_id, category, total, expense_count)
+            SELECT * FROM ({EXPENSE_CONTRIBUTIONS})
+        """, {'expense_id': None}).rowcount
+        conn.execute("""
+            INSERT INTO spending_monthly (user_id, month, group_id, category, total, expense_count)
+            SELECT user_id, strftime('%Y-%m', day), group_id, category, ROUND(SUM(total), 2), SUM(expense_count)
+            FROM spending_daily
+            GROUP BY user_id, strftime('%Y-%m', day), group_id, category
+        """)
+    return written
+
+def verify_rollups(conn: sqlite3.Connection) -> List[Dict]:
+    """
+    Compares both rollup tables with a recomputation. Returns one entry per
+    differing row; an empty list means the rollups are consistent.
+    """
+    ensure_rollup_tables(conn)
+    expected_daily: Dict[tuple, tuple] = dict()
+    expected_monthly: Dict[tuple, list] = dict()
+    for user_id, day, group_id, category, total, expense_count in conn.execute(EXPENSE_CONTRIBUTIONS, {'expense_id': None}):
+        expected_daily[(user_id, day, group_id, category)] = (total, expense_count)
+        monthly = expected_monthly.setdefault((user_id, day[:7], group_id, category), [0.0, 0])
+        monthly[0] += total
+        monthly[1] += expense_count
+
+    mismatches = []
+    for table, expected in (('spending_daily', expected_daily), ('spending_monthly', expected_monthly)):
+        period = 'day' if table == 'spending_daily' else 'month'
+        stored = {
+            (row[0], row[1], row[2], row[3]): (row[4], row[5])
+            for row in conn.execute(f"SELECT user_id, {period}, group_id, category, total, expense_count FROM {table}")
+        }
+        for key in sorted(expected.keys() | stored.keys(), key=str):
+            total, expense_count = expected.get(key, (0.0, 0))
+            stored_total, stored_count = stored.get(key, (0.0, 0))
+            if abs(total - stored_total) > TOLERANCE or expense_count != stored_count:
+                mismatches.append({
+                    'table': table,
+                    'key': key,
+                    'expected': {'total': round(total, 2), 'expense_count': expense_count},
+                    'stored': {'total': stored_total, 'expense_count': stored_count},
+                })
+    return mismatches
+
+def get_spending_summary(user_id: int, start_date: str, end_date: str, granularity: str = 'month',
+                         category: str = '', group_name: str = '') -> str:
+    """
+    Fast spending totals for a user, read from pre-aggregated rollups. Use this
+    for "how much did I spend on X per month / per day / between dates"
+    questions instead of summing expenses with SQL. A user's spending is their
+    share of each expense, whoever paid it: on a bill split four ways each
+    member spent a quarter. It is not what the user paid for others; use the
+    balances for who owes whom.
+    Args:
+        user_id: ID of the user whose spending is summarised
+        start_date: First day to include, YYYY-MM-DD
+        end_date: Last day to include, YYYY-MM-DD
+        granularity: 'month' or 'day'. With 'month', whole months from start_date's month to end_date's month are counted
+        category: Only this item category (e.g. 'groceries'); empty for all categories
+        group_name: Only expenses in this group; empty for all groups
+    Returns:
+        JSON string with one row per period and category, plus per category and overall totals
+    """
+    from chat_component.tools.sql_execution import execute_query
+
+    try:
+        if granularity not in ('month', 'day'):
+            return json.dumps({"error": "granularity must be 'month' or 'day'"})
+
+        if granularity == 'month':
+            table, period, bounds = 'spending_monthly', 'month', (start_date[:7], end_date[:7])
+        else:
+            table, period, bounds = 'spending_daily', 'day', (start_date, end_date)
+
+        query = f"""
+            SELECT s.{period}, s.category, ROUND(SUM(s.total), 2), SUM(s.expense_count)
+            FROM {table} s
+            JOIN groups g ON g.group_id = s.group_id
+            WHERE s.user_id = ? AND s.{period} BETWEEN ? AND ?
+              AND (? = '' OR LOWER(s.category) = LOWER(?))
+              AND (? = '' OR LOWER(g.name) = LOWER(?))
+            GROUP BY s.{period}, s.category
+            ORDER BY s.{period}, s.category
+        """
+        results = execute_query(query, (user_id, *bounds, category, category, group_name, group_name))
+
+        rows = []
+        by_category: Dict[str, float] = dict()
+        for period_value, row_category, total, expense_count in results:
+            rows.append({period: period_value, 'category': row_category, 'total': total, 'expense_count': expense_count})
+            by_category[row_category] = round(by_category.get(row_category, 0.0) + total, 2)
+
+        return json.dumps({
+            "user_id": user_id,
+            "granularity": granularity,
+            "start_date": start_date,
+            "end_date": end_date,
+            "rows": rows,
+            "totals_by_category": by_category,
+            "total": round(sum(by_category.values()), 2),
+        })
+    except Exception as e:
+        return json.dumps({"error": str(e)})
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild or verify the spending rollups")
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--db', default=DB_PATH, help="Path to the SQLite database")
+    args = parser.parse_args(argv)
+
+    if args.command == 'rebuild':
+        # The chat tools expect WAL, see sqlite_engine.py
+        enable_wal(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == 'rebuild':
+            print(f"Rebuilt spending rollups: {rebuild_rollups(conn)} daily rows")
+            return 0
+
+        mismatches = verify_rollups(conn)
+        for mismatch in mismatches:
+            print(f"{mismatch['table']} {mismatch['key']}: stored {mismatch['stored']}, expected {mismatch['expected']}")
+        print(f"{len(mismatches)} mismatched rollup rows" if mismatches else "Rollups are consistent")
+        return 1 if mismatches else 0
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
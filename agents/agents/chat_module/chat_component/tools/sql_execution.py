@@ -1,40 +1,21 @@
+from chat_component.tools.sqlite_engine import DB_PATH, execute
 
-import os
-import sqlite3
 
-# Get the base path for the database
-base_path = os.environ.get("DB_URL", '/Users/rakshithhr/Documents/projects/agentic_day/chat_module/chat_component')
-
-
-def execute_query(sql_query: str):
+def execute_query(sql_query: str, params: tuple = ()):
     """
     Function to execute the sqlite query and provide realtime data.
     Args:
         sql_query(str): Sqlite3 compatible sql query to execute against database and retrieve results
+        params(tuple): Values for the query's ? placeholders
 
     Returns:
         Results fetched from database
     """
-    import sqlite3
-    import os
-
-    # Get the database path relative to the project root
-    db_path = sqlite3.connect("/Users/rakshithhr/Documents/projects/agentic_day/group_agents/database/mock_finance.db")
-    conn = sqlite3.connect(db_path)
     print(f"SQL QUERY RECEIVED ----------------- {sql_query} -----------------------")
-    cursor = conn.cursor()
-
-    cursor.execute(sql_query)
 
-    # Commit for INSERT, UPDATE, DELETE operations
-    if sql_query.strip().upper().startswith(('INSERT', 'UPDATE')):
-        conn.commit()
-
-
-    results = cursor.fetchall()
-    conn.close()
-
-    return results
+    # Commit for INSERT, UPDATE operations; anything else is rolled back
+    commit = sql_query.strip().upper().startswith(('INSERT', 'UPDATE'))
+    return execute(DB_PATH, sql_query, params, commit=commit)
 
 
 # def execute_query(sql_query:str):
@@ -67,7 +48,6 @@ def execute_query_fetch(user_id:str,sql_query: str, tool_context: ToolContext)->
     Returns:
         Results fetched from database
     """
-    conn = sqlite3.connect(f'{base_path}/mock_finance.db')
     # user_id = tool_context.state['user_id']
     print(f"(((((((((((((((((((((( {user_id} )))))))))))))))))")
     # Ensure the query always filters for USER_ID=10 for security
@@ -174,10 +154,8 @@ def execute_query_fetch(user_id:str,sql_query: str, tool_context: ToolContext)->
                 sql_query = sql_query[:where_pos+5] + f' USER_ID={user_id} AND ' + sql_query[where_pos+5:]
     
     print(f"SQL QUERY RECEIVED ----------------- {sql_query} -----------------------")
-    cursor = conn.cursor()
-    cursor.execute(sql_query)
-    results = cursor.fetchall()
-    conn.close()
+    # Generated SQL only ever reads
+    results = execute(DB_PATH, sql_query, readonly=True)
     print(results)
     return results
 
@@ -0,0 +1,132 @@
+"""
+Reused, tuned SQLite connections for the chat tools and UI endpoints.
+
+Connecting is a file open plus, on the first query, reading and parsing the
+schema, and a new connection starts with an empty statement cache; the agent
+tools and endpoints used to pay all of it on every query. get_connection()
+keeps one connection per thread, database and mode instead. An sqlite3
+connection must not be shared between threads, and each thread (the event
+loop running the agent's tools, every threadpool thread serving a sync
+endpoint) runs one query at a time, so a connection per thread is a pool
+that never makes anyone wait.
+
+enable_wal() switches the database to WAL journaling, so readers neither
+block nor are blocked by the writer. The mode is stored in the file. The
+switch needs the database to itself, so it runs once: when the chat app
+starts and when balances.py / rollups.py rebuild, not on a connection
+serving queries (SQLITE_WAL=0 leaves the rollback journal alone).
+
+Every connection is opened with:
+
+- synchronous=NORMAL when the database is in WAL mode, which may lose the
+  last commits on a power cut but never corrupts the file
+- memory-mapped reads, SQLITE_MMAP_SIZE bytes
+- a page cache of SQLITE_CACHE_KB KiB and SQLITE_CACHED_STATEMENTS prepared
+  statements
+- SQLITE_BUSY_TIMEOUT_MS to wait for another writer's lock before failing
+
+readonly=True opens the file with a mode=ro URI and query_only set, so no
+statement sent through it writes, the SQL the agent generates included.
+
+execute() runs one statement and returns its rows. Whatever it leaves open
+is committed with commit=True and rolled back otherwise, as closing the
+connection used to, so a reused connection never carries a half finished
+transaction into the next query.
+"""
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+from typing import Dict, List, Tuple, Union
+
+def _database_path() -> str:
+    # DB_PATH, or DB_URL as older deployments set it, may name the database
+    # file or the directory holding mock_finance.db.
+    path = os.environ.get("DB_PATH") or os.environ.get("DB_URL") or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.path.isdir(path):
+        path = os.path.join(path, 'mock_finance.db')
+    return os.path.abspath(path)
+
+# The chat module's database, for the agent tools, the UI endpoints and the
+# balances / rollups scripts alike.
+DB_PATH = _database_path()
+
+USE_WAL = os.environ.get("SQLITE_WAL", "1") != "0"
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+CACHE_KB = int(os.environ.get("SQLITE_CACHE_KB", 64 * 1024))
+CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", 256))
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+_local = threading.local()
+
+def _open(path: str, readonly: bool) -> sqlite3.Connection:
+    options = dict(timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=CACHED_STATEMENTS)
+    if readonly:
+        conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True, **options)
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        conn = sqlite3.connect(path, **options)
+        # Only reads the mode, see enable_wal()
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_KB}")
+    return conn
+
+def enable_wal(path: str = DB_PATH) -> Union[str, None]:
+    """
+    Puts the database in WAL mode, unless SQLITE_WAL=0. Call it at startup,
+    before anything else has the file open. Returns the journal mode the
+    database is in, None when it is locked.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    try:
+        if USE_WAL:
+            return conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        return conn.execute("PRAGMA journal_mode").fetchone()[0]
+    except sqlite3.OperationalError as e:
+        # Another process holds the database; it keeps its journal mode.
+        print(f"Could not switch {path} to WAL: {e}")
+        return None
+    finally:
+        conn.close()
+
+def get_connection(path: str, readonly: bool = False) -> sqlite3.Connection:
+    """
+    This thread's connection to the database at `path`, opened on first use.
+    Don't close it; commit or roll back what you write with it.
+    """
+    connections: Dict[Tuple[str, bool], sqlite3.Connection] = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = dict()
+    key = (os.path.abspath(path), readonly)
+    conn = connections.get(key)
+    if conn is None:
+        conn = connections[key] = _open(key[0], readonly)
+    return conn
+
+def execute(path: str, sql_query: str, params: tuple = (), readonly: bool = False, commit: bool = False) -> List[tuple]:
+    """
+    Runs one statement on this thread's connection and returns its rows.
+    """
+    conn = get_connection(path, readonly)
+    try:
+        results = conn.execute(sql_query, params).fetchall()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    if conn.in_transaction:
+        if commit:
+            conn.commit()
+        else:
+            conn.rollback()
+    return results
+
+def close_connections():
+    """
+    Closes this thread's connections; the next query opens new ones.
+    """
+    for conn in getattr(_local, 'connections', dict()).values():
+        conn.close()
+    _local.connections = dict()
@@ -33,7 +33,7 @@ users(user_id, name, email, personal_group_id, created_at)
 groups(group_id, name, description, created_by, created_at)  
 user_groups(user_id, group_id, joined_at)  
 expenses(expense_id, group_id, payer_id, amount, currency, description, expense_date, location, type)  
-expense_items(item_id, expense_id, name, quantity, unit_price, total_price)  
+expense_items(item_id, expense_id, name, quantity, unit_price, total_price, category)  
 expense_shares(expense_id, user_id, share_amount)  
 expense_receipts(receipt_id, expense_id, url)  
 tasks(task_id, user_id, title, metadata, target_date, created_at)  
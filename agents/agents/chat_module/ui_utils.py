@@ -1,15 +1,14 @@
 import os
-import sqlite3
 from datetime import datetime
 
-DB_PATH = os.getenv("DB_PATH","/Users/rakshithhr/Documents/projects/agentic_day/chat_module/chat_component/mock_finance.db")
+from chat_component.tools.sqlite_engine import DB_PATH, get_connection
 
 
 def get_receipts_data(user_id=1):
     """
     Fetch receipt data from database and format it according to the desired structure
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH, readonly=True)
     cursor = conn.cursor()
     
     # Query to get expenses with group name, user name, and expense items
@@ -77,8 +76,6 @@ def get_receipts_data(user_id=1):
                 }
             ]
         receipts_list.append(receipt)
-    
-    conn.close()
     return receipts_list
 
 def format_date(date_str):
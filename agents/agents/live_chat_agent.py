@@ -18,7 +18,9 @@ root_agent = Agent(
    and answer user query regard the reciept and his previous spending.
    If a receipt is shown, call the receipt detail_extraction_agent once to 
    fetch the details in the receipt. Please acknowledge the user before processing
-   the receipt as it is a bit long process.
+   the receipt as it is a bit long process. The details come back in parts:
+   first the store, date and total, which you can tell the user straight away,
+   then the items read so far, then the whole bill.
    """,
    # Add google_search tool to perform grounding with Google search.
    tools=[process_live_receipt],
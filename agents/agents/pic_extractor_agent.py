@@ -1,5 +1,6 @@
 from google.adk import Agent
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.sessions import InMemorySessionService
 from google.genai.types import (
     Part,
@@ -8,11 +9,21 @@ from google.genai.types import (
 from pydantic import BaseModel
 from enum import Enum
 import json
+import time
+import hashlib
+from typing import Any, AsyncGenerator, AsyncIterator
 from google.adk.tools import ToolContext
 
 import os
 
-images = list[bytes]()
+from services.frames import get_frame_store
+from services.metrics import track_tool_call, EXTRACTION_FIRST_RESULT
+from services.frame_selection import select_frames
+from services.extraction_cache import extraction_cache, frames_key, frames_digest
+from services.database import save_bill
+from services.bill_stream import BillStreamParser
+from services.receipt_preprocess import preprocess_receipt, preprocess_receipts
+import asyncio
 
 class Rating(BaseModel):
     rating: int
@@ -72,56 +83,145 @@ data_extracted = Agent(
     output_schema=Bill
 )
 
-buffer = list[bytes]()
+EXTRACTION_PROMPT = "Go through the recipt{} throughly and extract the bill details."
 
-async def _run_pic_selection(data):
+# Cached bills are only valid for the prompt, model and schema that produced
+# them, and for the layout of the cache entry: {"frames": ..., "bill": ...}.
+EXTRACTION_PROMPT_VERSION = hashlib.sha256(json.dumps([
+    data_extracted.instruction, data_extracted.model, EXTRACTION_PROMPT, Bill.model_json_schema(), 'frames+bill',
+]).encode()).hexdigest()[:16]
+
+# Partial responses carry the bill JSON as the model writes it.
+EXTRACTION_RUN_CONFIG = RunConfig(streaming_mode=StreamingMode.SSE)
+# Reported to the live agent as soon as all of them are read.
+HEADER_FIELDS = {'Amount', 'expense_date', 'location'}
+# Least time between two reports of the items read so far.
+STREAM_REPORT_INTERVAL = float(os.getenv('EXTRACTION_STREAM_REPORT_INTERVAL', 3))
+
+# Built once; each call only adds a session, and removes it when done.
+_session_service = InMemorySessionService()
+_pic_selector_runner = Runner(app_name='raseed', agent=pic_selector, session_service=_session_service)
+_extraction_runner = Runner(app_name='raseed', agent=data_extracted, session_service=_session_service)
+
+async def _run_pic_selection(data, user_id: str):
     rating = ''
-    runner = Runner(app_name='raseed', agent=pic_selector, session_service=InMemorySessionService())
-    session = await runner.session_service.create_session(user_id="123", app_name="raseed")
-    async for event in runner.run_async(
-    new_message=Content(role="user", parts=[
-        Part.from_bytes(data=data, mime_type="image/jpeg"), 
-        Part.from_text(text=
-            """
-            Can you understand all the parts of recipt? Please rate it from a scale of 1 to 100
-            on how much of the data within the receipt is legible.
-            """)
-    ]),
-    user_id="123",
-    session_id=session.id
-    ):
-        part: Part | None | list[Part]= (
-            event.content and event.content.parts and event.content.parts[0]
-        )
-        if not part: continue
-
-        if not isinstance(part, list) and part.text:
-            rating = part.text
+    runner = _pic_selector_runner
+    data = await asyncio.to_thread(preprocess_receipt, data)
+    session = None
+    try:
+        session = await runner.session_service.create_session(user_id=user_id, app_name="raseed")
+        async for event in runner.run_async(
+        new_message=Content(role="user", parts=[
+            Part.from_bytes(data=data, mime_type="image/jpeg"), 
+            Part.from_text(text=
+                """
+                Can you understand all the parts of recipt? Please rate it from a scale of 1 to 100
+                on how much of the data within the receipt is legible.
+                """)
+        ]),
+        user_id=user_id,
+        session_id=session.id
+        ):
+            part: Part | None | list[Part]= (
+                event.content and event.content.parts and event.content.parts[0]
+            )
+            if not part: continue
+
+            if not isinstance(part, list) and part.text:
+                rating = part.text
+    finally:
+        if session is not None:
+            await runner.session_service.delete_session(app_name="raseed", user_id=user_id, session_id=session.id)
     print(f"Scoring agent result: {rating}")
     return rating
 
-async def _run_bill_extraction(images):
+async def _score_frame(data: bytes, user_id: str) -> int:
+    return int(json.loads(await _run_pic_selection(data, user_id))['rating'])
+
+async def _run_bill_extraction(images, user_id: str) -> AsyncIterator[tuple[bool, str]]:
+    """
+    Streams the extraction: (True, text) for each piece of the bill JSON as
+    the model writes it, then (False, bill_json) with all of it. The runner
+    session is the user's, for as long as the extraction runs.
+    """
     bill_json = ''
-    runner = Runner(app_name='raseed', agent=data_extracted, session_service=InMemorySessionService())
-    session = await runner.session_service.create_session(user_id="123", app_name="raseed")
-    parts = [Part.from_bytes(data=pic, mime_type="image/jpeg") for pic in images]
-    parts.append(Part.from_text(text=f"Go through the recipt{"s" if len(parts) > 1 else ''} throughly and extract the bill details."))
-    async for event in runner.run_async(
-        new_message=Content(role="user", parts=parts),
-        user_id="123",
-        session_id=session.id
-    ):
-        part: Part | None | list[Part]= (
-            event.content and event.content.parts and event.content.parts[0]
-        )
-        if not part: continue
-
-        if not isinstance(part, list) and part.text:
-            bill_json = part.text
+    runner = _extraction_runner
+    session = None
+    try:
+        # Cropped, deskewed and downscaled: the model bills per image tile.
+        images = await asyncio.to_thread(preprocess_receipts, images)
+        parts = [Part.from_bytes(data=pic, mime_type="image/jpeg") for pic in images]
+        parts.append(Part.from_text(text=EXTRACTION_PROMPT.format("s" if len(parts) > 1 else '')))
+        session = await runner.session_service.create_session(user_id=user_id, app_name="raseed")
+        async for event in runner.run_async(
+            new_message=Content(role="user", parts=parts),
+            user_id=user_id,
+            session_id=session.id,
+            run_config=EXTRACTION_RUN_CONFIG
+        ):
+            part: Part | None | list[Part]= (
+                event.content and event.content.parts and event.content.parts[0]
+            )
+            if not part: continue
+
+            if not isinstance(part, list) and part.text and not part.thought:
+                if event.partial:
+                    yield True, part.text
+                else:
+                    bill_json = part.text
+    finally:
+        if session is not None:
+            await runner.session_service.delete_session(app_name="raseed", user_id=user_id, session_id=session.id)
     print(f"Bill agent result: {bill_json}")
-    return bill_json
-    
-async def process_live_receipt() -> dict[str, str]:
+    yield False, bill_json
+
+async def _stream_bill(frames: list[bytes], user_id: str) -> AsyncIterator[tuple[str, Any]]:
+    """
+    The bill in the frames, as it is extracted: ('field', (name, value)) for
+    each header field and ('item', item) for each line item as soon as the
+    model has written it, then ('bill', (bill, digest)) unless the model's
+    output doesn't parse, `digest` being frames_digest() of the frames the
+    bill was read from. A bill from the cache, for these frames or the ones
+    selection picks from them, only comes as ('bill', (bill, digest)).
+    """
+    frames_cache_key = frames_key(frames, EXTRACTION_PROMPT_VERSION)
+    entry = await extraction_cache.get(frames_cache_key)
+    if entry is not None:
+        entry = json.loads(entry)
+        yield 'bill', (entry['bill'], entry['frames'])
+        return
+
+    selected = await select_frames(frames, lambda data: _score_frame(data, user_id))
+    selected_cache_key = frames_key(selected, EXTRACTION_PROMPT_VERSION)
+    entry = await extraction_cache.get(selected_cache_key)
+    if entry is None:
+        parser = BillStreamParser()
+        async for partial, text in _run_bill_extraction(selected, user_id):
+            if partial:
+                for event in parser.feed(text):
+                    yield event
+            else:
+                bill_json = text
+        try:
+            bill = json.loads(bill_json)
+        except json.JSONDecodeError as e:
+            # No ('bill', ...) then; nothing is cached either.
+            print(f"Bill agent result is not JSON: {e}")
+            return
+        # Only output that parsed gets this far and is cached.
+        entry = json.dumps({'frames': frames_digest(selected), 'bill': bill})
+        await extraction_cache.set(selected_cache_key, entry)
+    if frames_cache_key != selected_cache_key:
+        await extraction_cache.set(frames_cache_key, entry)
+    entry = json.loads(entry)
+    yield 'bill', (entry['bill'], entry['frames'])
+
+async def process_live_receipt(tool_context: ToolContext) -> AsyncGenerator[dict, None]:
+    """
+    Extracts the bill details from the receipt the user is showing on camera.
+    Reports the store, date and total as soon as they are read, the line
+    items read so far every few seconds, and then the whole bill.
+    """
     # folder_path = "/home/dedshot/adk-docs/examples/python/snippets/streaming/adk-streaming-ws/app/static/output_video"
     # if not os.path.isdir(folder_path):
     #     print(f"Error: The folder was not found at '{folder_path}'")
@@ -137,22 +237,69 @@ async def process_live_receipt() -> dict[str, str]:
     #             buffer.append(image_file.read())
     #     except IOError as e:
     #         print(f"Error reading file {filename}: {e}")
-    
-    # collected_image_indices = []
-    # scores = []
-    # for img in buffer:
-    #     scores.append(int(json.loads(await _run_pic_selection(img))['rating']))
-
-    # max_score = max(scores)
-    # error_bound = max_score - 20
-    # for i, score in enumerate(scores):
-    #     if score >= error_bound:
-    #         collected_image_indices.append(i)
-
-    # collected_images = []
-    # for i in collected_image_indices:
-    #     collected_images.append(buffer[i])
 
     print("Called live process agent.")
 
-    return json.loads(await _run_bill_extraction(images))
\ No newline at end of file
+    with track_tool_call("process_live_receipt"):
+        started = time.perf_counter()
+        # Only this session's frames. Blurry, badly exposed and duplicate
+        # ones are dropped locally, the best few are scored by pic_selector.
+        user_id = tool_context.state.get('user_id')
+        frame_store = get_frame_store(tool_context.state.get('live_session_id'))
+        frames = frame_store.recent_frames() if frame_store is not None else []
+        if not frames:
+            yield {"error": "No receipt has been shown on camera yet."}
+            return
+
+        # Each result is a new message to the live model, which it answers
+        # out loud; items are batched so a long receipt doesn't flood it.
+        header, items, reported = {}, [], 0
+        bill, digest = None, None
+        answered = False
+        last_report = time.monotonic()
+        async for kind, value in _stream_bill(frames, str(user_id)):
+            if kind == 'field':
+                header[value[0]] = value[1]
+                if answered or not header.keys() >= HEADER_FIELDS:
+                    continue
+                result = {"status": "Reading the items", **header}
+            elif kind == 'item':
+                items.append(value)
+                if not answered or time.monotonic() - last_report < STREAM_REPORT_INTERVAL:
+                    continue
+                result = {"status": "Reading the items", "items": items[reported:]}
+                reported = len(items)
+            else:
+                bill, digest = value
+                continue
+            if not answered:
+                EXTRACTION_FIRST_RESULT.observe(time.perf_counter() - started)
+                answered = True
+            last_report = time.monotonic()
+            yield result
+
+        if not answered:
+            EXTRACTION_FIRST_RESULT.observe(time.perf_counter() - started)
+        if bill is None:
+            yield {"error": "Couldn't read a bill from the receipt. Ask the user to hold it steady and try again."}
+            return
+
+        # Saved once per set of frames the bill was read from, however often
+        # the tool is called on them; the cache hands back the same frames.
+        if user_id is not None:
+            try:
+                saved = await asyncio.to_thread(save_bill, user_id, bill, digest)
+            except Exception as e:
+                print(f"Saving the bill failed: {e}")
+                bill['status'] = "Not saved, saving the bill failed."
+            else:
+                if saved is None:
+                    bill['status'] = "Not saved, the user was not found."
+                else:
+                    tool_context.state['db_write_lsn'] = saved['lsn']
+                    bill['expense_id'] = saved['expense_id']
+                    if saved['created']:
+                        bill['status'] = "Saved as a new expense."
+                    else:
+                        bill['status'] = "This receipt was already saved; no new expense was added."
+        yield bill
@@ -1,9 +1,10 @@
-import os
+import asyncio
 from google.adk.agents import Agent
-import psycopg2
+from google.adk.tools import ToolContext
 from psycopg2 import OperationalError, ProgrammingError
+from services.database import run_statement
 
-def sql_tool(sql_statement: str):
+async def sql_tool(sql_statement: str, tool_context: ToolContext):
     """
     Connects to a PostgreSQL database, executes a single SQL statement,
     and returns the result and status.
@@ -17,7 +18,6 @@ def sql_tool(sql_statement: str):
               - 'error' (str or None): A description of the error if one occurred.
     """
 
-    conn = None
     response = {
         'status': 'error',
         'data': None,
@@ -25,30 +25,20 @@ def sql_tool(sql_statement: str):
     }
         
     try:
-        conn = psycopg2.connect(database=os.getenv('DB_NAME', 'notfound'), 
-                        user=os.getenv('DB_USER', 'notfound'), 
-                        password=os.getenv('DB_PASSWORD', 'notfound'), 
-                        host=os.getenv('DB_HOST', 'localhost'), 
-                        port=os.getenv('DB_PORT', 5432))
-        
-        with conn.cursor() as cur:
-            cur.execute(sql_statement)
-            if cur.description:
-                response['data'] = cur.fetchall()
-            else:
-                conn.commit()
+        # Read-only statements run on the replica, once it has caught up with
+        # this session's last write. In a thread: the query and the wait for
+        # the replica block, and this runs on the live sessions' event loop.
+        result = await asyncio.to_thread(run_statement, sql_statement, min_lsn=tool_context.state.get('db_write_lsn'))
+        if result['lsn']:
+            tool_context.state['db_write_lsn'] = result['lsn']
 
-            response['status'] = 'success'
+        response['data'] = result['data']
+        response['status'] = 'success'
 
     except (OperationalError, ProgrammingError) as e:
         response['error'] = f"Database Error: {e}"
-        if conn:
-            conn.rollback()
     except Exception as e:
         response['error'] = f"An unexpected error occurred: {e}"
-    finally:
-        if conn is not None:
-            conn.close()
             
     return response
 
@@ -1,18 +1,16 @@
 import os
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
 import json
+import hmac
 import base64
 import asyncio
 import uvicorn
+from typing import Union
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Depends, Header, HTTPException
 
 from google.adk.cli.fast_api import get_fast_api_app
-from google.adk.runners import Runner
-from google.adk.agents import LiveRequestQueue
 from google.adk.agents.run_config import RunConfig, StreamingMode
-from google.adk.sessions import DatabaseSessionService
 from google.genai.types import (
     Part,
     Content,
@@ -21,38 +19,93 @@ from google.genai.types import (
 )
 
 from agents.live_chat_agent import root_agent
-from services.sessions import init_session
+from services.sessions import init_session, start_session_cache, close_redis
+from services.database import close_pools
+from services.runner import init_runner, shutdown_runner, create_agent_session, get_agent_session, get_session_pool_metrics, session_db_url
+from services.frames import FrameStore, open_frame_store
+from services.live_sessions import LiveSession, get_live_session, register_live_session, close_live_sessions
+from services.live_registry import (
+    start_live_registry, stop_live_registry, claim_live_session, release_live_session,
+    send_control, broadcast_control, get_live_registry_metrics
+)
+from services.ws_protocol import AgentMessageSender, negotiate_protocol, decode_media_frame, BINARY_SUBPROTOCOL
+from services.ingest import BoundedLiveRequestQueue, register_ingest_queue, get_ingest_metrics
+from services.metrics import TurnTracker, ACTIVE_SESSIONS, SESSIONS, RESUMES, CONTENT_TYPE, record_inbound, render_metrics
+from fastapi.responses import PlainTextResponse
 from urllib.parse import parse_qs
 
-from agents.pic_extractor_agent import images
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await start_session_cache()
+    await init_runner(app, root_agent)
+    await start_live_registry()
     yield
+    await stop_live_registry()
+    close_live_sessions()
+    await shutdown_runner(app)
+    await close_redis()
+    close_pools()
 
 app = get_fast_api_app(
     agents_dir=f".", 
-    session_service_uri=f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+    session_service_uri=session_db_url(),
     web=False,
     port=8083,
     lifespan=lifespan)
 
 app.middleware("http")(init_session)
 
-async def start_agent_session(user_id: str):
-    """Starts an agent session"""
-    
-    runner = Runner(
-        app_name='raseed',
-        agent=root_agent,
-        session_service=DatabaseSessionService(f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}")
-    )
+@app.get("/metrics/agent-sessions")
+async def agent_session_metrics():
+    return get_session_pool_metrics(app)
 
-    session = await runner.session_service.create_session(
-        app_name='raseed',
-        user_id=user_id
-    )
-    session.state['user_id'] = user_id
+@app.get("/metrics/live-ingest")
+async def live_ingest_metrics():
+    return get_ingest_metrics()
+
+@app.get("/metrics/live-registry")
+async def live_registry_metrics():
+    return get_live_registry_metrics()
+
+# Shared secret for the live control endpoints, which reach every worker's
+# sessions. Without it set they are turned off.
+LIVE_CONTROL_TOKEN = os.getenv('LIVE_CONTROL_TOKEN')
+
+def require_control_token(authorization: Union[str, None] = Header(default=None)):
+    if not LIVE_CONTROL_TOKEN:
+        raise HTTPException(status_code=403, detail="Live control is disabled")
+    expected = f"Bearer {LIVE_CONTROL_TOKEN}"
+    if authorization is None or not hmac.compare_digest(authorization.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid live control token")
+
+@app.post("/live/control", dependencies=[Depends(require_control_token)])
+async def broadcast_live_control(message: dict = Body(...)):
+    """Sends a control message to every connected client, on every worker"""
+    return {"workers": await broadcast_control(message)}
+
+@app.post("/live/{session_id}/control", dependencies=[Depends(require_control_token)])
+async def send_live_control(session_id: str, message: dict = Body(...)):
+    """Sends a control message to the session's client, on whichever worker
+    it is connected to"""
+    return {"delivered": await send_control(session_id, message)}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(render_metrics(app), media_type=CONTENT_TYPE)
+
+async def start_agent_session(user_id: str, session_id: Union[str, None] = None) -> LiveSession:
+    """Starts an agent session, or a new live stream on the stored session
+    `session_id` when there is one"""
+
+    # Runner and session service are shared by every connection; only the
+    # session row is new.
+    runner = app.state.runner
+    session = await get_agent_session(app, user_id, session_id) if session_id else None
+    if session is None:
+        session = await create_agent_session(app, user_id)
+        SESSIONS.inc()
+    else:
+        RESUMES.labels(stream='restarted').inc()
 
     # Set response modality
     run_config = RunConfig(
@@ -61,8 +114,14 @@ async def start_agent_session(user_id: str):
         output_audio_transcription=AudioTranscriptionConfig()
     )
 
-    # Create a LiveRequestQueue for this session
-    live_request_queue = LiveRequestQueue()
+    # Create a LiveRequestQueue for this session, bounded so a slow model
+    # link can't make client media pile up, see services/ingest.py
+    live_request_queue = BoundedLiveRequestQueue()
+    register_ingest_queue(session.id, live_request_queue)
+
+    # With several workers, another one may still be running this session;
+    # it stops before this one starts, see services/live_registry.py
+    await claim_live_session(session.id)
 
     # Start agent session
     live_events = runner.run_live(
@@ -71,55 +130,77 @@ async def start_agent_session(user_id: str):
         live_request_queue=live_request_queue,
         run_config=run_config,
     )
-    return live_events, live_request_queue
+    live = LiveSession(session.id, user_id, live_events, live_request_queue, open_frame_store(session.id))
+    live.on_close = release_live_session
+    register_live_session(live)
+    # Outlives the connection, see services/live_sessions.py
+    live.pump = asyncio.create_task(agent_to_client_messaging(live))
+    return live
+
+
+
+async def send_agent_event(sender: AgentMessageSender, event, turns: TurnTracker):
+    """Sends one live event to the client"""
+
+    # If the turn complete or interrupted, send it
+    if event.turn_complete or event.interrupted:
+        # Audio not yet sent is for the speech that was cut off.
+        if event.interrupted:
+            await sender.discard_audio()
+        turns.turn_ended(interrupted=bool(event.interrupted))
+        message = {
+            "turn_complete": event.turn_complete,
+            "interrupted": event.interrupted,
+        }
+        await sender.send_message(message)
+        print(f"[AGENT TO CLIENT]: {message}")
+        return
+
+
+    # Read the Content and its first Part
+    part: Part = (
+        event.content and event.content.parts and event.content.parts[0]
+    )
+    if not part:
+        return
 
+    # If it's audio, send it as a binary frame, or Base64 encoded for
+    # JSON only clients
+    is_audio = part.inline_data and part.inline_data.mime_type.startswith("audio/pcm")
+    if is_audio:
+        audio_data = part.inline_data and part.inline_data.data
+        if audio_data:
+            turns.agent_audio()
+            await sender.send_audio(audio_data, part.inline_data.mime_type)
+            return
 
+    # If it's text and a parial text, send it
+    if part.text and event.partial:
+        message = {
+            "mime_type": "text/plain",
+            "data": part.text
+        }
+        await sender.send_message(message)
+        print(f"[AGENT TO CLIENT]: text/plain: {message}")
 
-async def agent_to_client_messaging(websocket, live_events):
-    """Agent to client communication"""
+async def agent_to_client_messaging(live: LiveSession):
+    """Agent to client communication, for as long as the session's live
+    stream runs, whichever connection is attached"""
     print("[AGENT TO CLIENT]: Starting task.")
     try:
-        async for event in live_events:
-
-            # If the turn complete or interrupted, send it
-            if event.turn_complete or event.interrupted:
-                message = {
-                    "turn_complete": event.turn_complete,
-                    "interrupted": event.interrupted,
-                }
-                await websocket.send_text(json.dumps(message))
-                print(f"[AGENT TO CLIENT]: {message}")
-                continue
-            
-
-            # Read the Content and its first Part
-            part: Part = (
-                event.content and event.content.parts and event.content.parts[0]
-            )
-            if not part:
+        async for event in live.live_events:
+            sender = live.sender
+            # Parked: nobody to send to until a client resumes the session.
+            if sender is None:
                 continue
-
-            # If it's audio, send Base64 encoded audio data
-            is_audio = part.inline_data and part.inline_data.mime_type.startswith("audio/pcm")
-            if is_audio:
-                audio_data = part.inline_data and part.inline_data.data
-                if audio_data:
-                    message = {
-                        "mime_type": "audio/pcm",
-                        "data": base64.b64encode(audio_data).decode("ascii")
-                    }
-                    await websocket.send_text(json.dumps(message))
-                    print(f"[AGENT TO CLIENT]: audio/pcm: {len(audio_data)} bytes.")
-                    continue
-
-            # If it's text and a parial text, send it
-            if part.text and event.partial:
-                message = {
-                    "mime_type": "text/plain",
-                    "data": part.text
-                }
-                await websocket.send_text(json.dumps(message))
-                print(f"[AGENT TO CLIENT]: text/plain: {message}")
+            try:
+                await send_agent_event(sender, event, live.turns)
+            except Exception as e:
+                # The connection went away mid-send; its reader notices and
+                # parks the session.
+                print(f"[AGENT TO CLIENT]: Send failed: {e}")
+        if live.sender is not None:
+            await live.sender.close()
         print("[AGENT TO CLIENT]: live_events stream finished.")
     except Exception as e:
         print(f"[AGENT TO CLIENT]: An error occurred: {e}")
@@ -127,29 +208,43 @@ async def agent_to_client_messaging(websocket, live_events):
         print("[AGENT TO CLIENT]: Task finished.")
 
 
-async def client_to_agent_messaging(websocket, live_request_queue: LiveRequestQueue):
+async def client_to_agent_messaging(websocket, live_request_queue: BoundedLiveRequestQueue, frame_store: FrameStore, turns: TurnTracker):
     """Client to agent communication"""
     print("[CLIENT TO AGENT]: Starting task.")
     try:
         while True:
-            # Decode JSON message
-            message_json = await websocket.receive_text()
-            message = json.loads(message_json)
-            mime_type = message["mime_type"]
-            data = message["data"]
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000))
+
+            if received.get("bytes") is not None:
+                # Binary media frame, see services/ws_protocol.py
+                mime_type, decoded_data = decode_media_frame(received["bytes"])
+                record_inbound(mime_type, len(received["bytes"]))
+            else:
+                # Decode JSON message
+                message = json.loads(received["text"])
+                mime_type = message["mime_type"]
+                data = message["data"]
+                decoded_data = None
+                record_inbound(mime_type, len(received["text"]))
 
             # Send the message to the agent
             if mime_type == "text/plain":
                 # Send a text message
                 content = Content(role="user", parts=[Part.from_text(text=data)])
                 live_request_queue.send_content(content=content)
+                turns.user_input(mime_type, data)
                 print(f"[CLIENT TO AGENT]: {data}")
-            elif mime_type == "audio/pcm" or mime_type == "image/jpeg":
-                decoded_data = base64.b64decode(data)
+            elif mime_type.startswith("audio/pcm") or mime_type == "image/jpeg":
+                if decoded_data is None:
+                    decoded_data = base64.b64decode(data)
                 if mime_type == "image/jpeg":
-                    images.append(decoded_data)
-                # Send an audio data
-                live_request_queue.send_realtime(Blob(data=decoded_data, mime_type=mime_type))
+                    frame_store.add(decoded_data)
+                else:
+                    turns.user_input(mime_type, decoded_data)
+                # Send the media; waits here while the audio backlog is full
+                await live_request_queue.put_realtime(Blob(data=decoded_data, mime_type=mime_type))
             else:
                 raise ValueError(f"Mime type not supported: {mime_type}")
     except WebSocketDisconnect:
@@ -159,44 +254,71 @@ async def client_to_agent_messaging(websocket, live_request_queue: LiveRequestQu
     finally:
         print("[CLIENT TO AGENT]: Task finished.")
 
+async def close_superseded(websocket: WebSocket):
+    try:
+        await websocket.close(code=4000, reason="Resumed on another connection")
+    except Exception as e:
+        print(f"Closing a superseded connection failed: {e}")
+
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, is_audio: str):
+async def websocket_endpoint(websocket: WebSocket, session_id: str, is_audio: str):
     """Client websocket endpoint"""
-    # Wait for client connection
-    await websocket.accept()
-    print(f"Client #test_session connected, audio mode: {is_audio}")
+    # Wait for client connection. Clients offering the binary subprotocol
+    # get audio as binary frames, see services/ws_protocol.py
+    subprotocol = negotiate_protocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    print(f"Client #{session_id} connected, audio mode: {is_audio}")
 
-    # Start agent session
-    live_events, live_request_queue = await start_agent_session("123")
+    # Resume the session the client was given on an earlier connection,
+    # see services/live_sessions.py, or start one
+    user_id = "123"
+    live = get_live_session(session_id, user_id)
+    if live is not None:
+        RESUMES.labels(stream='running').inc()
+    else:
+        live = await start_agent_session(user_id, session_id)
+        live.pump.add_done_callback(lambda task: live.close())
+    sender = AgentMessageSender(websocket, binary=subprotocol == BINARY_SUBPROTOCOL)
+    previous = live.attach(websocket, sender)
+    if previous is not None:
+        # The server hasn't noticed yet that the old connection is gone.
+        # Closed in the background: a dead peer may never answer.
+        asyncio.create_task(close_superseded(previous))
+    ACTIVE_SESSIONS.inc()
+    await sender.send_message({"session_id": live.session_id})
 
     # Start tasks
-    agent_to_client_task = asyncio.create_task(
-        agent_to_client_messaging(websocket, live_events)
-    )
     client_to_agent_task = asyncio.create_task(
-        client_to_agent_messaging(websocket, live_request_queue)
+        client_to_agent_messaging(websocket, live.live_request_queue, live.frame_store, live.turns)
     )
 
-    # Wait until the websocket is disconnected or an error occurs
+    # Wait until the websocket is disconnected, an error occurs or the live
+    # stream ends
     done, pending = await asyncio.wait(
-        [agent_to_client_task, client_to_agent_task],
+        [live.pump, client_to_agent_task],
         return_when=asyncio.FIRST_COMPLETED
     )
 
     for task in done:
-        if task.exception():
+        if task.cancelled():
+            # The session was closed under it, e.g. handed off to another
+            # worker
+            print("Task cancelled.")
+        elif task.exception():
             print(f"Task finished with exception: {task.exception()}")
         else:
             print("Task finished without exception.")
 
-    for task in pending:
-        task.cancel()
+    client_to_agent_task.cancel()
 
-    # Close LiveRequestQueue
-    live_request_queue.close()
+    # Park the session for the client to come back to, unless another
+    # connection has taken it over; it is closed once the live stream ends
+    # or nobody resumes it in time
+    live.detach(websocket)
+    ACTIVE_SESSIONS.dec()
 
     # Disconnected
-    print(f"Client #test_session disconnected")
+    print(f"Client #{session_id} disconnected. {sender.stats()}")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="localhost", port=8001)
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+Bytes on the wire and CPU per second of agent audio sent to the client, for
+the JSON protocol (base64 audio, one message per chunk, as before) and the
+binary one from services/ws_protocol.py, each with and without coalescing.
+
+Feeds AgentMessageSender the chunks the live API would stream, back to back,
+into a websocket that only counts what it is sent. Needs nothing running.
+Run from agents/:
+
+    python -m benchmarks.audio_out
+
+BENCH_AUDIO_SECONDS sets how much audio is sent, BENCH_CHUNK_MS the size of
+the model's chunks.
+"""
+import os
+import time
+import asyncio
+
+from services.ws_protocol import AgentMessageSender, COALESCE_MS, DEFAULT_SAMPLE_RATE, BYTES_PER_SAMPLE
+
+AUDIO_SECONDS = int(os.getenv('BENCH_AUDIO_SECONDS', 600))
+CHUNK_MS = int(os.getenv('BENCH_CHUNK_MS', 10))
+
+class CountingWebSocket:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_text(self, data: str):
+        self.frames += 1
+        self.bytes += len(data.encode())
+
+    async def send_bytes(self, data: bytes):
+        self.frames += 1
+        self.bytes += len(data)
+
+async def run(binary: bool, coalesce_ms: float) -> tuple[float, float, float]:
+    """
+    Returns frames, bytes and CPU milliseconds per second of audio.
+    """
+    chunk = os.urandom(DEFAULT_SAMPLE_RATE * BYTES_PER_SAMPLE * CHUNK_MS // 1000)
+    chunks = AUDIO_SECONDS * 1000 // CHUNK_MS
+    websocket = CountingWebSocket()
+    sender = AgentMessageSender(websocket, binary=binary, coalesce_ms=coalesce_ms)
+    started = time.process_time()
+    for _ in range(chunks):
+        await sender.send_audio(chunk, f'audio/pcm;rate={DEFAULT_SAMPLE_RATE}')
+    await sender.close()
+    cpu = time.process_time() - started
+    return websocket.frames / AUDIO_SECONDS, websocket.bytes / AUDIO_SECONDS, 1000 * cpu / AUDIO_SECONDS
+
+async def main():
+    pcm = DEFAULT_SAMPLE_RATE * BYTES_PER_SAMPLE
+    print(f"{AUDIO_SECONDS}s of audio in {CHUNK_MS} ms chunks, {pcm} bytes of PCM per second")
+    print(f"{'':28}{'frames/s':>10}{'bytes/s':>10}{'overhead':>10}{'cpu ms/s':>10}")
+    for name, binary, coalesce_ms in (('json, per chunk (before)', False, 0),
+                                      (f'json, {COALESCE_MS:g} ms coalescing', False, COALESCE_MS),
+                                      ('binary, per chunk', True, 0),
+                                      (f'binary, {COALESCE_MS:g} ms coalescing', True, COALESCE_MS)):
+        frames, sent, cpu = await run(binary, coalesce_ms)
+        print(f"{name:28}{frames:>10.1f}{sent:>10.0f}{sent / pcm - 1:>10.1%}{cpu:>10.3f}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
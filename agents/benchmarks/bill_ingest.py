@@ -0,0 +1,145 @@
+"""
+Time and statements to save an extracted bill: the expense, share, receipt
+and then one INSERT per item, against services.database.save_bill(), which
+sends all of it as one statement.
+
+Needs a Postgres with the backend migrations applied, reached with the usual
+DB_* settings, and an existing user BENCH_USER_ID with a personal group. The
+bills it saves are deleted again at the end. Run from agents/:
+
+    python -m benchmarks.bill_ingest
+
+BENCH_ITEMS sets the line items per bill and BENCH_BILLS how many are saved
+each way.
+"""
+import os
+import time
+import uuid
+import statistics
+
+from services.database import save_bill, _get_pool, _bill_date
+
+USER_ID = int(os.getenv('BENCH_USER_ID', 1))
+ITEMS = int(os.getenv('BENCH_ITEMS', 120))
+BILLS = int(os.getenv('BENCH_BILLS', 50))
+
+def make_bill() -> dict:
+    return {
+        'Amount': 4321.5,
+        'expense_date': '2026-03-14',
+        'location': 'RASEED MART',
+        'item_list': [
+            {'name': f'Item {i}', 'quantity': 1 + i % 3, 'unit_price': 12.5, 'total_price': 0, 'item_type': 'groceries'}
+            for i in range(ITEMS)
+        ],
+    }
+
+def save_row_by_row(bill: dict, content_hash: str) -> int:
+    """
+    The statement per row way, as the sqlite tools write expenses. Returns
+    the number of statements sent.
+    """
+    pool = _get_pool('primary')
+    conn = pool.getconn()
+    statements = 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT expense_id FROM expense_receipts WHERE content_hash = %s", (content_hash,))
+            statements += 1
+            cur.execute(
+                """
+                INSERT INTO expenses (group_id, payer_id, amount, description, expense_date, location)
+                SELECT personal_group_id, user_id, %s, %s, %s, %s FROM users WHERE user_id = %s
+                RETURNING expense_id, expense_date
+                """,
+                (bill['Amount'], 'Receipt', _bill_date(bill['expense_date']), bill['location'], USER_ID),
+            )
+            expense_id, expense_date = cur.fetchone()
+            cur.execute(
+                "INSERT INTO expense_shares (expense_id, user_id, share_amount, expense_date) VALUES (%s, %s, %s, %s)",
+                (expense_id, USER_ID, bill['Amount'], expense_date),
+            )
+            cur.execute(
+                """
+                INSERT INTO expense_receipts (expense_id, url, bought_at, expense_date, content_hash)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (expense_id, f'sha256:{content_hash}', expense_date, expense_date, content_hash),
+            )
+            statements += 3
+            for item in bill['item_list']:
+                cur.execute(
+                    """
+                    INSERT INTO expense_items (expense_id, name, quantity, unit_price, category, expense_date)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    """,
+                    (expense_id, item['name'], item['quantity'], item['unit_price'], item['item_type'], expense_date),
+                )
+                statements += 1
+        conn.commit()
+        return statements + 1
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+
+def clean_up(prefix: str):
+    pool = _get_pool('primary')
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                WITH receipts AS (
+                    DELETE FROM expense_receipts WHERE content_hash LIKE %s RETURNING expense_id
+                ), items AS (
+                    DELETE FROM expense_items WHERE expense_id IN (SELECT expense_id FROM receipts)
+                ), shares AS (
+                    DELETE FROM expense_shares WHERE expense_id IN (SELECT expense_id FROM receipts)
+                )
+                SELECT expense_id FROM receipts
+                """,
+                (prefix + '%',),
+            )
+            expense_ids = [row[0] for row in cur.fetchall()]
+            cur.execute("DELETE FROM expenses WHERE expense_id = ANY(%s)", (expense_ids,))
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+
+def main():
+    prefix = f'bench:{uuid.uuid4().hex}:'
+    bill = make_bill()
+    try:
+        row_timings, statements = [], 0
+        for index in range(BILLS):
+            started = time.perf_counter()
+            statements = save_row_by_row(bill, f'{prefix}rows:{index}')
+            row_timings.append(1000 * (time.perf_counter() - started))
+
+        bill_timings = []
+        for index in range(BILLS):
+            started = time.perf_counter()
+            save_bill(USER_ID, bill, f'{prefix}bill:{index}')
+            bill_timings.append(1000 * (time.perf_counter() - started))
+
+        repeat_timings = []
+        for index in range(BILLS):
+            started = time.perf_counter()
+            save_bill(USER_ID, bill, f'{prefix}bill:{index}')
+            repeat_timings.append(1000 * (time.perf_counter() - started))
+    finally:
+        clean_up(prefix)
+
+    print(f"{BILLS} bills of {ITEMS} items")
+    print(f"{'':28}{'statements':>12}{'median ms':>11}{'p95 ms':>9}")
+    for name, count, timings in [
+        ('statement per row', statements, row_timings),
+        ('save_bill', 2, bill_timings),
+        ('save_bill, already saved', 2, repeat_timings),
+    ]:
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{name:28}{count:>12}{statistics.median(timings):>11.2f}{p95:>9.2f}")
+    print("save_bill's two: the bill, which commits itself, and the WAL position for read-your-writes")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+LLM scoring calls and selection latency per receipt: every frame scored one
+after another (the loop process_live_receipt used to have) against the local
+prefilter plus concurrent scoring of the top K (services/frame_selection.py).
+
+Uses synthetic camera frames of a receipt, sharp, blurred, underexposed and
+near duplicates, and a stand-in scorer that takes BENCH_SCORE_MS like a
+pic_selector round trip. Needs numpy and Pillow. Run from agents/:
+
+    python -m benchmarks.frame_selection
+
+BENCH_FRAMES sets how many frames the receipt was shown for.
+"""
+import io
+import os
+import time
+import random
+import asyncio
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+from services.frame_selection import prefilter_frames, select_frames, SCORE_TOP_K
+
+FRAMES = int(os.getenv('BENCH_FRAMES', 30))
+SCORE_MS = int(os.getenv('BENCH_SCORE_MS', 800))
+
+def receipt_frame(rng: random.Random, kind: str) -> bytes:
+    image = Image.new('L', (1280, 720), 90)
+    draw = ImageDraw.Draw(image)
+    # The receipt moves around as the camera is held up to it.
+    left, top = 440 + rng.randint(-120, 120), 40 + rng.randint(-30, 30)
+    draw.rectangle([left, top, left + 400, top + 640], fill=245)
+    for line in range(28):
+        y = top + 30 + line * 21
+        draw.text((left + 20, y), f"ITEM {line:02d}  x{line % 4 + 1}   {line * 3.15:8.2f}", fill=20)
+    if kind == 'blurred':
+        image = image.filter(ImageFilter.GaussianBlur(4))
+    elif kind == 'dark':
+        image = ImageEnhance.Brightness(image).enhance(0.12)
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+scoring_calls = 0
+
+async def fake_score(data: bytes) -> int:
+    global scoring_calls
+    scoring_calls += 1
+    await asyncio.sleep(SCORE_MS / 1000)
+    return 60 + len(data) % 40
+
+async def sequential(frames: list[bytes]) -> list[int]:
+    return [await fake_score(data) for data in frames]
+
+async def main():
+    global scoring_calls
+    rng = random.Random(7)
+    kinds = [rng.choice(('sharp', 'sharp', 'blurred', 'blurred', 'dark')) for _ in range(FRAMES)]
+    frames = [receipt_frame(rng, kind) for kind in kinds]
+    print(f"{FRAMES} frames: " + ', '.join(f"{kinds.count(k)} {k}" for k in ('sharp', 'blurred', 'dark')))
+
+    started = time.perf_counter()
+    await sequential(frames)
+    before = time.perf_counter() - started
+    before_calls, scoring_calls = scoring_calls, 0
+
+    started = time.perf_counter()
+    candidates = prefilter_frames(frames)
+    prefilter_ms = 1000 * (time.perf_counter() - started)
+    started = time.perf_counter()
+    selected = await select_frames(frames, fake_score)
+    after = time.perf_counter() - started
+
+    print(f"{'':30}{'scoring calls':>15}{'latency s':>11}")
+    print(f"{'every frame, one by one':30}{before_calls:>15}{before:>11.2f}")
+    print(f"{f'prefilter + top {SCORE_TOP_K} at once':30}{scoring_calls:>15}{after:>11.2f}")
+    print(f"prefilter: {prefilter_ms:.1f} ms for {FRAMES} frames, kept {[kinds[i] for i in candidates]}, "
+          f"{len(selected)} frame(s) to extraction")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+Upload bytes and model image tokens per receipt frame, raw against
+preprocessed (services/receipt_preprocess.py), plus the preprocessing time.
+
+Runs on the JPEGs in BENCH_RECEIPTS_DIR when set. Otherwise it generates a
+fixed fixture set: receipts photographed at 720p, 1080p and portrait phone
+resolution, tilted up to 12 degrees, on a textured background. Tokens follow
+Gemini's image accounting: 258 per 768x768 tile, or 258 in all for
+images within 384x384.
+Needs numpy and Pillow; nothing is sent to a model. Run from agents/:
+
+    python -m benchmarks.receipt_preprocess
+"""
+import io
+import os
+import math
+import time
+import random
+import statistics
+from PIL import Image, ImageDraw, ImageFilter
+
+from services.receipt_preprocess import _preprocess
+
+RECEIPTS_DIR = os.getenv('BENCH_RECEIPTS_DIR')
+FIXTURES = int(os.getenv('BENCH_FIXTURES', 12))
+
+def image_tokens(width: int, height: int) -> int:
+    if width <= 384 and height <= 384:
+        return 258
+    return math.ceil(width / 768) * math.ceil(height / 768) * 258
+
+def fixture(rng: random.Random, size: tuple[int, int], tilt: float) -> bytes:
+    width, height = size
+    background = Image.effect_noise(size, 40).filter(ImageFilter.GaussianBlur(2))
+    background = Image.merge('RGB', [background.point(lambda v, o=o: min(255, v // 2 + o)) for o in (60, 45, 30)])
+
+    receipt_height = int(height * rng.uniform(0.7, 0.85))
+    receipt = Image.new('RGB', (int(receipt_height * 0.42), receipt_height), (242, 240, 232))
+    draw = ImageDraw.Draw(receipt)
+    line_height = receipt_height // 40
+    draw.text((20, 10), "RASEED MART  #0421", fill=(30, 30, 30))
+    for line in range(1, 36):
+        draw.text((20, 10 + line * line_height),
+                  f"{rng.choice(['MILK', 'BREAD', 'EGGS', 'RICE', 'SOAP', 'TEA'])} x{rng.randint(1, 4)}"
+                  f"   {rng.uniform(0.5, 40):7.2f}", fill=(30, 30, 30))
+    paper_mask = Image.new('L', receipt.size, 255).rotate(tilt, resample=Image.Resampling.BICUBIC, expand=True)
+    receipt = receipt.rotate(tilt, resample=Image.Resampling.BICUBIC, expand=True)
+    left = (width - receipt.width) // 2 + rng.randint(-width // 10, width // 10)
+    top = (height - receipt.height) // 2
+    background.paste(receipt, (left, top), paper_mask)
+
+    out = io.BytesIO()
+    background.save(out, 'JPEG', quality=92)
+    return out.getvalue()
+
+def load_frames() -> list[tuple[str, bytes]]:
+    if RECEIPTS_DIR:
+        names = sorted(name for name in os.listdir(RECEIPTS_DIR) if name.lower().endswith(('.jpg', '.jpeg')))
+        return [(name, open(os.path.join(RECEIPTS_DIR, name), 'rb').read()) for name in names]
+    rng = random.Random(11)
+    sizes = [(1280, 720), (1920, 1080), (1080, 1920)]
+    frames = []
+    for index in range(FIXTURES):
+        size = sizes[index % len(sizes)]
+        tilt = rng.uniform(-12, 12)
+        frames.append((f"{size[0]}x{size[1]} tilt {tilt:+.1f}", fixture(rng, size, tilt)))
+    return frames
+
+def main():
+    frames = load_frames()
+    totals = {'raw_bytes': 0, 'bytes': 0, 'raw_tokens': 0, 'tokens': 0}
+    timings = []
+    print(f"{'frame':26}{'raw KB':>8}{'KB':>7}{'raw tok':>9}{'tok':>6}{'size':>11}{'ms':>7}")
+    for name, data in frames:
+        started = time.perf_counter()
+        processed = _preprocess(data)
+        timings.append(1000 * (time.perf_counter() - started))
+        raw_size = Image.open(io.BytesIO(data)).size
+        size = Image.open(io.BytesIO(processed)).size
+        raw_tokens, tokens = image_tokens(*raw_size), image_tokens(*size)
+        totals['raw_bytes'] += len(data)
+        totals['bytes'] += len(processed)
+        totals['raw_tokens'] += raw_tokens
+        totals['tokens'] += tokens
+        print(f"{name:26}{len(data) / 1024:>8.0f}{len(processed) / 1024:>7.0f}{raw_tokens:>9}{tokens:>6}"
+              f"{f'{size[0]}x{size[1]}':>11}{timings[-1]:>7.1f}")
+
+    print(f"{len(frames)} frames: bytes {totals['bytes'] / totals['raw_bytes']:.0%} of raw, "
+          f"tokens {totals['tokens'] / totals['raw_tokens']:.0%} of raw, "
+          f"median {statistics.median(timings):.1f} ms per frame")
+
+if __name__ == '__main__':
+    main()
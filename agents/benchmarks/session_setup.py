@@ -0,0 +1,80 @@
+"""
+Time and Postgres connections needed to start live agent sessions, before
+(a Runner and DatabaseSessionService built for every websocket connection)
+and after (the shared runner from services/runner.py).
+
+Needs the agents' DB_* settings pointing at a Postgres the ADK session tables
+can be created in. Run from agents/:
+
+    python -m benchmarks.session_setup
+
+BENCH_SESSIONS sets how many sessions each variant starts.
+"""
+import os
+import time
+import asyncio
+import statistics
+import psycopg2
+from fastapi import FastAPI
+from google.adk.runners import Runner
+from google.adk.sessions import DatabaseSessionService
+
+from agents.live_chat_agent import root_agent
+from services.runner import APP_NAME, init_runner, shutdown_runner, create_agent_session, get_session_pool_metrics, session_db_url
+
+SESSIONS = int(os.getenv('BENCH_SESSIONS', 50))
+
+def server_connections() -> int:
+    conn = psycopg2.connect(session_db_url())
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid != pg_backend_pid()"
+            )
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+async def legacy_sessions() -> tuple[list[float], int]:
+    # What start_agent_session used to do on every connection. The services
+    # stay referenced, as they are while their websocket is open.
+    services, timings = [], []
+    for i in range(SESSIONS):
+        started = time.perf_counter()
+        service = DatabaseSessionService(session_db_url())
+        runner = Runner(app_name=APP_NAME, agent=root_agent, session_service=service)
+        await runner.session_service.create_session(app_name=APP_NAME, user_id=f'bench-{i}')
+        timings.append(1000 * (time.perf_counter() - started))
+        services.append(service)
+    connections = server_connections()
+    for service in services:
+        service.db_engine.dispose()
+    return timings, connections
+
+async def shared_sessions() -> tuple[list[float], int, dict]:
+    app = FastAPI()
+    await init_runner(app, root_agent)
+    timings = []
+    try:
+        for i in range(SESSIONS):
+            started = time.perf_counter()
+            await create_agent_session(app, f'bench-{i}')
+            timings.append(1000 * (time.perf_counter() - started))
+        return timings, server_connections(), get_session_pool_metrics(app)
+    finally:
+        await shutdown_runner(app)
+
+async def main():
+    baseline = server_connections()
+    before, before_connections = await legacy_sessions()
+    after, after_connections, pool = await shared_sessions()
+
+    print(f"{SESSIONS} sessions started one after another")
+    print(f"{'':22}{'median ms':>11}{'max ms':>9}{'connections':>13}")
+    for name, timings, connections in (('service per session', before, before_connections),
+                                       ('shared service', after, after_connections)):
+        print(f"{name:22}{statistics.median(timings):>11.2f}{max(timings):>9.2f}{connections - baseline:>13}")
+    print(f"shared pool: {pool}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
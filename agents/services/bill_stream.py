@@ -0,0 +1,114 @@
+"""
+Incremental parser for the Bill JSON the extraction model streams.
+
+The model writes the bill as one JSON object, a few tokens at a time. feed()
+takes each piece of text as it arrives and returns what it completed:
+
+- ('field', (name, value)) for a top level field (Amount, expense_date,
+  location), once its value is whole
+- ('item', item) for each element of item_list, once its closing brace is in
+
+so the header can be used while the line items are still being written, and
+each item as soon as it is. Values are only ever handed out whole, decoded
+with json.loads; nothing is guessed from a partial value.
+
+Each character is scanned once, whatever size the pieces come in, and the
+only state kept besides the text is the stack of open brackets. Text before
+the opening brace (a markdown fence, say) and after the closing one is
+ignored.
+"""
+import json
+from typing import Any, Union
+
+ITEMS_KEY = 'item_list'
+
+class _Container:
+    __slots__ = ('kind', 'key', 'expecting_key', 'value_start')
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        # The key of the value being read, in an object.
+        self.key: Union[str, None] = None
+        self.expecting_key = kind == '{'
+        # Where the value being read starts in the text, if one is.
+        self.value_start: Union[int, None] = None
+
+class BillStreamParser:
+    def __init__(self, items_key: str = ITEMS_KEY):
+        self.items_key = items_key
+        self.text = ''
+        self.done = False
+        self._stack: list[_Container] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._string_is_key = False
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        events: list[tuple[str, Any]] = []
+        start = len(self.text)
+        self.text += chunk
+        text = self.text
+        for index in range(start, len(text)):
+            if self.done:
+                break
+            char = text[index]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    container = self._stack[-1]
+                    if self._string_is_key:
+                        container.key = json.loads(text[self._string_start:index + 1])
+                    elif container.value_start == self._string_start:
+                        self._complete(index + 1, events)
+                continue
+
+            if not self._stack:
+                if char == '{':
+                    self._stack.append(_Container('{'))
+                continue
+
+            container = self._stack[-1]
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+                self._string_is_key = container.expecting_key
+                if not self._string_is_key:
+                    container.value_start = index
+            elif char in '{[':
+                container.value_start = index
+                self._stack.append(_Container(char))
+            elif char in '}]':
+                # A number or literal runs up to the bracket.
+                if container.value_start is not None:
+                    self._complete(index, events)
+                self._stack.pop()
+                if self._stack:
+                    self._complete(index + 1, events)
+                else:
+                    self.done = True
+            elif char == ',':
+                if container.value_start is not None:
+                    self._complete(index, events)
+                container.expecting_key = container.kind == '{'
+            elif char == ':':
+                container.expecting_key = False
+            elif not char.isspace() and container.value_start is None:
+                # First character of a number or true / false / null.
+                container.value_start = index
+        return events
+
+    def _complete(self, end: int, events: list[tuple[str, Any]]):
+        container = self._stack[-1]
+        value = json.loads(self.text[container.value_start:end])
+        container.value_start = None
+        depth = len(self._stack)
+        if depth == 1 and container.key != self.items_key:
+            events.append(('field', (container.key, value)))
+        elif depth == 2 and container.kind == '[' and self._stack[0].key == self.items_key:
+            events.append(('item', value))
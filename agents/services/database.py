@@ -0,0 +1,311 @@
+"""
+Postgres connections for the agent tools.
+
+Statements go through one of two process wide pools: the primary, for
+anything that writes, and the read replica (DB_REPLICA_HOST) for read-only
+statements, above all the analytical SELECTs the text-to-SQL agent writes.
+Those can scan a lot of history and should never hold a primary connection
+while expenses and splits are being written. Without DB_REPLICA_HOST both
+kinds go to the primary.
+
+Read-your-writes: after a write commits, run_statement() returns the primary's
+WAL position. The caller keeps it with the session (tool_context.state) and
+passes it back as `min_lsn`; a read then uses the replica only once it has
+replayed that far, waiting up to DB_REPLICA_MAX_WAIT_MS, and otherwise reads
+from the primary.
+
+Everything here blocks, the replica wait included; from the agents' event
+loop call it through asyncio.to_thread. A pool with all its connections out
+makes the caller wait up to DB_POOL_TIMEOUT seconds for one.
+"""
+import os
+import re
+import time
+import threading
+from datetime import date, datetime
+from typing import Union
+from psycopg2.errors import UniqueViolation
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from psycopg2.extensions import connection
+from dotenv import load_dotenv
+load_dotenv()
+
+REPLICA_MAX_WAIT = float(os.getenv('DB_REPLICA_MAX_WAIT_MS', 200)) / 1000
+REPLICA_POLL_INTERVAL = 0.01
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+
+# Bounds the agent's analytical queries. On a replica a long query also holds
+# back WAL replay (max_standby_streaming_delay), so keep it short.
+READ_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_READ_STATEMENT_TIMEOUT_MS', 15000))
+
+# Whether this server has everything up to a given WAL position. On the
+# primary pg_last_wal_replay_lsn() is NULL and its own position is used.
+REPLAYED_UP_TO = "SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn()) >= %s::pg_lsn"
+
+# Writes a bill extracted from receipt images in one statement: the expense,
+# in the user's personal group, their share of it, the receipt row and every
+# item, the items sent as parallel arrays and unnested, so a receipt with a
+# hundred lines is still one statement. A content hash saved before returns
+# that expense instead. Foreign keys between the new rows are checked at the
+# end of the statement, once all of them exist.
+SAVE_BILL = """
+    WITH existing AS (
+        SELECT expense_id
+        FROM expense_receipts
+        WHERE content_hash = %(content_hash)s
+    ), new_expense AS (
+        INSERT INTO expenses (group_id, payer_id, amount, description, expense_date, location)
+        SELECT personal_group_id, user_id, %(amount)s, %(description)s, %(expense_date)s, %(location)s
+        FROM users
+        WHERE user_id = %(user_id)s
+          AND NOT EXISTS (SELECT 1 FROM existing)
+        RETURNING expense_id, payer_id, amount, expense_date
+    ), new_share AS (
+        INSERT INTO expense_shares (expense_id, user_id, share_amount, expense_date)
+        SELECT expense_id, payer_id, amount, expense_date
+        FROM new_expense
+    ), new_receipt AS (
+        INSERT INTO expense_receipts (expense_id, url, bought_at, expense_date, content_hash)
+        SELECT expense_id, %(url)s, expense_date, expense_date, %(content_hash)s
+        FROM new_expense
+    ), new_items AS (
+        INSERT INTO expense_items (expense_id, name, quantity, unit_price, category, expense_date)
+        SELECT e.expense_id, i.name, i.quantity, i.unit_price, i.category, e.expense_date
+        FROM new_expense e,
+             unnest(%(names)s::text[], %(quantities)s::numeric[], %(unit_prices)s::numeric[], %(categories)s::text[])
+                 AS i (name, quantity, unit_price, category)
+    )
+    SELECT expense_id, false AS created FROM existing
+    UNION ALL
+    SELECT expense_id, true AS created FROM new_expense
+"""
+
+# Dates as receipts print them, tried after ISO 8601.
+BILL_DATE_FORMATS = ['%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y', '%d %b %Y', '%d %B %Y']
+
+READ_ONLY_START = re.compile(r'^\s*(SELECT|WITH|VALUES|TABLE|SHOW|EXPLAIN)\b', re.IGNORECASE)
+# Anything that could make a read-only looking statement write or lock:
+# data modifying CTEs, SELECT ... INTO, SELECT ... FOR UPDATE / SHARE.
+WRITE_KEYWORDS = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|MERGE|INTO|FOR\s+(NO\s+KEY\s+)?UPDATE|FOR\s+(KEY\s+)?SHARE)\b',
+    re.IGNORECASE,
+)
+
+def is_read_only(sql_statement: str) -> bool:
+    """
+    Whether the statement is safe to send to a replica. Errs on the side of
+    the primary: a read classified as a write still runs, just not offloaded.
+    """
+    code = re.sub(r'--[^\n]*|/\*.*?\*/', ' ', sql_statement, flags=re.DOTALL)
+    code = re.sub(r"'(?:[^']|'')*'", "''", code)
+    return bool(READ_ONLY_START.match(code)) and not WRITE_KEYWORDS.search(code)
+
+def _connection_kwargs(replica: bool = False) -> dict:
+    kwargs = dict(
+        database=os.getenv('DB_NAME', 'notfound'),
+        user=os.getenv('DB_USER', 'notfound'),
+        password=os.getenv('DB_PASSWORD', 'notfound'),
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=os.getenv('DB_PORT', 5432),
+    )
+    if replica:
+        kwargs.update(
+            database=os.getenv('DB_REPLICA_NAME', kwargs['database']),
+            host=os.getenv('DB_REPLICA_HOST'),
+            port=os.getenv('DB_REPLICA_PORT', kwargs['port']),
+        )
+    return kwargs
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that waits up to `timeout` seconds for a
+    connection to be returned when all of them are out, instead of raising
+    PoolError straight away.
+    """
+    def __init__(self, minconn: int, maxconn: int, *args, timeout: float = POOL_TIMEOUT, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None) -> connection:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"no connection free within {self.timeout} s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
+_pools: dict[str, BlockingConnectionPool] = dict()
+_pools_lock = threading.Lock()
+
+def _get_pool(name: str) -> BlockingConnectionPool:
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                prefix = 'DB_REPLICA_POOL' if name == 'replica' else 'DB_POOL'
+                pool = BlockingConnectionPool(
+                    int(os.getenv(f'{prefix}_MIN_SIZE', 1)),
+                    int(os.getenv(f'{prefix}_MAX_SIZE', 10)),
+                    **_connection_kwargs(replica=name == 'replica'),
+                )
+                _pools[name] = pool
+    return pool
+
+def has_replica() -> bool:
+    return bool(os.getenv('DB_REPLICA_HOST'))
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+
+def _replica_caught_up(conn: connection, min_lsn: str) -> bool:
+    deadline = time.monotonic() + REPLICA_MAX_WAIT
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(REPLAYED_UP_TO, (min_lsn,))
+            caught_up = cur.fetchone()[0]
+        # End the snapshot so the next poll, and the read, see new data.
+        conn.rollback()
+        if caught_up or time.monotonic() >= deadline:
+            return caught_up
+        time.sleep(REPLICA_POLL_INTERVAL)
+
+def _fetch(conn: connection, sql_statement: str) -> Union[list, None]:
+    with conn.cursor() as cur:
+        cur.execute(f"SET LOCAL statement_timeout = {READ_STATEMENT_TIMEOUT_MS}")
+        cur.execute(sql_statement)
+        return cur.fetchall() if cur.description else None
+
+def _run_read(name: str, sql_statement: str, min_lsn: Union[str, None]) -> Union[tuple[list, str], None]:
+    """
+    Runs a read on the named pool in a read-only transaction. Returns None
+    without running it when `name` is the replica and it is behind `min_lsn`.
+    """
+    pool = _get_pool(name)
+    conn = pool.getconn()
+    try:
+        if name == 'replica' and min_lsn and not _replica_caught_up(conn, min_lsn):
+            return None
+        conn.set_session(readonly=True)
+        return _fetch(conn, sql_statement), name
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            conn.set_session(readonly=False)
+        pool.putconn(conn, close=bool(conn.closed))
+
+def run_statement(sql_statement: str, min_lsn: Union[str, None] = None) -> dict:
+    """
+    Runs one statement, routed by is_read_only().
+
+    Returns:
+      dict with 'data' (rows, or None for statements without a result),
+      'server' ('replica' or 'primary') and, after a write, 'lsn': the WAL
+      position to pass back as `min_lsn` on the session's next read.
+    """
+    if is_read_only(sql_statement):
+        if has_replica():
+            result = _run_read('replica', sql_statement, min_lsn)
+            if result is not None:
+                return {'data': result[0], 'server': result[1], 'lsn': None}
+        data, server = _run_read('primary', sql_statement, None)
+        return {'data': data, 'server': server, 'lsn': None}
+
+    pool = _get_pool('primary')
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql_statement)
+            data = cur.fetchall() if cur.description else None
+        conn.commit()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_current_wal_lsn()::text")
+            lsn = cur.fetchone()[0]
+        return {'data': data, 'server': 'primary', 'lsn': lsn}
+    finally:
+        if not conn.closed:
+            conn.rollback()
+        pool.putconn(conn, close=bool(conn.closed))
+
+def _bill_date(value: str) -> date:
+    """
+    The purchase date printed on the receipt, or today when it can't be read.
+    """
+    value = (value or '').strip()
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    for format in BILL_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, format).date()
+        except ValueError:
+            continue
+    return date.today()
+
+def save_bill(user_id: int, bill: dict, content_hash: str, url: Union[str, None] = None) -> Union[dict, None]:
+    """
+    Saves a bill extracted by process_live_receipt as an expense the user
+    paid in their personal group, with its items and receipt, in a single
+    statement that commits itself. Idempotent on `content_hash`, the digest
+    of the images the bill was read from: two receipts alike down to the
+    amount are still two expenses, one receipt saved twice is one.
+
+    Two round trips: the statement, then the WAL position after its commit.
+    A position read within the statement would come before the commit
+    record, and a replica that had replayed just that far would not show the
+    bill yet.
+
+    Returns:
+      dict with 'expense_id', whether it was 'created' by this call and
+      'lsn', the WAL position to pass back as `min_lsn` on the session's next
+      read; None when there is no such user.
+    """
+    items = bill.get('item_list') or []
+    location = bill.get('location') or None
+    params = {
+        'user_id': user_id,
+        'content_hash': content_hash,
+        # The frames themselves are not kept; the receipt names them by hash.
+        'url': url or f'sha256:{content_hash}',
+        'amount': bill['Amount'],
+        'description': f'Receipt from {location}' if location else 'Receipt',
+        'expense_date': _bill_date(bill.get('expense_date')),
+        'location': location,
+        'names': [item['name'] for item in items],
+        'quantities': [item['quantity'] for item in items],
+        'unit_prices': [item['unit_price'] for item in items],
+        'categories': [item.get('item_type') for item in items],
+    }
+
+    pool = _get_pool('primary')
+    conn = pool.getconn()
+    # The statement is its own transaction, without a separate COMMIT.
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(SAVE_BILL, params)
+            except UniqueViolation:
+                # Lost a race with a concurrent save of the same receipt; it
+                # has committed by now, so this finds its expense.
+                cur.execute(SAVE_BILL, params)
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute("SELECT pg_current_wal_lsn()::text")
+            lsn = cur.fetchone()[0]
+        return {'expense_id': row[0], 'created': row[1], 'lsn': lsn}
+    finally:
+        if not conn.closed:
+            conn.autocommit = False
+        pool.putconn(conn, close=bool(conn.closed))
@@ -0,0 +1,125 @@
+"""
+Cache of bill extraction results, keyed by the frames they came from.
+
+A key is the prompt version plus a SHA-256 over the frames' normalized JPEG
+bytes: metadata segments (APPn, COM) are left out, so the same image with
+different EXIF still hits, and frames are hashed in sorted order, so the
+order they were picked in does not matter. The prompt version changes
+whenever the extraction prompt, model or Bill schema do, which retires old
+entries without a flush.
+
+Entries live in a per-process LRU (EXTRACTION_CACHE_SIZE entries, each for
+EXTRACTION_CACHE_TTL seconds). With EXTRACTION_CACHE_BACKEND=redis they are
+also written to Redis, so every worker shares them; Redis failures only cost
+the cache, never the extraction.
+"""
+import os
+import time
+import hashlib
+from typing import Union
+from collections import OrderedDict
+
+from services.sessions import get_redis
+
+CACHE_BACKEND = os.getenv('EXTRACTION_CACHE_BACKEND', 'memory')
+CACHE_SIZE = int(os.getenv('EXTRACTION_CACHE_SIZE', 1000))
+CACHE_TTL = int(os.getenv('EXTRACTION_CACHE_TTL', 24 * 3600))
+KEY_PREFIX = 'extraction'
+
+def _jpeg_payload(data: bytes) -> list[bytes]:
+    """
+    The JPEG's segments without APPn and COM, i.e. what decodes to pixels.
+    Anything that does not parse as a JPEG is returned whole.
+    """
+    if data[:2] != b'\xff\xd8':
+        return [data]
+    parts = []
+    position = 2
+    while position + 4 <= len(data) and data[position] == 0xFF:
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker.
+            position += 1
+            continue
+        if marker == 0xDA:
+            # Start of scan: entropy coded data runs to the end.
+            parts.append(data[position:])
+            return parts
+        length = int.from_bytes(data[position + 2:position + 4], 'big')
+        if not (0xE0 <= marker <= 0xEF or marker == 0xFE):
+            parts.append(data[position:position + 2 + length])
+        position += 2 + length
+    return [data]
+
+def frames_digest(frames: list[bytes]) -> str:
+    """
+    SHA-256 of a set of frames, ignoring their metadata and order.
+    """
+    digests = []
+    for data in frames:
+        digest = hashlib.sha256()
+        for part in _jpeg_payload(data):
+            digest.update(part)
+        digests.append(digest.digest())
+    key = hashlib.sha256()
+    for digest in sorted(digests):
+        key.update(digest)
+    return key.hexdigest()
+
+def frames_key(frames: list[bytes], prompt_version: str) -> str:
+    return f'{KEY_PREFIX}:{prompt_version}:{frames_digest(frames)}'
+
+class ExtractionCache:
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl: int = CACHE_TTL, backend: str = CACHE_BACKEND):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Union[str, None]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] >= time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+
+        if self.backend == 'redis':
+            try:
+                value = await get_redis().get(key)
+            except Exception as e:
+                print(f"Extraction cache read failed: {e}")
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        self._remember(key, value)
+        if self.backend == 'redis':
+            try:
+                await get_redis().set(key, value, ex=self.ttl)
+            except Exception as e:
+                print(f"Extraction cache write failed: {e}")
+
+    def _remember(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+extraction_cache = ExtractionCache()
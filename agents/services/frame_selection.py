@@ -0,0 +1,141 @@
+"""
+Picks the receipt frames worth sending to bill extraction.
+
+Scoring a frame with the pic_selector agent is an LLM round trip, so frames
+are first judged locally, on a greyscale copy decoded at reduced size:
+
+- sharpness: variance of the Laplacian; motion blur and out of focus frames
+  score low (FRAME_MIN_SHARPNESS)
+- exposure: mean brightness within FRAME_MIN_BRIGHTNESS..FRAME_MAX_BRIGHTNESS,
+  and at most FRAME_MAX_CLIPPED of the pixels crushed to black or white
+- duplicates: frames within FRAME_DEDUP_DISTANCE bits of difference hash of
+  a sharper frame
+
+Only the FRAME_SCORE_TOP_K sharpest survivors are scored by the model, all
+at once, so selection costs one round trip. FRAME_SCORE_CONCURRENCY bounds
+scoring calls in flight across the whole process.
+
+Needs numpy and Pillow; without them frames are not filtered locally and
+the most recent FRAME_SCORE_TOP_K are scored.
+"""
+import io
+import os
+import asyncio
+from typing import Awaitable, Callable, Union
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
+
+from services.frames import image_dhash, DEDUP_DISTANCE
+
+MIN_SHARPNESS = float(os.getenv('FRAME_MIN_SHARPNESS', 40))
+MIN_BRIGHTNESS = float(os.getenv('FRAME_MIN_BRIGHTNESS', 40))
+MAX_BRIGHTNESS = float(os.getenv('FRAME_MAX_BRIGHTNESS', 235))
+MAX_CLIPPED = float(os.getenv('FRAME_MAX_CLIPPED', 0.4))
+SCORE_TOP_K = int(os.getenv('FRAME_SCORE_TOP_K', 3))
+SCORE_CONCURRENCY = int(os.getenv('FRAME_SCORE_CONCURRENCY', 8))
+# Frames scored this close to the best one all go to extraction.
+SCORE_MARGIN = int(os.getenv('FRAME_SCORE_MARGIN', 20))
+# Least longest side of the greyscale copy the metrics are computed on; the
+# decoder picks the smallest of 1/1, 1/2, 1/4 or 1/8 scale that keeps it.
+ANALYSIS_SIZE = 384
+
+_score_semaphore: Union[asyncio.BoundedSemaphore, None] = None
+
+class FrameQuality:
+    def __init__(self, index: int, sharpness: float, brightness: float, clipped: float, hash: int):
+        self.index = index
+        self.sharpness = sharpness
+        self.brightness = brightness
+        self.clipped = clipped
+        self.hash = hash
+
+    @property
+    def acceptable(self) -> bool:
+        return (self.sharpness >= MIN_SHARPNESS
+                and MIN_BRIGHTNESS <= self.brightness <= MAX_BRIGHTNESS
+                and self.clipped <= MAX_CLIPPED)
+
+def frame_quality(index: int, data: bytes) -> Union[FrameQuality, None]:
+    """
+    None when the frame does not decode.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # The JPEG decoder scales down while decoding, keeping both sides
+            # at least the requested size.
+            scale = ANALYSIS_SIZE / max(image.size)
+            image.draft('L', (int(image.width * scale), int(image.height * scale)))
+            grey = image.convert('L')
+    except Exception:
+        return None
+
+    pixels = numpy.asarray(grey, dtype=numpy.float32)
+    laplacian = (pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+                 - 4 * pixels[1:-1, 1:-1])
+    histogram = numpy.bincount(numpy.asarray(grey).ravel(), minlength=256)
+    clipped = (histogram[:8].sum() + histogram[248:].sum()) / max(histogram.sum(), 1)
+    return FrameQuality(index, float(laplacian.var()), float(pixels.mean()), float(clipped), image_dhash(grey))
+
+def prefilter_frames(frames: list[bytes], top_k: int = SCORE_TOP_K) -> list[int]:
+    """
+    Indexes of the frames worth scoring, sharpest first. Keeps the sharpest
+    frame when none passes, as a poor frame beats no extraction at all.
+    """
+    if numpy is None or Image is None:
+        return list(range(len(frames)))[-top_k:][::-1]
+
+    qualities = [quality for index, data in enumerate(frames)
+                 if (quality := frame_quality(index, data)) is not None]
+    qualities.sort(key=lambda quality: quality.sharpness, reverse=True)
+
+    selected: list[FrameQuality] = []
+    for quality in qualities:
+        if not quality.acceptable:
+            continue
+        if any(bin(quality.hash ^ kept.hash).count('1') <= DEDUP_DISTANCE for kept in selected):
+            continue
+        selected.append(quality)
+        if len(selected) == top_k:
+            break
+
+    if not selected and qualities:
+        selected = qualities[:1]
+    return [quality.index for quality in selected]
+
+async def _bounded(score: Callable[[bytes], Awaitable[int]], data: bytes) -> int:
+    global _score_semaphore
+    if _score_semaphore is None:
+        _score_semaphore = asyncio.BoundedSemaphore(SCORE_CONCURRENCY)
+    async with _score_semaphore:
+        return await score(data)
+
+async def select_frames(frames: list[bytes], score: Callable[[bytes], Awaitable[int]]) -> list[bytes]:
+    """
+    The frames to extract the bill from: the local prefilter's survivors
+    scored concurrently by `score`, keeping those within SCORE_MARGIN of the
+    best score. Frames whose scoring failed are left out unless all failed,
+    in which case the prefilter's choice stands.
+    """
+    # A few ms per frame of decoding and numpy; kept off the event loop that
+    # streams the session's audio.
+    candidates = await asyncio.to_thread(prefilter_frames, frames)
+    if len(candidates) <= 1:
+        return [frames[index] for index in candidates]
+
+    results = await asyncio.gather(*(_bounded(score, frames[index]) for index in candidates),
+                                   return_exceptions=True)
+    scored = [(result, index) for result, index in zip(results, candidates)
+              if not isinstance(result, BaseException)]
+    for result in results:
+        if isinstance(result, BaseException):
+            print(f"Frame scoring failed: {result}")
+    if not scored:
+        return [frames[index] for index in candidates]
+
+    best = max(result for result, _ in scored)
+    return [frames[index] for result, index in scored if result >= best - SCORE_MARGIN]
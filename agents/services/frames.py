@@ -0,0 +1,181 @@
+"""
+Per live session store of the camera frames a client sends.
+
+Each live websocket session gets its own FrameStore, a ring buffer bounded
+both by frame count (FRAME_STORE_MAX_FRAMES) and by bytes
+(FRAME_STORE_BYTE_BUDGET): the oldest frames are dropped to make room. A
+frame that looks like one already stored (same 64-bit difference hash within
+FRAME_DEDUP_DISTANCE bits) is not stored twice; of the two, the larger JPEG is
+kept, as the sharper frame compresses worse. Frames above FRAME_SPILL_BYTES
+are written to an anonymous temp file instead of being held in memory.
+
+Without Pillow, only byte-identical frames are recognised as duplicates.
+"""
+import io
+import os
+import time
+import hashlib
+import tempfile
+from collections import deque
+from typing import IO, Union
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MAX_FRAMES = int(os.getenv('FRAME_STORE_MAX_FRAMES', 8))
+BYTE_BUDGET = int(os.getenv('FRAME_STORE_BYTE_BUDGET', 8 * 1024 * 1024))
+SPILL_BYTES = int(os.getenv('FRAME_SPILL_BYTES', 256 * 1024))
+DEDUP_DISTANCE = int(os.getenv('FRAME_DEDUP_DISTANCE', 6))
+
+def dhash(data: bytes) -> Union[int, None]:
+    """
+    64-bit difference hash: the image shrunk to 9x8 greyscale, one bit per
+    pair of horizontally adjacent pixels. Frames of the same scene differ in
+    a few bits. None when Pillow is missing or the frame does not decode.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Lets the JPEG decoder scale down by up to 8x while decoding,
+            # which is most of the cost of hashing a camera frame.
+            image.draft('L', (64, 64))
+            return image_dhash(image)
+    except Exception:
+        return None
+
+def image_dhash(image: 'Image.Image') -> int:
+    pixels = image.convert('L').resize((9, 8), Image.Resampling.BILINEAR).tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+class Frame:
+    def __init__(self, data: bytes):
+        self.size = len(data)
+        self.received_at = time.monotonic()
+        self.digest = hashlib.blake2b(data, digest_size=16).digest()
+        self.hash = dhash(data)
+        self._data: Union[bytes, None] = None
+        self._file: Union[IO[bytes], None] = None
+        if self.size > SPILL_BYTES:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(data)
+        else:
+            self._data = data
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def read(self) -> bytes:
+        if self._file is None:
+            return self._data
+        self._file.seek(0)
+        return self._file.read()
+
+    def resembles(self, other: 'Frame') -> bool:
+        if self.digest == other.digest:
+            return True
+        if self.hash is None or other.hash is None:
+            return False
+        return bin(self.hash ^ other.hash).count('1') <= DEDUP_DISTANCE
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._data = None
+
+class FrameStore:
+    def __init__(self, max_frames: int = MAX_FRAMES, byte_budget: int = BYTE_BUDGET):
+        self.max_frames = max_frames
+        self.byte_budget = byte_budget
+        self._frames: deque[Frame] = deque()
+        self.bytes = 0
+        self.received = 0
+        self.duplicates = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def add(self, data: bytes) -> bool:
+        """
+        Stores a frame. Returns False when it was dropped: too large for the
+        whole budget, or a near duplicate of a sharper stored frame.
+        """
+        self.received += 1
+        if len(data) > self.byte_budget:
+            self.rejected += 1
+            return False
+
+        frame = Frame(data)
+        for stored in self._frames:
+            if frame.resembles(stored):
+                self.duplicates += 1
+                if frame.size <= stored.size:
+                    frame.close()
+                    return False
+                self._remove(stored)
+                break
+
+        self._frames.append(frame)
+        self.bytes += frame.size
+        while len(self._frames) > self.max_frames or self.bytes > self.byte_budget:
+            self._remove(self._frames[0])
+            self.evicted += 1
+        return True
+
+    def _remove(self, frame: Frame):
+        self._frames.remove(frame)
+        self.bytes -= frame.size
+        frame.close()
+
+    def recent_frames(self, limit: Union[int, None] = None) -> list[bytes]:
+        """
+        The `limit` most recent distinct frames (all by default), oldest first.
+        """
+        frames = list(self._frames)
+        if limit is not None:
+            frames = frames[-limit:] if limit > 0 else []
+        return [frame.read() for frame in frames]
+
+    def stats(self) -> dict:
+        return {
+            'frames': len(self._frames),
+            'bytes': self.bytes,
+            'spilled': sum(frame.spilled for frame in self._frames),
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'evicted': self.evicted,
+            'rejected': self.rejected,
+        }
+
+    def close(self):
+        for frame in self._frames:
+            frame.close()
+        self._frames.clear()
+        self.bytes = 0
+
+# Live session id -> its frames, for as long as the websocket is open.
+_stores: dict[str, FrameStore] = dict()
+
+def open_frame_store(session_id: str) -> FrameStore:
+    store = _stores.get(session_id)
+    if store is None:
+        store = _stores[session_id] = FrameStore()
+    return store
+
+def get_frame_store(session_id: Union[str, None]) -> Union[FrameStore, None]:
+    return _stores.get(session_id) if session_id else None
+
+def close_frame_store(session_id: str):
+    store = _stores.pop(session_id, None)
+    if store is not None:
+        store.close()
@@ -0,0 +1,151 @@
+"""
+Bounded LiveRequestQueue for the media a live client streams in.
+
+ADK's LiveRequestQueue is an unbounded asyncio.Queue: when the model link is
+slower than the client, microphone audio and camera frames pile up in memory
+without limit. BoundedLiveRequestQueue keeps the same interface, so run_live
+consumes it unchanged, and bounds the two kinds of media differently:
+
+- camera frames (image/*): at most INGEST_MAX_IMAGES waiting; a new frame
+  drops the oldest waiting one, as only the latest view matters
+- microphone audio: at most INGEST_MAX_AUDIO_CHUNKS waiting; put_realtime()
+  then waits for the model to catch up, so the websocket stops being read
+  and TCP flow control slows the client down. No speech is dropped.
+
+Text, activity signals and close are never bounded and keep their order
+with the media around them.
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from google.adk.agents import LiveRequestQueue
+from google.adk.agents.live_request_queue import LiveRequest
+from google.genai import types
+
+MAX_AUDIO_CHUNKS = int(os.getenv('INGEST_MAX_AUDIO_CHUNKS', 50))
+MAX_IMAGES = int(os.getenv('INGEST_MAX_IMAGES', 2))
+
+def _is_image(request: LiveRequest) -> bool:
+    return request.blob is not None and (request.blob.mime_type or '').startswith('image/')
+
+def _is_audio(request: LiveRequest) -> bool:
+    return request.blob is not None and (request.blob.mime_type or '').startswith('audio/')
+
+class BoundedLiveRequestQueue(LiveRequestQueue):
+    def __init__(self, max_audio_chunks: int = MAX_AUDIO_CHUNKS, max_images: int = MAX_IMAGES):
+        super().__init__()
+        self.max_audio_chunks = max_audio_chunks
+        self.max_images = max_images
+        self._requests: deque[LiveRequest] = deque()
+        self._readable = asyncio.Event()
+        self._audio_space = asyncio.Event()
+        self.audio_depth = 0
+        self.image_depth = 0
+        self.dropped_images = 0
+        self.audio_waits = 0
+        self.audio_wait_seconds = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._requests)
+
+    def send(self, req: LiveRequest):
+        if _is_image(req):
+            while self.image_depth >= self.max_images:
+                self._drop_oldest_image()
+            self.image_depth += 1
+        elif _is_audio(req):
+            self.audio_depth += 1
+        self._requests.append(req)
+        self._readable.set()
+
+    def close(self):
+        self.send(LiveRequest(close=True))
+
+    def send_content(self, content: types.Content):
+        self.send(LiveRequest(content=content))
+
+    def send_realtime(self, blob: types.Blob):
+        # Can't wait here; audio sent this way is not bounded. The websocket
+        # reader uses put_realtime().
+        self.send(LiveRequest(blob=blob))
+
+    def send_activity_start(self):
+        self.send(LiveRequest(activity_start=types.ActivityStart()))
+
+    def send_activity_end(self):
+        self.send(LiveRequest(activity_end=types.ActivityEnd()))
+
+    async def put_realtime(self, blob: types.Blob):
+        """
+        send_realtime() that waits while the audio backlog is full.
+        """
+        if (blob.mime_type or '').startswith('audio/') and self.audio_depth >= self.max_audio_chunks:
+            self.audio_waits += 1
+            started = time.perf_counter()
+            while self.audio_depth >= self.max_audio_chunks:
+                self._audio_space.clear()
+                await self._audio_space.wait()
+            self.audio_wait_seconds += time.perf_counter() - started
+        self.send(LiveRequest(blob=blob))
+
+    async def get(self) -> LiveRequest:
+        while not self._requests:
+            self._readable.clear()
+            await self._readable.wait()
+        request = self._requests.popleft()
+        if _is_image(request):
+            self.image_depth -= 1
+        elif _is_audio(request):
+            self.audio_depth -= 1
+            self._audio_space.set()
+        return request
+
+    def _drop_oldest_image(self):
+        for request in self._requests:
+            if _is_image(request):
+                self._requests.remove(request)
+                self.image_depth -= 1
+                self.dropped_images += 1
+                return
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.depth,
+            'audio_depth': self.audio_depth,
+            'image_depth': self.image_depth,
+            'dropped_images': self.dropped_images,
+            'audio_waits': self.audio_waits,
+            'audio_wait_seconds': self.audio_wait_seconds,
+        }
+
+# Live session id -> its queue, for as long as the websocket is open.
+_queues: dict[str, BoundedLiveRequestQueue] = dict()
+# Counters of the queues already closed.
+_closed = {'dropped_images': 0, 'audio_waits': 0, 'audio_wait_seconds': 0.0}
+
+def register_ingest_queue(session_id: str, queue: BoundedLiveRequestQueue):
+    _queues[session_id] = queue
+
+def unregister_ingest_queue(session_id: str):
+    queue = _queues.pop(session_id, None)
+    if queue is not None:
+        stats = queue.stats()
+        for key in _closed:
+            _closed[key] += stats[key]
+
+def get_ingest_metrics() -> dict:
+    """
+    Backlog of client media waiting for the model, over open connections.
+    Drops and waits count since the process started.
+    """
+    stats = [queue.stats() for queue in _queues.values()]
+    return {
+        'sessions': len(stats),
+        'depth': sum(s['depth'] for s in stats),
+        'max_depth': max((s['depth'] for s in stats), default=0),
+        'audio_depth': sum(s['audio_depth'] for s in stats),
+        'image_depth': sum(s['image_depth'] for s in stats),
+        **{key: closed + sum(s[key] for s in stats) for key, closed in _closed.items()},
+    }
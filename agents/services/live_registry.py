@@ -0,0 +1,289 @@
+"""
+Which worker runs each live session, kept in Redis, so the live endpoint
+can run on several uvicorn workers or pods without sticky routing.
+
+A live session's model stream, ingest queue and frame store live in the
+process that started it. With LIVE_REGISTRY=redis every worker claims the
+sessions it runs under live:owner:{session_id}, and renews each claim every
+LIVE_OWNER_TTL / 3 seconds while the session lasts. A crashed worker's
+sessions are free again after LIVE_OWNER_TTL seconds, and a worker that
+finds one of its claims taken closes that session.
+
+A client reconnecting to a worker other than the owner (see
+services/live_sessions.py) hands the session off. The new worker asks the
+owner, on the owner's channel live:worker:{worker id}, to give the session
+up. The owner closes its connection and live stream, drops its claim and
+answers. The new worker then claims the session and starts a new live
+stream on the stored ADK session. An owner that doesn't answer within
+LIVE_HANDOFF_TIMEOUT seconds is taken to be gone.
+
+send_control() delivers a JSON control message to a session's client on
+whichever worker has it; broadcast_control() fans one out to every client
+on every worker. Their endpoints in app.py want LIVE_CONTROL_TOKEN as a
+bearer token, and are off while it isn't set.
+
+LIVE_REGISTRY=off, the default, keeps all of it in the one process. For
+several workers on one machine, with Redis on localhost:
+
+    LIVE_REGISTRY=redis uvicorn app:app --workers 4 --port 8001
+"""
+import os
+import json
+import socket
+import asyncio
+from uuid import uuid4
+from typing import Union
+from redis.asyncio.connection import Connection
+
+from services.sessions import get_redis, _redis_kwargs
+from services.live_sessions import LiveSession, get_live_session, list_live_sessions
+
+REGISTRY_BACKEND = os.getenv('LIVE_REGISTRY', 'off')
+OWNER_TTL = int(os.getenv('LIVE_OWNER_TTL', 30))
+HANDOFF_TIMEOUT = float(os.getenv('LIVE_HANDOFF_TIMEOUT', 2))
+
+WORKER_ID = os.getenv('LIVE_WORKER_ID') or f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+OWNER_KEY = 'live:owner:{}'
+WORKER_CHANNEL = 'live:worker:{}'
+BROADCAST_CHANNEL = 'live:broadcast'
+
+# Only ever act on a claim that is still this worker's.
+RELEASE_IF_OWNER = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+"""
+# A claim that has vanished (Redis restarted, or was down when the session
+# started) is made again.
+RENEW_IF_OWNER = """
+    local owner = redis.call('GET', KEYS[1])
+    if owner == ARGV[1] or not owner then
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+        return 1
+    end
+    return 0
+"""
+
+class RegistryMetrics:
+    def __init__(self):
+        self.claims = 0
+        self.handoffs_requested = 0
+        self.handoffs_timed_out = 0
+        self.handoffs_given = 0
+        self.claims_lost = 0
+        self.control_delivered = 0
+
+    def snapshot(self) -> dict:
+        return {
+            'backend': REGISTRY_BACKEND,
+            'worker_id': WORKER_ID,
+            'sessions': len(list_live_sessions()),
+            **vars(self),
+        }
+
+registry_metrics = RegistryMetrics()
+
+_tasks: list[asyncio.Task] = []
+# Handoffs this worker is waiting on, by session id.
+_handoffs: dict[str, asyncio.Future] = dict()
+
+def registry_enabled() -> bool:
+    return REGISTRY_BACKEND == 'redis' and bool(_tasks)
+
+async def claim_live_session(session_id: str):
+    """
+    Makes this worker the session's owner, taking it over from the worker
+    that has it, if any. Call before starting the session's live stream.
+    """
+    if not registry_enabled():
+        return
+    redis = get_redis()
+    key = OWNER_KEY.format(session_id)
+    registry_metrics.claims += 1
+    try:
+        if await redis.set(key, WORKER_ID, nx=True, ex=OWNER_TTL):
+            return
+        owner = await redis.get(key)
+        if owner is not None and owner != WORKER_ID:
+            await _request_handoff(owner, session_id)
+        await redis.set(key, WORKER_ID, ex=OWNER_TTL)
+    except Exception as e:
+        # The session still runs here; the claim is made on renewal.
+        print(f"Claiming live session {session_id} failed: {e}")
+
+async def _request_handoff(owner: str, session_id: str):
+    registry_metrics.handoffs_requested += 1
+    released = asyncio.get_running_loop().create_future()
+    _handoffs[session_id] = released
+    try:
+        message = json.dumps({'type': 'handoff', 'session_id': session_id, 'worker': WORKER_ID})
+        # Nobody listening: the owner is gone and its claim is stale.
+        if await get_redis().publish(WORKER_CHANNEL.format(owner), message):
+            await asyncio.wait_for(released, HANDOFF_TIMEOUT)
+    except asyncio.TimeoutError:
+        registry_metrics.handoffs_timed_out += 1
+        print(f"Live session {session_id}: worker {owner} did not hand it off in time, taking it over")
+    finally:
+        _handoffs.pop(session_id, None)
+
+async def _release(session_id: str):
+    try:
+        await get_redis().eval(RELEASE_IF_OWNER, 1, OWNER_KEY.format(session_id), WORKER_ID)
+    except Exception as e:
+        print(f"Releasing live session {session_id} failed: {e}")
+
+def release_live_session(live: LiveSession):
+    """
+    LiveSession.on_close: gives up the session's claim.
+    """
+    if registry_enabled():
+        asyncio.create_task(_release(live.session_id))
+
+async def _close_connection(live: LiveSession, reason: str):
+    websocket = live.websocket
+    live.close()
+    if websocket is not None:
+        try:
+            await websocket.close(code=4000, reason=reason)
+        except Exception as e:
+            print(f"Closing live session {live.session_id}'s connection failed: {e}")
+
+async def _hand_off(session_id: str, worker: str):
+    live = get_live_session(session_id)
+    if live is not None:
+        registry_metrics.handoffs_given += 1
+        await _close_connection(live, "Resumed on another worker")
+    await _release(session_id)
+    await get_redis().publish(WORKER_CHANNEL.format(worker), json.dumps({'type': 'released', 'session_id': session_id}))
+
+async def _deliver(live: LiveSession, message: dict):
+    sender = live.sender
+    if sender is None:
+        return
+    try:
+        await sender.send_message(message)
+        registry_metrics.control_delivered += 1
+    except Exception as e:
+        print(f"Control message for live session {live.session_id} failed: {e}")
+
+def _on_message(data: str):
+    message = json.loads(data)
+    kind = message.get('type')
+    if kind == 'handoff':
+        asyncio.create_task(_hand_off(message['session_id'], message['worker']))
+    elif kind == 'released':
+        released = _handoffs.get(message['session_id'])
+        if released is not None and not released.done():
+            released.set_result(True)
+    elif kind == 'control':
+        live = get_live_session(message['session_id'])
+        if live is not None:
+            asyncio.create_task(_deliver(live, message['message']))
+    elif kind == 'broadcast':
+        for live in list_live_sessions():
+            asyncio.create_task(_deliver(live, message['message']))
+
+async def _listen():
+    """
+    Keeps one dedicated connection subscribed to this worker's channel and
+    the broadcast channel, reconnecting when it drops.
+    """
+    while True:
+        # As the session cache's listener, see services/sessions.py
+        listener = Connection(protocol=2, **_redis_kwargs(), socket_timeout=None)
+        try:
+            await listener.connect()
+            await listener.send_command('SUBSCRIBE', WORKER_CHANNEL.format(WORKER_ID), BROADCAST_CHANNEL)
+            await listener.read_response()
+            await listener.read_response()
+            while True:
+                message = await listener.read_response(timeout=None)
+                if isinstance(message, list) and message[0] == 'message':
+                    try:
+                        _on_message(message[2])
+                    except Exception as e:
+                        print(f"Bad live registry message {message[2]!r}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Live registry listener failed: {e}")
+        finally:
+            await listener.disconnect()
+        await asyncio.sleep(1)
+
+async def _renew_claims():
+    """
+    Renews the claims on this worker's sessions. A session claimed by
+    another worker, taken over while this one couldn't hear the handoff
+    request, is closed rather than left running twice.
+    """
+    while True:
+        await asyncio.sleep(OWNER_TTL / 3)
+        sessions = list_live_sessions()
+        if not sessions:
+            continue
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for live in sessions:
+                    pipe.eval(RENEW_IF_OWNER, 1, OWNER_KEY.format(live.session_id), WORKER_ID, OWNER_TTL)
+                renewed = await pipe.execute()
+        except Exception as e:
+            print(f"Renewing live session claims failed: {e}")
+            continue
+        for live, ok in zip(sessions, renewed):
+            if not ok and not live.closed:
+                registry_metrics.claims_lost += 1
+                print(f"Live session {live.session_id} is owned by another worker now, closing it")
+                await _close_connection(live, "Session moved to another worker")
+
+async def send_control(session_id: str, message: dict) -> bool:
+    """
+    Sends `message` to the session's client, on whichever worker it is.
+    False when the session isn't running anywhere.
+    """
+    live = get_live_session(session_id)
+    if live is not None:
+        await _deliver(live, message)
+        return live.sender is not None
+    if not registry_enabled():
+        return False
+    owner = await get_redis().get(OWNER_KEY.format(session_id))
+    if owner is None:
+        return False
+    envelope = json.dumps({'type': 'control', 'session_id': session_id, 'message': message})
+    return await get_redis().publish(WORKER_CHANNEL.format(owner), envelope) > 0
+
+async def broadcast_control(message: dict) -> int:
+    """
+    Sends `message` to every connected client. Returns the number of workers
+    it went to.
+    """
+    if not registry_enabled():
+        for live in list_live_sessions():
+            await _deliver(live, message)
+        return 1
+    return await get_redis().publish(BROADCAST_CHANNEL, json.dumps({'type': 'broadcast', 'message': message}))
+
+async def start_live_registry():
+    if REGISTRY_BACKEND == 'redis' and not _tasks:
+        _tasks.append(asyncio.create_task(_listen()))
+        _tasks.append(asyncio.create_task(_renew_claims()))
+        print(f"Live session registry in Redis, worker {WORKER_ID}")
+
+async def stop_live_registry():
+    """
+    Gives up this worker's claims, so reconnecting clients don't wait on a
+    handoff nobody will answer, and stops listening.
+    """
+    if not _tasks:
+        return
+    for live in list_live_sessions():
+        await _release(live.session_id)
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+def get_live_registry_metrics() -> dict:
+    return registry_metrics.snapshot()
@@ -0,0 +1,133 @@
+"""
+Live sessions that outlive their websocket.
+
+Every connection is told its session id first thing ({"session_id": ...}).
+A client that loses its connection, a phone dropping Wi-Fi for a second,
+reconnects to /ws/{that id}:
+
+- within LIVE_RESUME_GRACE seconds of the disconnect, it is reattached to
+  the session's running live model stream, ingest queue, frame store and
+  turn tracker, which were parked rather than closed. Resuming is a dict
+  lookup. Agent output produced while no client was attached is dropped.
+- later, or on a worker that never had the session, the ADK session is
+  loaded and a new live stream is started on it with the conversation so
+  far as history: the context survives, the model connection is new.
+- any other id starts a new session.
+
+A reconnect that arrives before the server has noticed the old connection
+is gone takes the session over from it.
+"""
+import os
+import asyncio
+from typing import AsyncIterator, Callable, Union
+from fastapi import WebSocket
+
+from services.frames import FrameStore, close_frame_store
+from services.ingest import BoundedLiveRequestQueue, unregister_ingest_queue
+from services.metrics import TurnTracker, PARKED_SESSIONS
+from services.ws_protocol import AgentMessageSender
+
+RESUME_GRACE = float(os.getenv('LIVE_RESUME_GRACE', 30))
+
+class LiveSession:
+    def __init__(
+        self,
+        session_id: str,
+        user_id: str,
+        live_events: AsyncIterator,
+        live_request_queue: BoundedLiveRequestQueue,
+        frame_store: FrameStore,
+    ):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.live_events = live_events
+        self.live_request_queue = live_request_queue
+        self.frame_store = frame_store
+        self.turns = TurnTracker()
+        self.websocket: Union[WebSocket, None] = None
+        # None while parked.
+        self.sender: Union[AgentMessageSender, None] = None
+        # Forwards live_events to whichever client is attached; runs for as
+        # long as the session, not the connection.
+        self.pump: Union[asyncio.Task, None] = None
+        self.closed = False
+        # Between a disconnect and a resume or RESUME_GRACE running out.
+        self.parked = False
+        self._expiry: Union[asyncio.TimerHandle, None] = None
+        # Called once the session is closed, e.g. to give up its claim in
+        # the worker registry (services/live_registry.py).
+        self.on_close: Union[Callable[['LiveSession'], None], None] = None
+
+    def attach(self, websocket: WebSocket, sender: AgentMessageSender) -> Union[WebSocket, None]:
+        """
+        Makes `websocket` the session's client. Returns the connection it
+        took over from, if any, for the caller to close.
+        """
+        if self.parked:
+            self.parked = False
+            PARKED_SESSIONS.dec()
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        previous = self.websocket
+        self.websocket = websocket
+        self.sender = sender
+        return previous
+
+    def detach(self, websocket: WebSocket):
+        """
+        Parks the session when `websocket` is still its client, closing it
+        unless a client resumes within RESUME_GRACE seconds.
+        """
+        if self.websocket is not websocket or self.closed:
+            return
+        self.websocket = None
+        self.sender = None
+        self.parked = True
+        PARKED_SESSIONS.inc()
+        if RESUME_GRACE > 0:
+            self._expiry = asyncio.get_running_loop().call_later(RESUME_GRACE, self.close)
+        else:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.parked:
+            self.parked = False
+            PARKED_SESSIONS.dec()
+        self.closed = True
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        if self.pump is not None and not self.pump.done():
+            self.pump.cancel()
+        self.live_request_queue.close()
+        unregister_ingest_queue(self.session_id)
+        close_frame_store(self.session_id)
+        if _live_sessions.get(self.session_id) is self:
+            del _live_sessions[self.session_id]
+        if self.on_close is not None:
+            self.on_close(self)
+
+_live_sessions: dict[str, LiveSession] = dict()
+
+def register_live_session(live: LiveSession):
+    _live_sessions[live.session_id] = live
+
+def get_live_session(session_id: str, user_id: Union[str, None] = None) -> Union[LiveSession, None]:
+    """
+    This process's live session with that id, if it belongs to `user_id`
+    (any user when None).
+    """
+    live = _live_sessions.get(session_id)
+    if live is None or live.closed or (user_id is not None and live.user_id != user_id):
+        return None
+    return live
+
+def list_live_sessions() -> list[LiveSession]:
+    return [live for live in _live_sessions.values() if not live.closed]
+
+def close_live_sessions():
+    for live in list(_live_sessions.values()):
+        live.close()
@@ -0,0 +1,172 @@
+"""
+Prometheus metrics of the live voice pipeline, served on GET /metrics in the
+text exposition format by prometheus_client.
+
+The counters and histograms are process wide, so with several workers each
+one is scraped on its own. render_metrics() also reads the live ingest
+queues and the session service's connection pool when it is scraped.
+"""
+import os
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Union
+from fastapi import FastAPI
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from services.ingest import get_ingest_metrics
+from services.runner import get_session_pool_metrics
+from services.extraction_cache import extraction_cache
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Peak 16-bit sample value above which a microphone chunk counts as speech.
+VOICE_PEAK = int(os.getenv('LIVE_VOICE_PEAK', 500))
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+TOOL_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# Only the pipeline's metrics, not the process and GC ones of the default
+# registry.
+REGISTRY = CollectorRegistry()
+
+ACTIVE_SESSIONS = Gauge('raseed_live_sessions_active', 'Open live websocket sessions.', registry=REGISTRY)
+SESSIONS = Counter('raseed_live_sessions_total', 'Live websocket sessions started.', registry=REGISTRY)
+PARKED_SESSIONS = Gauge(
+    'raseed_live_sessions_parked', 'Live sessions waiting for their client to reconnect.', registry=REGISTRY,
+)
+RESUMES = Counter(
+    'raseed_live_resumes_total',
+    'Reconnects to an existing session, by whether the live stream was still running.', ('stream',),
+    registry=REGISTRY,
+)
+INBOUND_BYTES = Counter(
+    'raseed_live_inbound_bytes_total', 'Bytes received from live clients.', ('mime_type',), registry=REGISTRY,
+)
+INBOUND_MESSAGES = Counter(
+    'raseed_live_inbound_messages_total', 'Messages received from live clients.', ('mime_type',), registry=REGISTRY,
+)
+OUTBOUND_BYTES = Counter(
+    'raseed_live_outbound_bytes_total', 'Bytes sent to live clients.', ('mime_type',), registry=REGISTRY,
+)
+OUTBOUND_MESSAGES = Counter(
+    'raseed_live_outbound_messages_total', 'Messages sent to live clients.', ('mime_type',), registry=REGISTRY,
+)
+TURN_LATENCY = Histogram(
+    'raseed_live_turn_latency_seconds',
+    'From the end of the user\'s input to the first agent audio of the reply.',
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+TURNS = Counter('raseed_live_turns_total', 'Agent turns by how they ended.', ('outcome',), registry=REGISTRY)
+TOOL_CALL_SECONDS = Histogram(
+    'raseed_tool_call_duration_seconds', 'Agent tool call durations.', ('tool', 'outcome'),
+    buckets=TOOL_BUCKETS, registry=REGISTRY,
+)
+EXTRACTION_FIRST_RESULT = Histogram(
+    'raseed_extraction_first_result_seconds',
+    'From a receipt extraction call to its first result for the live agent.',
+    buckets=TOOL_BUCKETS, registry=REGISTRY,
+)
+
+class _ScrapeTimeCollector:
+    """
+    What other modules count themselves (the ingest queues, the extraction
+    cache, the session service's pool), read when /metrics is scraped.
+    """
+    def __init__(self):
+        self.app: Union[FastAPI, None] = None
+
+    def collect(self):
+        ingest = get_ingest_metrics()
+        depth = GaugeMetricFamily('raseed_live_ingest_queue_depth', 'Client media waiting for the model.', labels=('kind',))
+        depth.add_metric(('audio',), ingest['audio_depth'])
+        depth.add_metric(('image',), ingest['image_depth'])
+        yield depth
+        yield CounterMetricFamily(
+            'raseed_live_ingest_dropped_images', 'Camera frames dropped from full ingest queues.',
+            value=ingest['dropped_images'],
+        )
+        yield CounterMetricFamily(
+            'raseed_live_ingest_audio_wait_seconds', 'Time clients were held back by full audio queues.',
+            value=ingest['audio_wait_seconds'],
+        )
+
+        cache = extraction_cache.stats()
+        lookups = CounterMetricFamily('raseed_extraction_cache_lookups', 'Bill extraction cache lookups.', labels=('result',))
+        lookups.add_metric(('hit',), cache['hits'])
+        lookups.add_metric(('miss',), cache['misses'])
+        yield lookups
+
+        if self.app is not None:
+            pool = get_session_pool_metrics(self.app)
+            yield GaugeMetricFamily(
+                'raseed_agent_session_pool_checked_out', 'Session service connections in use.',
+                value=pool['checked_out'],
+            )
+            yield GaugeMetricFamily(
+                'raseed_agent_session_pool_saturation', 'Session service connections in use over the pool limit.',
+                value=pool['saturation'],
+            )
+
+_scrape_time = _ScrapeTimeCollector()
+REGISTRY.register(_scrape_time)
+
+def _base_type(mime_type: str) -> str:
+    return mime_type.split(';', 1)[0]
+
+def record_inbound(mime_type: str, size: int):
+    INBOUND_BYTES.labels(mime_type=_base_type(mime_type)).inc(size)
+    INBOUND_MESSAGES.labels(mime_type=_base_type(mime_type)).inc()
+
+def record_outbound(mime_type: str, size: int):
+    OUTBOUND_BYTES.labels(mime_type=_base_type(mime_type)).inc(size)
+    OUTBOUND_MESSAGES.labels(mime_type=_base_type(mime_type)).inc()
+
+def is_voiced(pcm: bytes) -> bool:
+    samples = array('h', pcm[:len(pcm) & ~1])
+    return bool(samples) and max(max(samples), -min(samples)) >= VOICE_PEAK
+
+class TurnTracker:
+    """
+    Turn latency of one live session. The end of the user's turn is the last
+    text message or speech-loud microphone chunk before the agent's first
+    audio; the microphone keeps streaming silence after the user stops.
+    """
+    def __init__(self):
+        self.last_input: Union[float, None] = None
+        self.replied_at: Union[float, None] = None
+        self.awaiting_reply = True
+
+    def user_input(self, mime_type: str, data: Union[bytes, str]):
+        if mime_type.startswith('audio/') and not is_voiced(data):
+            return
+        self.last_input = time.perf_counter()
+
+    def agent_audio(self):
+        if self.awaiting_reply and self.last_input is not None:
+            self.replied_at = time.perf_counter()
+            TURN_LATENCY.observe(self.replied_at - self.last_input)
+        self.awaiting_reply = False
+
+    def turn_ended(self, interrupted: bool):
+        TURNS.labels(outcome='interrupted' if interrupted else 'turn_complete').inc()
+        self.awaiting_reply = True
+        # Input from before this reply is answered; input since (the user
+        # talking over the agent) starts the next turn.
+        if self.last_input is not None and self.replied_at is not None and self.last_input < self.replied_at:
+            self.last_input = None
+
+@contextmanager
+def track_tool_call(tool: str):
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        TOOL_CALL_SECONDS.labels(tool=tool, outcome=outcome).observe(time.perf_counter() - started)
+
+def render_metrics(app: FastAPI) -> bytes:
+    _scrape_time.app = app
+    return generate_latest(REGISTRY)
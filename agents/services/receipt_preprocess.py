@@ -0,0 +1,170 @@
+"""
+Shrinks receipt frames before they are sent to the model.
+
+Camera frames are mostly background. Each frame is:
+
+1. decoded at reduced scale straight to greyscale (the JPEG decoder scales
+   by 1/2, 1/4 or 1/8 for free) when it is far larger than needed
+2. deskewed: the receipt is the bright region, its principal axis from the
+   mask's second moments gives the tilt, corrected when it is between
+   RECEIPT_MIN_SKEW and RECEIPT_MAX_SKEW degrees
+3. cropped to the receipt's bounding box plus a margin, when the bright
+   region is a plausible share of the frame
+4. contrast stretched, scaled to at most RECEIPT_MAX_SHORT_SIDE by
+   RECEIPT_MAX_SIDE, and re-encoded at RECEIPT_JPEG_QUALITY
+
+Text stays legible at these sizes while the image costs far fewer bytes and
+model tokens (fewer 768px tiles). Frames that do not decode, or any frame
+when numpy or Pillow is missing, are passed through unchanged. Results are
+kept in a per-process LRU keyed by the frame's hash, as the same frames are
+scored and then extracted.
+"""
+import io
+import os
+import math
+import hashlib
+import threading
+from typing import Union
+from collections import OrderedDict
+
+try:
+    import numpy
+    from PIL import Image, ImageOps
+except ImportError:
+    numpy = None
+    Image = None
+
+# The model bills images per 768x768 tile: a receipt fits one tile across
+# and two down.
+MAX_SIDE = int(os.getenv('RECEIPT_MAX_SIDE', 1536))
+MAX_SHORT_SIDE = int(os.getenv('RECEIPT_MAX_SHORT_SIDE', 768))
+JPEG_QUALITY = int(os.getenv('RECEIPT_JPEG_QUALITY', 70))
+MIN_SKEW = float(os.getenv('RECEIPT_MIN_SKEW', 1.0))
+MAX_SKEW = float(os.getenv('RECEIPT_MAX_SKEW', 25.0))
+CACHE_SIZE = int(os.getenv('RECEIPT_PREPROCESS_CACHE_SIZE', 256))
+# Side of the copy the receipt is located on.
+MASK_SIZE = 256
+# Crop only when the receipt covers this share of the frame.
+MIN_COVERAGE = 0.05
+MAX_COVERAGE = 0.9
+MARGIN = 0.03
+
+_cache: OrderedDict[bytes, bytes] = OrderedDict()
+# Frames are preprocessed in worker threads.
+_cache_lock = threading.Lock()
+
+def _otsu_threshold(pixels: 'numpy.ndarray') -> int:
+    histogram = numpy.bincount(pixels.ravel(), minlength=256).astype(numpy.float64)
+    weights = numpy.cumsum(histogram)
+    means = numpy.cumsum(histogram * numpy.arange(256))
+    total, total_mean = weights[-1], means[-1]
+    background = weights[:-1]
+    foreground = total - background
+    valid = (background > 0) & (foreground > 0)
+    between = numpy.zeros(255)
+    between[valid] = (total_mean * background[valid] - total * means[:-1][valid]) ** 2 \
+        / (background[valid] * foreground[valid])
+    return int(between.argmax())
+
+def _paper_mask(grey: 'Image.Image') -> 'numpy.ndarray':
+    small = grey.copy()
+    small.thumbnail((MASK_SIZE, MASK_SIZE))
+    pixels = numpy.asarray(small)
+    return pixels > _otsu_threshold(pixels)
+
+def _skew_degrees(mask: 'numpy.ndarray') -> float:
+    """
+    How far the bright region's long axis is from upright, in degrees,
+    positive counterclockwise.
+    """
+    ys, xs = numpy.nonzero(mask)
+    if len(xs) < 100:
+        return 0.0
+    xs = xs - xs.mean()
+    ys = ys - ys.mean()
+    mu20, mu02, mu11 = (xs * xs).mean(), (ys * ys).mean(), (xs * ys).mean()
+    # Orientation of the principal axis from the x axis, image coordinates.
+    theta = 0.5 * math.degrees(math.atan2(2 * mu11, mu20 - mu02))
+    # Receipts are portrait: measure against the vertical axis.
+    skew = theta - 90 if theta > 0 else theta + 90
+    return -skew
+
+def _receipt_box(mask: 'numpy.ndarray') -> Union[tuple[float, float, float, float], None]:
+    """
+    Fractional (left, top, right, bottom) of the longest runs of rows, then
+    columns, at least half as papery as the most papery one. None when that
+    is not a plausible receipt.
+    """
+    def longest_run(profile: 'numpy.ndarray') -> tuple[int, int]:
+        best, start, best_range = 0, None, (0, 0)
+        for index, on in enumerate(list(profile) + [False]):
+            if on and start is None:
+                start = index
+            elif not on and start is not None:
+                if index - start > best:
+                    best, best_range = index - start, (start, index)
+                start = None
+        return best_range
+
+    height, width = mask.shape
+    rows = mask.mean(axis=1)
+    top, bottom = longest_run(rows > rows.max() / 2)
+    columns = mask[top:bottom].mean(axis=0)
+    left, right = longest_run(columns > columns.max() / 2)
+    coverage = (bottom - top) * (right - left) / (height * width)
+    if not MIN_COVERAGE <= coverage <= MAX_COVERAGE:
+        return None
+    return (max(left / width - MARGIN, 0), max(top / height - MARGIN, 0),
+            min(right / width + MARGIN, 1), min(bottom / height + MARGIN, 1))
+
+def _preprocess(data: bytes) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format == 'JPEG':
+            scale = MAX_SIDE / max(image.size)
+            image.draft('L', (int(image.width * scale), int(image.height * scale)))
+        grey = ImageOps.exif_transpose(image).convert('L')
+
+    skew = _skew_degrees(_paper_mask(grey))
+    if MIN_SKEW <= abs(skew) <= MAX_SKEW:
+        background = int(numpy.asarray(grey).mean())
+        grey = grey.rotate(-skew, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=background)
+
+    box = _receipt_box(_paper_mask(grey))
+    if box is not None:
+        grey = grey.crop((int(box[0] * grey.width), int(box[1] * grey.height),
+                          int(box[2] * grey.width), int(box[3] * grey.height)))
+
+    grey = ImageOps.autocontrast(grey, cutoff=1)
+    if grey.width <= grey.height:
+        grey.thumbnail((MAX_SHORT_SIDE, MAX_SIDE), Image.Resampling.LANCZOS)
+    else:
+        grey.thumbnail((MAX_SIDE, MAX_SHORT_SIDE), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    grey.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue()
+
+def preprocess_receipt(data: bytes) -> bytes:
+    """
+    The frame as it should be uploaded. CPU bound, call it off the event loop.
+    """
+    if numpy is None or Image is None:
+        return data
+    key = hashlib.sha256(data).digest()
+    with _cache_lock:
+        processed = _cache.get(key)
+        if processed is not None:
+            _cache.move_to_end(key)
+            return processed
+    try:
+        processed = _preprocess(data)
+    except Exception as e:
+        print(f"Receipt preprocessing failed, sending the frame as is: {e}")
+        processed = data
+    with _cache_lock:
+        _cache[key] = processed
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return processed
+
+def preprocess_receipts(frames: list[bytes]) -> list[bytes]:
+    return [preprocess_receipt(data) for data in frames]
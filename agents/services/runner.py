@@ -0,0 +1,122 @@
+"""
+One Runner and one DatabaseSessionService per process, shared by every live
+websocket connection.
+
+DatabaseSessionService builds its own SQLAlchemy engine, connection pool and
+schema check when it is created, so it is created once in the app lifespan
+with a bounded pool (AGENT_DB_POOL_SIZE + AGENT_DB_MAX_OVERFLOW connections at
+most); starting a session then costs only the session row insert.
+"""
+import os
+import time
+from uuid import uuid4, UUID
+from typing import Union
+from fastapi import FastAPI
+from google.adk.agents import BaseAgent
+from google.adk.runners import Runner
+from google.adk.sessions import DatabaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+
+APP_NAME = 'raseed'
+
+def session_db_url() -> str:
+    return f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+
+def _engine_kwargs() -> dict:
+    return dict(
+        pool_size=int(os.getenv('AGENT_DB_POOL_SIZE', 5)),
+        max_overflow=int(os.getenv('AGENT_DB_MAX_OVERFLOW', 5)),
+        # Connecting sessions wait this long for a free connection, then fail.
+        pool_timeout=float(os.getenv('AGENT_DB_POOL_TIMEOUT', 30)),
+        # Voice sessions can sit idle for a long time between events.
+        pool_pre_ping=True,
+        pool_recycle=int(os.getenv('AGENT_DB_POOL_RECYCLE', 1800)),
+    )
+
+class SessionStartMetrics:
+    """
+    Time spent creating session rows, i.e. the database part of a websocket
+    connect.
+    """
+    def __init__(self):
+        self.started = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float):
+        self.started += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def snapshot(self) -> dict:
+        return {
+            'sessions_started': self.started,
+            'create_session_avg_ms': 1000 * self.total / (self.started or 1),
+            'create_session_max_ms': 1000 * self.max,
+        }
+
+async def init_runner(app: FastAPI, agent: BaseAgent):
+    session_service = DatabaseSessionService(session_db_url(), **_engine_kwargs())
+    app.state.session_service = session_service
+    app.state.runner = Runner(app_name=APP_NAME, agent=agent, session_service=session_service)
+    app.state.session_start_metrics = SessionStartMetrics()
+
+async def shutdown_runner(app: FastAPI):
+    app.state.session_service.db_engine.dispose()
+
+async def create_agent_session(app: FastAPI, user_id: str) -> Session:
+    """
+    Creates the ADK session for a new live connection on the shared service.
+    The initial state goes in with the row, in the same insert.
+
+    The id is chosen here and also kept in the state as 'live_session_id', so
+    tools can find the connection's per session resources (its frame store)
+    from tool_context.state.
+    """
+    started = time.perf_counter()
+    session_id = str(uuid4())
+    session = await app.state.runner.session_service.create_session(
+        app_name=APP_NAME,
+        user_id=user_id,
+        session_id=session_id,
+        state={'user_id': user_id, 'live_session_id': session_id},
+    )
+    app.state.session_start_metrics.record(time.perf_counter() - started)
+    return session
+
+async def get_agent_session(app: FastAPI, user_id: str, session_id: str) -> Union[Session, None]:
+    """
+    The stored session a reconnecting client asks for, or None. Only ids this
+    module could have issued (UUIDs) are looked up, so clients that name
+    their connection with an id of their own don't cost a query.
+    """
+    try:
+        UUID(session_id)
+    except ValueError:
+        return None
+    # Just enough to know it exists; run_live loads the whole history.
+    return await app.state.runner.session_service.get_session(
+        app_name=APP_NAME,
+        user_id=user_id,
+        session_id=session_id,
+        config=GetSessionConfig(num_recent_events=1),
+    )
+
+def get_session_pool_metrics(app: FastAPI) -> dict:
+    """
+    Use of the session service's connection pool, alongside how long
+    session creation takes.
+    """
+    pool = app.state.session_service.db_engine.pool
+    size = pool.size()
+    checked_out = pool.checkedout()
+    max_overflow = getattr(pool, '_max_overflow', 0)
+    return {
+        'pool_size': size,
+        'max_overflow': max_overflow,
+        'checked_out': checked_out,
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+        'saturation': checked_out / ((size + max(max_overflow, 0)) or 1),
+        **app.state.session_start_metrics.snapshot(),
+    }
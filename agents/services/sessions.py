@@ -1,92 +1,352 @@
 import os
+import time
+import asyncio
 from uuid import uuid4
-import redis
-from inspect import isawaitable
+from typing import Union
+from collections import OrderedDict
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.connection import Connection
+from redis.exceptions import ConnectionError
 from fastapi import Request, Response
 from dotenv import load_dotenv
 load_dotenv()
 
+SESSION_TTL = int(os.getenv('REDIS_SESSION_TTL', 3600))
+
+# How the in-process session cache learns about writes made by other workers:
+#   tracking: Redis client side caching, invalidations pushed by the server.
+#   pubsub:   SessionData.flush() publishes the session id on a channel.
+#   off:      no in-process cache, every load goes to Redis.
+SESSION_CACHE_MODE = os.getenv('SESSION_CACHE_MODE', 'tracking')
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+# Upper bound on staleness should an invalidation ever be missed.
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 300))
+SESSION_INVALIDATION_CHANNEL = os.getenv('SESSION_INVALIDATION_CHANNEL', 'session-invalidations')
+TRACKING_INVALIDATION_CHANNEL = '__redis__:invalidate'
+
+class TrackingConnection(Connection):
+    """
+    Connection that turns on Redis client side caching as part of its
+    handshake, redirecting invalidation messages to the listener connection.
+    """
+    def __init__(self, *args, tracking_redirect: Union[int, None] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tracking_redirect = tracking_redirect
+
+    async def on_connect_check_health(self, check_health: bool = True) -> None:
+        await super().on_connect_check_health(check_health=check_health)
+        if self.tracking_redirect is not None:
+            await self.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', self.tracking_redirect)
+            if await self.read_response() != 'OK':
+                raise ConnectionError('CLIENT TRACKING could not be enabled')
+
+def _redis_kwargs() -> dict:
+    return dict(
+        host=os.getenv('REDIS_HOST', 'localhost'),
+        port=int(os.getenv('REDIS_PORT', 6379)),
+        db=0,
+        decode_responses=True,
+    )
+
+def _create_client(tracking_redirect: Union[int, None] = None) -> Redis:
+    pool = BlockingConnectionPool(
+        connection_class=TrackingConnection,
+        tracking_redirect=tracking_redirect,
+        max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+        **_redis_kwargs(),
+    )
+    return Redis(connection_pool=pool)
+
+# One pool per process; every request borrows a connection from it instead of
+# opening its own TCP connection to Redis.
+_redis_client: Union[Redis, None] = None
+
+def get_redis() -> Redis:
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = _create_client()
+    return _redis_client
+
+async def _replace_redis(client: Redis):
+    global _redis_client
+    previous, _redis_client = _redis_client, client
+    if previous is not None:
+        # Connections still checked out are closed when they are returned.
+        await previous.connection_pool.disconnect(inuse_connections=False)
+
+class SessionCache:
+    """
+    Bounded LRU of session hashes kept in each worker.
+
+    Entries are only served while the invalidation listener is connected. A
+    fetch must be started with `begin()`; if the key is invalidated while the
+    fetch is in flight, `store()` drops the (possibly stale) result.
+    """
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = False
+        self._entries: OrderedDict[str, tuple[float, dict[str, str]]] = OrderedDict()
+        self._fetching: dict[str, bool] = dict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Union[dict[str, str], None]:
+        entry = self._entries.get(key) if self.enabled else None
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry[1])
+
+    def begin(self, key: str):
+        self._fetching[key] = True
+
+    def store(self, key: str, data: Union[dict[str, str], None]):
+        if not self._fetching.pop(key, False) or not self.enabled or data is None:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, dict(data))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self.invalidations += 1
+        self._entries.pop(key, None)
+        if key in self._fetching:
+            self._fetching[key] = False
+
+    def clear(self):
+        self._entries.clear()
+        for key in self._fetching:
+            self._fetching[key] = False
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+session_cache = SessionCache(max_entries=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+
+async def _listen_for_invalidations(cache: SessionCache, mode: str):
+    """
+    Keeps one dedicated connection subscribed to invalidation messages. The
+    cache is emptied and switched off whenever that connection is down, so a
+    missed message can never leave a stale entry behind.
+    """
+    while True:
+        # RESP2 so subscription messages come back as plain replies, and no
+        # socket timeout: the channel can be quiet for any length of time.
+        listener = Connection(protocol=2, **_redis_kwargs(), socket_timeout=None)
+        try:
+            await listener.connect()
+            if mode == 'tracking':
+                await listener.send_command('CLIENT', 'ID')
+                client_id = await listener.read_response()
+                # New data connections track the keys they read and send
+                # invalidations to this listener.
+                await _replace_redis(_create_client(tracking_redirect=client_id))
+                channel = TRACKING_INVALIDATION_CHANNEL
+            else:
+                channel = SESSION_INVALIDATION_CHANNEL
+            await listener.send_command('SUBSCRIBE', channel)
+            await listener.read_response()
+
+            cache.clear()
+            cache.enabled = True
+            while True:
+                message = await listener.read_response(timeout=None)
+                if not isinstance(message, list) or message[0] != 'message':
+                    continue
+                keys = message[2]
+                if keys is None:
+                    # FLUSHDB/FLUSHALL, or the server forgot what we track.
+                    cache.clear()
+                    continue
+                for key in (keys if isinstance(keys, list) else [keys]):
+                    cache.invalidate(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Session cache invalidation listener failed: {e}")
+        finally:
+            cache.enabled = False
+            cache.clear()
+            await listener.disconnect()
+        await asyncio.sleep(1)
+
+_listener_task: Union[asyncio.Task, None] = None
+
+async def start_session_cache():
+    global _listener_task
+    if SESSION_CACHE_MODE in ('tracking', 'pubsub') and _listener_task is None:
+        _listener_task = asyncio.create_task(_listen_for_invalidations(session_cache, SESSION_CACHE_MODE))
+
+async def close_redis():
+    global _redis_client, _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        await _redis_client.connection_pool.disconnect()
+        _redis_client = None
+
 class SessionData:
-    def __init__(self, session_id: str, redis_client: redis.Redis, ttl: int):
+    """
+    Request scoped view of a session hash in Redis.
+
+    Nothing is fetched until `load()` is awaited, so routes that never read
+    the session cost no round trip, and hot sessions are served from
+    `session_cache`. Writes are buffered locally and sent by `flush()` as a
+    single pipelined HSET/HDEL + EXPIRE.
+    """
+    def __init__(self, session_id: str, redis_client: Redis, ttl: int, is_new: bool = False):
         self._session_id = session_id
         self._redis = redis_client
         self._ttl = ttl
+        self._is_new = is_new
+
+        self._data: Union[dict[str, str], None] = None
+        self._pending: dict[str, str] = dict()
+        self._deleted: set[str] = set()
+
+        if is_new:
+            # Nothing to read for a brand new session.
+            self._data = dict()
+            self['session_id'] = session_id
 
-        result = dict()
-        if redis_client.exists(session_id):
-            result = redis_client.hgetall(session_id)
-        else:
-            redis_client.hset(session_id, 'session_id', session_id)
-            result['session_id'] = session_id
-        
-        if not isawaitable(result):
-            self._data: dict[str, str] = result
+    @property
+    def session_id(self) -> str:
+        return self._session_id
 
-    def _refresh_ttl(self):
-        self._redis.expire(self._session_id, self._ttl)
+    @property
+    def is_new(self) -> bool:
+        return self._is_new
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._pending or self._deleted)
+
+    async def load(self) -> 'SessionData':
+        if self._data is None:
+            data = session_cache.get(self._session_id)
+            if data is None:
+                # Only reads made through the current (tracked) client may
+                # be cached.
+                cacheable = self._redis is get_redis()
+                if cacheable:
+                    session_cache.begin(self._session_id)
+                try:
+                    data = await self._redis.hgetall(self._session_id)
+                finally:
+                    if cacheable:
+                        session_cache.store(self._session_id, data)
+            # Writes made before the load win over what was stored.
+            for key in self._deleted:
+                data.pop(key, None)
+            data.update(self._pending)
+            self._data = data
+        return self
+
+    async def flush(self):
+        if not self.is_dirty:
+            return
+        session_cache.invalidate(self._session_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if self._deleted:
+                pipe.hdel(self._session_id, *self._deleted)
+            if self._pending:
+                pipe.hset(self._session_id, mapping=self._pending)
+            pipe.expire(self._session_id, self._ttl)
+            if SESSION_CACHE_MODE == 'pubsub':
+                pipe.publish(SESSION_INVALIDATION_CHANNEL, self._session_id)
+            await pipe.execute()
+        session_cache.invalidate(self._session_id)
+        self._pending = dict()
+        self._deleted = set()
+
+    def _loaded(self) -> dict[str, str]:
+        if self._data is None:
+            raise RuntimeError(f"Session {self._session_id} read before load(), await session.load() first.")
+        return self._data
 
     def __setitem__(self, key: str, value: str):
         str_value = str(value)
-        self._data[key] = str_value
-        self._redis.hset(self._session_id, key, str_value)
-        self._refresh_ttl()
+        if self._data is not None:
+            self._data[key] = str_value
+        self._pending[key] = str_value
+        self._deleted.discard(key)
 
     def __getitem__(self, key: str) -> str:
-        if key in self._data.keys():
-            return self._data[key]
+        data = self._loaded()
+        if key in data.keys():
+            return data[key]
         else: return ''
 
     def __delitem__(self, key: str) -> None:
-        if key in self._data.keys():
+        if self._data is not None:
+            if key not in self._data.keys():
+                return
             del self._data[key]
-            self._redis.hdel(self._session_id, key)
-            self._refresh_ttl()
+        self._pending.pop(key, None)
+        self._deleted.add(key)
 
     def __contains__(self, key: str) -> bool:
-        return key in self._data
+        return key in self._loaded()
 
     def __repr__(self) -> str:
-        return str(self._data)
+        return str(self._data if self._data is not None else f"<unloaded session {self._session_id}>")
 
     def get(self, key: str, default=''):
-        if key in self._data.keys():
-            return self._data.get(key, default)
+        return self._loaded().get(key, default)
 
     def keys(self):
-        return self._data.keys()
+        return self._loaded().keys()
 
     def values(self):
-        return self._data.values()
+        return self._loaded().values()
 
     def items(self):
-        return self._data.items()
+        return self._loaded().items()
 
 async def init_session(request: Request, call_next) -> Response:
-    redis_client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)), db=0, decode_responses=True)
     cookies = request.cookies
-    session = None
     agent_session= None
-    new_session = True
     if 'session_id' in cookies:
-        session =SessionData(session_id=cookies['session_id'], redis_client=redis_client, ttl=int(os.getenv('REDIS_SESSION_TTL', 3600)))
-        new_session = False
+        session = SessionData(session_id=cookies['session_id'], redis_client=get_redis(), ttl=SESSION_TTL)
     else:
-        session = SessionData(session_id=str(uuid4()), redis_client=redis_client, ttl=int(os.getenv('REDIS_SESSION_TTL', 3600)))
+        session = SessionData(session_id=str(uuid4()), redis_client=get_redis(), ttl=SESSION_TTL, is_new=True)
         #TODO: update this id when google oauth is setup.
         session['user_id'] = '123'
 
-    print("session accessed")
-
     request.state.session = session
     request.state.agent_session = agent_session
     response = await call_next(request)
-    
-    if new_session:
+
+    # Everything the handler wrote goes out in one round trip.
+    await session.flush()
+
+    if session.is_new:
         response.set_cookie(
             key='session_id',
-            value=session['session_id'],
-            max_age=int(os.getenv('REDIS_SESSION_TTL', 3600)), # Use TTL from manager
+            value=session.session_id,
+            max_age=SESSION_TTL, # Use TTL from manager
             samesite="lax",
         )
 
-    return response
\ No newline at end of file
+    return response
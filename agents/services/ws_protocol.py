@@ -0,0 +1,181 @@
+"""
+Wire format of the live agent websocket.
+
+A client that offers the BINARY_SUBPROTOCOL websocket subprotocol receives
+the agent's audio as binary frames: a 12 byte header, then raw 16-bit PCM.
+
+    version   u8   PROTOCOL_VERSION
+    kind      u8   KIND_AUDIO, or KIND_IMAGE (client to agent only)
+    reserved  u16  0
+    sequence  u32  counts the sender's media frames, from 0
+    rate      u32  audio sample rate in Hz, 0 for images
+
+Text and control messages (turn_complete / interrupted) stay JSON text
+frames. Clients that do not offer the subprotocol get everything as JSON, with
+audio base64 encoded, as before.
+
+The same frames carry the client's microphone audio and camera frames
+(JPEG) to the agent, instead of base64 inside JSON. The server reads a
+client's binary frames whichever mode it negotiated.
+
+In both modes the small audio chunks the model streams are coalesced: a
+frame goes out once AUDIO_COALESCE_MS of audio is buffered, or
+AUDIO_COALESCE_MS after the first buffered chunk arrived, whichever is first.
+"""
+import os
+import re
+import json
+import base64
+import struct
+import asyncio
+from typing import Union
+from fastapi import WebSocket
+
+from services.metrics import record_outbound
+
+BINARY_SUBPROTOCOL = 'raseed.audio.v1'
+PROTOCOL_VERSION = 1
+KIND_AUDIO = 1
+KIND_IMAGE = 2
+AUDIO_HEADER = struct.Struct('!BBHII')
+
+COALESCE_MS = float(os.getenv('AUDIO_COALESCE_MS', 40))
+# The live API speaks 16-bit mono PCM at 24kHz unless the mime type says otherwise.
+DEFAULT_SAMPLE_RATE = 24000
+BYTES_PER_SAMPLE = 2
+
+_RATE = re.compile(r'rate=(\d+)')
+
+def sample_rate(mime_type: str) -> int:
+    match = _RATE.search(mime_type or '')
+    return int(match.group(1)) if match else DEFAULT_SAMPLE_RATE
+
+def negotiate_protocol(websocket: WebSocket) -> Union[str, None]:
+    """
+    The subprotocol to accept the websocket with: BINARY_SUBPROTOCOL when the
+    client offered it, otherwise None (JSON only).
+    """
+    offered = websocket.scope.get('subprotocols') or []
+    return BINARY_SUBPROTOCOL if BINARY_SUBPROTOCOL in offered else None
+
+def encode_audio_frame(sequence: int, rate: int, audio: bytes) -> bytes:
+    return AUDIO_HEADER.pack(PROTOCOL_VERSION, KIND_AUDIO, 0, sequence & 0xFFFFFFFF, rate) + audio
+
+def decode_media_frame(frame: bytes) -> tuple[str, bytes]:
+    """
+    A client's binary frame as (mime type, data). Raises ValueError for
+    frames that are not media of a known kind.
+    """
+    if len(frame) < AUDIO_HEADER.size:
+        raise ValueError(f"Binary frame of {len(frame)} bytes is shorter than its header")
+    version, kind, _, _, rate = AUDIO_HEADER.unpack_from(frame)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Binary protocol version not supported: {version}")
+    data = frame[AUDIO_HEADER.size:]
+    if kind == KIND_AUDIO:
+        return (f"audio/pcm;rate={rate}" if rate else "audio/pcm"), data
+    if kind == KIND_IMAGE:
+        return "image/jpeg", data
+    raise ValueError(f"Binary frame kind not supported: {kind}")
+
+def encode_audio_json(audio: bytes) -> str:
+    return json.dumps({
+        "mime_type": "audio/pcm",
+        "data": base64.b64encode(audio).decode("ascii")
+    })
+
+class AgentMessageSender:
+    """
+    Sends one connection's agent output, in order. Audio is buffered as
+    described above; a JSON message flushes any buffered audio first.
+    """
+    def __init__(self, websocket: WebSocket, binary: bool, coalesce_ms: float = COALESCE_MS):
+        self.websocket = websocket
+        self.binary = binary
+        self.coalesce = coalesce_ms / 1000
+        self._chunks: list[bytes] = []
+        self._buffered = 0
+        self._rate = DEFAULT_SAMPLE_RATE
+        self._timer: Union[asyncio.Task, None] = None
+        self._lock = asyncio.Lock()
+        self.sequence = 0
+        self.audio_chunks = 0
+        self.audio_frames = 0
+        self.audio_bytes = 0
+        self.bytes_sent = 0
+
+    async def send_audio(self, audio: bytes, mime_type: str):
+        rate = sample_rate(mime_type)
+        async with self._lock:
+            if self._chunks and rate != self._rate:
+                await self._flush()
+            self._rate = rate
+            self._chunks.append(audio)
+            self._buffered += len(audio)
+            self.audio_chunks += 1
+            if self._buffered >= rate * BYTES_PER_SAMPLE * self.coalesce:
+                await self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.create_task(self._flush_later())
+
+    async def send_message(self, message: dict):
+        async with self._lock:
+            await self._flush()
+            payload = json.dumps(message)
+            await self.websocket.send_text(payload)
+            self.bytes_sent += len(payload)
+            record_outbound(message.get("mime_type", "control"), len(payload))
+
+    async def discard_audio(self):
+        """
+        Drops buffered audio, e.g. when the user interrupted the agent.
+        """
+        async with self._lock:
+            self._cancel_timer()
+            self._chunks = []
+            self._buffered = 0
+
+    async def close(self):
+        async with self._lock:
+            await self._flush()
+
+    def stats(self) -> dict:
+        return {
+            'protocol': 'binary' if self.binary else 'json',
+            'audio_chunks': self.audio_chunks,
+            'audio_frames': self.audio_frames,
+            'audio_bytes': self.audio_bytes,
+            'bytes_sent': self.bytes_sent,
+        }
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.coalesce)
+        async with self._lock:
+            # Cleared first so _flush() does not cancel this task.
+            self._timer = None
+            await self._flush()
+
+    async def _flush(self):
+        # Callers hold self._lock.
+        self._cancel_timer()
+        if not self._chunks:
+            return
+        audio = self._chunks[0] if len(self._chunks) == 1 else b''.join(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+        if self.binary:
+            payload = encode_audio_frame(self.sequence, self._rate, audio)
+            await self.websocket.send_bytes(payload)
+        else:
+            payload = encode_audio_json(audio)
+            await self.websocket.send_text(payload)
+        self.sequence += 1
+        self.audio_frames += 1
+        self.audio_bytes += len(audio)
+        self.bytes_sent += len(payload)
+        record_outbound("audio/pcm", len(payload))
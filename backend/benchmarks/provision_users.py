@@ -0,0 +1,84 @@
+"""
+Time to provision a partner import of users with their personal groups:
+one upsert_user_login() per user, as logins create them, against
+provision_users(), which COPYs the rows into a staging table and creates
+every missing user and group in one statement.
+
+Needs a Postgres with the backend schema, reached with the usual DB_*
+settings; DB_SUPER_USER has to be a superuser for the clean up. The users
+and groups it creates are deleted again at the end.
+Run from backend/:
+
+    python -m benchmarks.provision_users
+
+BENCH_USERS sets how many users provision_users() imports, BENCH_LOGIN_USERS
+how many go through upsert_user_login() one by one (the per-user rate is
+extrapolated from those).
+"""
+import os
+import time
+import asyncio
+from uuid import uuid4
+from fastapi import FastAPI
+
+from repository.database import init_db, shutdown_db, upsert_user_login, provision_users
+
+USERS = int(os.getenv('BENCH_USERS', 100000))
+LOGIN_USERS = int(os.getenv('BENCH_LOGIN_USERS', 2000))
+
+def make_rows(prefix: str, count: int) -> list[tuple[str, str, str]]:
+    return [(f'Imported user {i}', f'{prefix}-{i}@example.com', f'token-{i}') for i in range(count)]
+
+async def clean_up(app: FastAPI, prefix: str):
+    async with app.state.db_pool.connection() as conn:
+        async with conn.transaction():
+            # Nothing refers to these users but their own groups. Checked,
+            # the deletes would probe every expense partition for each user.
+            await conn.execute("SET LOCAL session_replication_role = replica")
+            cur = await conn.execute(
+                """
+                UPDATE users SET personal_group_id = NULL
+                WHERE email LIKE %s
+                RETURNING user_id
+                """,
+                (f'{prefix}-%',),
+            )
+            user_ids = [row['user_id'] for row in await cur.fetchall()]
+            await conn.execute("DELETE FROM groups WHERE created_by = ANY(%s)", (user_ids,))
+            await conn.execute("DELETE FROM users WHERE user_id = ANY(%s)", (user_ids,))
+
+async def main():
+    app = FastAPI()
+    await init_db(app)
+    prefix = f'provision-bench-{uuid4().hex[:8]}'
+    try:
+        login_rows = make_rows(f'{prefix}-login', LOGIN_USERS)
+        started = time.perf_counter()
+        for name, email, token in login_rows:
+            await upsert_user_login(app.state.db_pool, name, email, token)
+        login_seconds = time.perf_counter() - started
+
+        rows = make_rows(f'{prefix}-import', USERS)
+        started = time.perf_counter()
+        mapping = await provision_users(app.state.db_pool, rows)
+        import_seconds = time.perf_counter() - started
+        created = sum(user['created'] for user in mapping.values())
+
+        started = time.perf_counter()
+        mapping = await provision_users(app.state.db_pool, rows)
+        rerun_seconds = time.perf_counter() - started
+        created_again = sum(user['created'] for user in mapping.values())
+    finally:
+        await clean_up(app, prefix)
+        await shutdown_db(app)
+
+    print(f"{'':34}{'users':>8}{'created':>9}{'seconds':>9}{'per 100k':>10}")
+    for name, count, made, seconds in [
+        ('upsert_user_login, one by one', LOGIN_USERS, LOGIN_USERS, login_seconds),
+        ('provision_users', USERS, created, import_seconds),
+        ('provision_users, same rows again', USERS, created_again, rerun_seconds),
+    ]:
+        print(f"{name:34}{count:>8}{made:>9}{seconds:>9.2f}{100000 * seconds / count:>10.1f}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,362 @@
+"""
+Plan and latency regression checks for the hot read queries of the agent
+tools (agents/agents/chat_module/chat_component/tools) and the UI endpoints
+(agents/agents/chat_module/ui_utils.py, app.py), run against a synthetic
+dataset in a scratch Postgres database.
+
+For every query the plan is taken with EXPLAIN (ANALYZE, FORMAT JSON) and the
+statement is then timed over a number of runs. A query fails when its plan
+contains a sequential scan of one of the large tables, or when its median
+latency is over budget; a query bounded by expense_date also fails when its
+plan touches more monthly partitions than its date range covers. The script
+exits non-zero if any query fails, so it can gate a build.
+
+Needs a Postgres reachable with the usual DB_* settings; the user must be
+allowed to create databases. Run from backend/:
+
+    python -m benchmarks.query_plans                  # migrated schema
+    python -m benchmarks.query_plans --baseline-only  # db.sql alone, no indexes
+    python -m benchmarks.query_plans --reuse          # keep an already seeded database
+
+BENCH_DB_NAME (default raseed_bench) is dropped and recreated unless --reuse
+is given. BENCH_SCALE multiplies the dataset size (1 = 20k users, 5k groups,
+500k expenses), BENCH_RUNS sets the timed runs per query and
+BENCH_LATENCY_MS the median latency budget.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import statistics
+from psycopg import AsyncConnection, sql
+
+from repository.database import connection_kwargs
+from repository.migrations import BASELINE_PATH, migrate
+
+BENCH_DB_NAME = os.getenv('BENCH_DB_NAME', 'raseed_bench')
+SCALE = float(os.getenv('BENCH_SCALE', 1))
+RUNS = int(os.getenv('BENCH_RUNS', 20))
+LATENCY_BUDGET_MS = float(os.getenv('BENCH_LATENCY_MS', 25))
+
+USERS = int(20000 * SCALE)
+GROUPS = int(5000 * SCALE)
+MEMBERS_PER_GROUP = 4
+EXPENSES = int(500000 * SCALE)
+
+# A sequential scan is a regression only on a table at least this large;
+# below that, scanning a few pages can legitimately beat an index.
+SEQ_SCAN_MIN_ROWS = int(os.getenv('BENCH_SEQ_SCAN_MIN_ROWS', 10000))
+
+# The j-th member of group g. Members of a group are distinct as long as
+# USERS > 13 * MEMBERS_PER_GROUP.
+MEMBER = "((({group} * 7 + {slot} * 13) % {users}) + 1)"
+
+FIRST_EXPENSE_DATE = '2023-01-01'
+EXPENSE_DAYS = 1000
+
+def seed_statements(partitioned: bool) -> list[str]:
+    """
+    The partitioned schema (migration 0002) wants the parent expense's date on
+    expense_shares, expense_items and expense_receipts rows; db.sql alone has
+    no such column.
+    """
+    date_column = ', expense_date' if partitioned else ''
+    date_value = ', e.expense_date' if partitioned else ''
+    return [
+        f"""
+        INSERT INTO users (name, email, password_hash)
+        SELECT 'User ' || i, 'user' || i || '@example.com', 'token-' || i
+        FROM generate_series(1, {USERS}) AS i
+        """,
+        f"""
+        INSERT INTO groups (name, description, created_by)
+        SELECT 'Group ' || g, 'Synthetic group ' || g, {MEMBER.format(group='g', slot=0, users=USERS)}
+        FROM generate_series(1, {GROUPS}) AS g
+        """,
+        f"""
+        INSERT INTO user_groups (user_id, group_id)
+        SELECT {MEMBER.format(group='g', slot='m', users=USERS)}, g
+        FROM generate_series(1, {GROUPS}) AS g, generate_series(0, {MEMBERS_PER_GROUP - 1}) AS m
+        """,
+        f"""
+        INSERT INTO expenses (group_id, payer_id, amount, description, expense_date, location)
+        SELECT g, {MEMBER.format(group='g', slot=f'(i % {MEMBERS_PER_GROUP})', users=USERS)},
+               round((random() * 5000)::numeric, 2), 'Expense ' || i,
+               DATE '{FIRST_EXPENSE_DATE}' + (random() * {EXPENSE_DAYS})::int, 'Somewhere'
+        FROM (
+            SELECT i, 1 + (random() * ({GROUPS} - 1))::int AS g
+            FROM generate_series(1, {EXPENSES}) AS i
+        ) AS s
+        """,
+        # Every expense is split between its payer and the next member.
+        f"""
+        INSERT INTO expense_shares (expense_id, user_id, share_amount{date_column})
+        SELECT e.expense_id, m.user_id, round(e.amount / 2, 2){date_value}
+        FROM expenses e
+        CROSS JOIN LATERAL (
+            SELECT e.payer_id AS user_id
+            UNION
+            SELECT {MEMBER.format(group='e.group_id', slot=f'((e.expense_id + 1) % {MEMBERS_PER_GROUP})', users=USERS)}
+        ) AS m
+        """,
+        f"""
+        INSERT INTO expense_items (expense_id, name, quantity, unit_price{date_column})
+        SELECT e.expense_id, 'Item ' || n, 1 + n, round(e.amount / 4, 2){date_value}
+        FROM expenses e, generate_series(1, 2) AS n
+        """,
+        f"""
+        INSERT INTO expense_receipts (expense_id, url, bought_at{date_column})
+        SELECT e.expense_id, 'https://receipts.example.com/' || e.expense_id, e.expense_date{date_value}
+        FROM expenses e
+        WHERE e.expense_id % 4 = 0
+        """,
+    ]
+
+# The busiest case for a user is group 1's first member; group 1 is looked
+# up by name exactly the way the agent tools do.
+SAMPLE_GROUP_ID = 1
+SAMPLE_USER_ID = ((SAMPLE_GROUP_ID * 7) % USERS) + 1
+
+# (name, statement). The statements are the ones the agents and UI run, with
+# placeholders in psycopg style and columns that only exist in the SQLite mock
+# database (group_type, role) left out. The {...} clauses are filled in by
+# partition_clauses().
+QUERIES = [
+    ('ui_utils.get_receipts_data', """
+        SELECT e.expense_id, e.amount, e.currency, e.description, e.expense_date, e.location, e.type,
+               g.name AS group_name, u.name AS payer_name,
+               ei.item_id, ei.name AS item_name, ei.quantity, ei.unit_price, ei.total_price
+        FROM expenses e
+        JOIN groups g ON e.group_id = g.group_id
+        JOIN users u ON e.payer_id = u.user_id
+        LEFT JOIN expense_items ei ON e.expense_id = ei.expense_id{ei_date}
+        WHERE e.payer_id = %(user_id)s
+        ORDER BY e.expense_date DESC, e.expense_id DESC
+    """),
+    ('agent_tools.validate_group', """
+        SELECT g.group_id, g.name, g.description, g.created_at
+        FROM groups g
+        JOIN user_groups ug ON g.group_id = ug.group_id
+        WHERE LOWER(g.name) = LOWER(%(group_name)s) AND ug.user_id = %(user_id)s
+    """),
+    ('agent_tools.group_members', """
+        SELECT u.user_id, u.name, u.email
+        FROM users u
+        JOIN user_groups ug ON u.user_id = ug.user_id
+        WHERE ug.group_id = %(group_id)s
+    """),
+    ('agent_tools.get_user_groups', """
+        SELECT g.group_id, g.name, g.description, g.created_at
+        FROM groups g
+        JOIN user_groups ug ON g.group_id = ug.group_id
+        WHERE ug.user_id = %(user_id)s
+        ORDER BY g.created_at DESC
+    """),
+    ('agent_tools.get_group_balance_info', """
+        SELECT u.user_id, u.name,
+               COALESCE(SUM(CASE WHEN e.payer_id = u.user_id THEN e.amount ELSE 0 END), 0) AS paid,
+               COALESCE(SUM(es.share_amount), 0) AS owes
+        FROM users u
+        JOIN user_groups ug ON u.user_id = ug.user_id
+        LEFT JOIN expenses e ON e.group_id = ug.group_id
+        LEFT JOIN expense_shares es ON es.user_id = u.user_id AND es.expense_id = e.expense_id{es_date}
+        WHERE ug.group_id = %(group_id)s
+        GROUP BY u.user_id, u.name
+        ORDER BY u.name
+    """),
+    ('group_wallet.group_total', """
+        SELECT SUM(amount) FROM expenses WHERE group_id = %(group_id)s
+    """),
+    ('group_wallet.paid_by_member', """
+        SELECT payer_id, SUM(amount) AS total_paid
+        FROM expenses
+        WHERE group_id = %(group_id)s
+        GROUP BY payer_id
+    """),
+    ('group_wallet.share_by_member', """
+        SELECT es.user_id, SUM(es.share_amount) AS total_share
+        FROM expense_shares es
+        JOIN expenses e ON es.expense_id = e.expense_id{es_date}
+        WHERE e.group_id = %(group_id)s
+        GROUP BY es.user_id
+    """),
+    ('app.group_details_members', """
+        SELECT u.user_id, u.name AS user_name, u.email,
+               COALESCE(SUM(CASE WHEN e.payer_id = u.user_id THEN e.amount ELSE 0 END), 0) AS total_paid,
+               COALESCE(SUM(CASE WHEN es.user_id = u.user_id THEN es.share_amount ELSE 0 END), 0) AS total_owed
+        FROM users u
+        JOIN user_groups ug ON u.user_id = ug.user_id
+        LEFT JOIN expenses e ON e.group_id = ug.group_id AND e.payer_id = u.user_id
+        LEFT JOIN expense_shares es ON es.expense_id = e.expense_id AND es.user_id = u.user_id{es_date}
+        WHERE ug.group_id = %(group_id)s
+        GROUP BY u.user_id, u.name, u.email
+        ORDER BY u.name
+    """),
+    ('app.group_details_receipts', """
+        SELECT er.receipt_id, er.url, er.uploaded_at, e.expense_id, e.amount,
+               e.description AS expense_description, e.expense_date, u.name AS payer_name
+        FROM expense_receipts er
+        JOIN expenses e ON er.expense_id = e.expense_id{er_date}
+        JOIN users u ON e.payer_id = u.user_id
+        WHERE e.group_id = %(group_id)s
+        ORDER BY e.expense_date DESC, er.uploaded_at DESC
+    """),
+    # What sql_execution's user filter turns "SELECT * FROM expense_shares" into.
+    ('sql_execution.user_shares', """
+        SELECT * FROM expense_shares WHERE user_id = %(user_id)s
+    """),
+    # "How much did the group spend this month", "what do I owe for last week".
+    ('spending.group_month', """
+        SELECT SUM(amount) FROM expenses
+        WHERE group_id = %(group_id)s AND expense_date >= %(month_start)s AND expense_date < %(month_end)s
+    """),
+    ('spending.user_shares_week', """
+        SELECT es.expense_id, es.share_amount, e.description, e.expense_date
+        FROM expense_shares es
+        JOIN expenses e ON e.expense_id = es.expense_id{es_date}
+        WHERE es.user_id = %(user_id)s
+          AND e.expense_date >= %(week_start)s AND e.expense_date < %(week_end)s{es_week}
+    """),
+]
+
+# Date bounded queries and the most partitions of any one table their plans
+# may touch once expenses are partitioned by month.
+PARTITION_LIMITS = {
+    'spending.group_month': 1,
+    'spending.user_shares_week': 1,
+}
+
+PARAMS = {
+    'user_id': SAMPLE_USER_ID,
+    'group_id': SAMPLE_GROUP_ID,
+    'group_name': f'group {SAMPLE_GROUP_ID}',
+    'month_start': '2024-03-01',
+    'month_end': '2024-04-01',
+    'week_start': '2024-03-11',
+    'week_end': '2024-03-18',
+}
+
+def partition_clauses(partitioned: bool) -> dict[str, str]:
+    """
+    Once the tables are partitioned, a join to expenses on expense_id alone
+    has to probe every partition, so {es_date}, {ei_date} and {er_date} add
+    the expense_date to it. Postgres does not carry a range condition across
+    a join either, so {es_week} repeats the week's bounds for expense_shares.
+    """
+    clauses = {
+        f'{alias}_date': f' AND {alias}.expense_date = e.expense_date' if partitioned else ''
+        for alias in ('es', 'ei', 'er')
+    }
+    clauses['es_week'] = (
+        ' AND es.expense_date >= %(week_start)s AND es.expense_date < %(week_end)s' if partitioned else ''
+    )
+    return clauses
+
+def seq_scans(plan: dict, large_tables: set[str]) -> list[str]:
+    found = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in large_tables:
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child, large_tables))
+    return found
+
+def scanned_partitions(plan: dict, partitions: dict[str, str]) -> dict[str, set[str]]:
+    """
+    Maps each partitioned table to the partitions of it that the plan scans.
+    `partitions` maps partition name to parent name.
+    """
+    found: dict[str, set[str]] = dict()
+    relation = plan.get('Relation Name')
+    if relation in partitions:
+        found.setdefault(partitions[relation], set()).add(relation)
+    for child in plan.get('Plans', []):
+        for parent, names in scanned_partitions(child, partitions).items():
+            found.setdefault(parent, set()).update(names)
+    return found
+
+async def create_database(baseline_only: bool):
+    kwargs = connection_kwargs()
+    async with await AsyncConnection.connect(**{**kwargs, 'dbname': 'postgres'}, autocommit=True) as conn:
+        await conn.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(BENCH_DB_NAME)))
+        await conn.execute(
+            sql.SQL("CREATE DATABASE {} ENCODING 'UTF8' TEMPLATE template0").format(sql.Identifier(BENCH_DB_NAME))
+        )
+
+    kwargs['dbname'] = BENCH_DB_NAME
+    if baseline_only:
+        async with await AsyncConnection.connect(**kwargs, autocommit=True) as conn:
+            with open(BASELINE_PATH, encoding='utf-8') as file:
+                await conn.execute(file.read())
+    else:
+        await migrate(**kwargs)
+
+    started = time.perf_counter()
+    async with await AsyncConnection.connect(**kwargs, autocommit=True) as conn:
+        cur = await conn.execute("SELECT to_regproc('create_expense_partitions') IS NOT NULL")
+        partitioned = (await cur.fetchone())[0]
+        if partitioned:
+            # The migration only creates partitions from today on; the seeded
+            # history needs its months too, or it all lands in the defaults.
+            months = EXPENSE_DAYS // 28 + 1
+            await conn.execute("SELECT create_expense_partitions(%s, %s)", (FIRST_EXPENSE_DATE, months))
+        for statement in seed_statements(partitioned):
+            await conn.execute(statement)
+        await conn.execute("VACUUM ANALYZE")
+    print(f"Seeded {USERS} users, {GROUPS} groups, {EXPENSES} expenses in {time.perf_counter() - started:.1f}s")
+
+async def check_queries() -> int:
+    failures = 0
+    async with await AsyncConnection.connect(**{**connection_kwargs(), 'dbname': BENCH_DB_NAME}, autocommit=True) as conn:
+        cur = await conn.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples >= %s",
+            (SEQ_SCAN_MIN_ROWS,),
+        )
+        large_tables = {row[0] for row in await cur.fetchall()}
+        cur = await conn.execute(
+            "SELECT inhrelid::regclass::text, inhparent::regclass::text FROM pg_inherits"
+            " JOIN pg_class ON pg_class.oid = inhrelid WHERE pg_class.relkind = 'r'"
+        )
+        partitions = {row[0]: row[1] for row in await cur.fetchall()}
+        clauses = partition_clauses(bool(partitions))
+
+        print(f"{'query':36} {'median ms':>10} {'p95 ms':>8}  plan")
+        for name, statement in QUERIES:
+            statement = statement.format(**clauses)
+            cur = await conn.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {statement}", PARAMS)
+            plan = (await cur.fetchone())[0][0]['Plan']
+            scanned = seq_scans(plan, large_tables)
+
+            timings = []
+            for _ in range(RUNS):
+                started = time.perf_counter()
+                cur = await conn.execute(statement, PARAMS, prepare=True)
+                await cur.fetchall()
+                timings.append(1000 * (time.perf_counter() - started))
+            median = statistics.median(timings)
+            p95 = sorted(timings)[max(0, int(len(timings) * 0.95) - 1)]
+
+            problems = []
+            if scanned:
+                problems.append(f"Seq Scan on {', '.join(sorted(set(scanned)))}")
+            if median > LATENCY_BUDGET_MS:
+                problems.append(f"median over {LATENCY_BUDGET_MS:g} ms budget")
+            if name in PARTITION_LIMITS and partitions:
+                for parent, names in sorted(scanned_partitions(plan, partitions).items()):
+                    if len(names) > PARTITION_LIMITS[name]:
+                        problems.append(f"{len(names)} partitions of {parent} scanned")
+            failures += bool(problems)
+            print(f"{name:36} {median:10.2f} {p95:8.2f}  {'; '.join(problems) or 'ok'}")
+            if problems and os.getenv('BENCH_SHOW_PLANS') == '1':
+                print(json.dumps(plan, indent=2))
+    return failures
+
+async def main(argv: list[str]) -> int:
+    if '--reuse' not in argv:
+        await create_database(baseline_only='--baseline-only' in argv)
+    failures = await check_queries()
+    print(f"{failures} of {len(QUERIES)} queries failed" if failures else "All query plans ok")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,80 @@
+"""
+Checks read-your-writes across the primary and the read replica.
+
+Each round writes a row on the primary and reads it straight back, once
+through read_connection() with the write's LSN and once without it. Reads
+that carry the LSN must always see the row: from the replica when it has
+replayed the write, from the primary otherwise. Reads without it show how
+often plain replica routing would have missed a session's own write.
+
+Needs a primary and a streaming replica, e.g. the db and db-replica services
+in docker-compose.yaml, with DB_* pointing at the primary and
+DB_REPLICA_HOST / DB_REPLICA_PORT at the replica. Run from backend/:
+
+    python -m benchmarks.replica_routing
+
+BENCH_ROUNDS sets the number of rounds. Exits non-zero if any read with the
+LSN missed its row.
+"""
+import os
+import sys
+import time
+import asyncio
+from uuid import uuid4
+from fastapi import FastAPI
+
+from repository.database import init_db, shutdown_db, read_connection, current_wal_lsn
+
+ROUNDS = int(os.getenv('BENCH_ROUNDS', 200))
+
+async def read_back(app: FastAPI, email: str, min_lsn) -> tuple[bool, bool]:
+    """
+    Returns (found, served by the replica).
+    """
+    async with read_connection(app.state.db_pool, app.state.db_replica_pool, min_lsn) as conn:
+        cur = await conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM users WHERE email = %s) AS found, pg_is_in_recovery() AS replica",
+            (email,),
+        )
+        row = await cur.fetchone()
+    return row['found'], row['replica']
+
+async def main() -> int:
+    if not os.getenv('DB_REPLICA_HOST'):
+        print("DB_REPLICA_HOST is not set; every read would go to the primary")
+        return 1
+
+    app = FastAPI()
+    await init_db(app)
+    prefix = f'replica-check-{uuid4().hex[:8]}'
+    results = {'with_lsn': [0, 0, 0], 'without_lsn': [0, 0, 0]}  # found, missed, from replica
+    read_ms = {'with_lsn': 0.0, 'without_lsn': 0.0}
+    try:
+        for i in range(ROUNDS):
+            for mode in ('with_lsn', 'without_lsn'):
+                email = f'{prefix}-{mode}-{i}@example.com'
+                async with app.state.db_pool.connection() as conn:
+                    await conn.execute(
+                        "INSERT INTO users (name, email, password_hash) VALUES ('Replica check', %s, '')",
+                        (email,),
+                    )
+                    await conn.commit()
+                    lsn = await current_wal_lsn(conn)
+
+                started = time.perf_counter()
+                found, replica = await read_back(app, email, lsn if mode == 'with_lsn' else None)
+                read_ms[mode] += 1000 * (time.perf_counter() - started)
+                results[mode][0 if found else 1] += 1
+                results[mode][2] += replica
+    finally:
+        async with app.state.db_pool.connection() as conn:
+            await conn.execute("DELETE FROM users WHERE email LIKE %s", (f'{prefix}-%',))
+        await shutdown_db(app)
+
+    print(f"{'reads':14}{'found':>8}{'missed':>8}{'replica':>9}{'avg ms':>9}")
+    for mode, (found, missed, replica) in results.items():
+        print(f"{mode:14}{found:>8}{missed:>8}{replica:>9}{read_ms[mode] / ROUNDS:>9.2f}")
+    return 1 if results['with_lsn'][1] else 0
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,152 @@
+"""
+Counts Redis round trips and new Redis connections per HTTP request for the
+session middleware, before (sync client per request, eager load, write
+through) and after (shared async pool, lazy load, pipelined flush). The
+"before" numbers include the handshake commands redis-py sends on every new
+connection.
+
+Needs a Redis at REDIS_HOST/REDIS_PORT. Run from backend/:
+
+    python -m benchmarks.session_roundtrips
+"""
+import os
+import redis
+import redis.asyncio
+from uuid import uuid4
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+
+from services.sessions import init_session
+
+class Counter:
+    def __init__(self):
+        self.round_trips = 0
+        self.connects = 0
+
+    def install(self):
+        counter = self
+        for connection_class in (redis.connection.Connection, redis.asyncio.connection.Connection):
+            send = connection_class.send_packed_command
+            connect = connection_class.connect
+
+            if connection_class is redis.connection.Connection:
+                def counted_send(self, *args, __send=send, **kwargs):
+                    counter.round_trips += 1
+                    return __send(self, *args, **kwargs)
+
+                def counted_connect(self, *args, __connect=connect, **kwargs):
+                    if not self.is_connected:
+                        counter.connects += 1
+                    return __connect(self, *args, **kwargs)
+            else:
+                async def counted_send(self, *args, __send=send, **kwargs):
+                    counter.round_trips += 1
+                    return await __send(self, *args, **kwargs)
+
+                async def counted_connect(self, *args, __connect=connect, **kwargs):
+                    if not self.is_connected:
+                        counter.connects += 1
+                    return await __connect(self, *args, **kwargs)
+
+            connection_class.send_packed_command = counted_send
+            connection_class.connect = counted_connect
+
+    def take(self):
+        taken = (self.round_trips, self.connects)
+        self.round_trips = 0
+        self.connects = 0
+        return taken
+
+class LegacySessionData:
+    """The request-time behaviour of SessionData before the async store."""
+    def __init__(self, session_id: str, redis_client: redis.Redis, ttl: int):
+        self._session_id = session_id
+        self._redis = redis_client
+        self._ttl = ttl
+        if redis_client.exists(session_id):
+            self._data = redis_client.hgetall(session_id)
+        else:
+            redis_client.hset(session_id, 'session_id', session_id)
+            self._data = {'session_id': session_id}
+
+    def __setitem__(self, key, value):
+        self._data[key] = str(value)
+        self._redis.hset(self._session_id, key, str(value))
+        self._redis.expire(self._session_id, self._ttl)
+
+    def __getitem__(self, key):
+        return self._data.get(key, '')
+
+    async def load(self):
+        return self
+
+async def legacy_init_session(request: Request, call_next) -> Response:
+    redis_client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)), db=0, decode_responses=True)
+    new_session = 'session_id' not in request.cookies
+    session_id = str(uuid4()) if new_session else request.cookies['session_id']
+    session = LegacySessionData(session_id=session_id, redis_client=redis_client, ttl=3600)
+    if new_session:
+        session['user_id'] = '123'
+    request.state.session = session
+    response = await call_next(request)
+    if new_session:
+        response.set_cookie(key='session_id', value=session_id)
+    return response
+
+def build_app(middleware) -> FastAPI:
+    app = FastAPI()
+    app.middleware("http")(middleware)
+
+    @app.get("/home")
+    async def home():
+        return {}
+
+    @app.get("/me")
+    async def me(request: Request):
+        session = await request.state.session.load()
+        return {'user_id': session['user_id']}
+
+    @app.get("/login")
+    async def login(request: Request):
+        request.state.session['user_id'] = '42'
+        return {}
+
+    return app
+
+SCENARIOS = [
+    ('first visit, /home', '/home', False),
+    ('/home with session', '/home', True),
+    ('/me reads user_id', '/me', True),
+    ('/login writes user_id', '/login', True),
+]
+
+def run(middleware, counter: Counter, requests_per_scenario: int) -> dict:
+    results = dict()
+    with TestClient(build_app(middleware)) as client:
+        client.get('/home')
+        session_id = client.cookies['session_id']
+        for name, path, with_cookie in SCENARIOS:
+            counter.take()
+            for _ in range(requests_per_scenario):
+                client.cookies.clear()
+                if with_cookie:
+                    client.cookies.set('session_id', session_id)
+                client.get(path)
+            round_trips, connects = counter.take()
+            results[name] = (round_trips / requests_per_scenario, connects / requests_per_scenario)
+    return results
+
+def main():
+    requests_per_scenario = int(os.getenv('BENCH_REQUESTS', 200))
+    counter = Counter()
+    counter.install()
+    before = run(legacy_init_session, counter, requests_per_scenario)
+    after = run(init_session, counter, requests_per_scenario)
+
+    print(f"{'scenario':<26}{'round trips/req':>24}{'new connections/req':>28}")
+    print(f"{'':<26}{'before':>12}{'after':>12}{'before':>14}{'after':>14}")
+    for name, _, _ in SCENARIOS:
+        print(f"{name:<26}{before[name][0]:>12.2f}{after[name][0]:>12.2f}{before[name][1]:>14.2f}{after[name][1]:>14.2f}")
+
+if __name__ == "__main__":
+    main()
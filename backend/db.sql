@@ -161,9 +161,9 @@ CREATE TABLE expense_receipts (
     -- url: The URL where the receipt image or file is stored.
     url           TEXT NOT NULL,
     -- uploaded_at: A timestamp recording when the receipt was uploaded.
-    uploaded_at   TIMESTAMP DEFAULT now()
-
-    bought_at TIMESTAMP
+    uploaded_at   TIMESTAMP DEFAULT now(),
+    -- bought_at: When the purchase on the receipt was made, if known.
+    bought_at     TIMESTAMP
 );
 
 --
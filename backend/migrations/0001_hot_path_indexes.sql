@@ -0,0 +1,36 @@
+-- migrate: no-transaction
+--
+-- Secondary indexes for the queries the agent tools and UI endpoints run on
+-- every request. Built CONCURRENTLY so applying this to a live database does
+-- not block writes; IF NOT EXISTS makes a re-run after a failure safe.
+--
+
+-- Expenses of a group, newest first, and per group totals. payer_id and
+-- amount are included so the group balance queries can use index-only scans.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS expenses_group_id_expense_date_idx
+    ON expenses (group_id, expense_date DESC)
+    INCLUDE (payer_id, amount);
+
+-- A user's own expenses, in the order the receipts view lists them.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS expenses_payer_id_expense_date_idx
+    ON expenses (payer_id, expense_date DESC, expense_id DESC);
+
+-- The primary key (expense_id, user_id) already serves lookups by expense.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS expense_shares_user_id_idx
+    ON expense_shares (user_id)
+    INCLUDE (share_amount);
+
+-- The primary key (user_id, group_id) already serves a user's groups; this
+-- serves a group's members.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS user_groups_group_id_idx
+    ON user_groups (group_id, user_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS expense_items_expense_id_idx
+    ON expense_items (expense_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS expense_receipts_expense_id_idx
+    ON expense_receipts (expense_id);
+
+-- Group lookup by name is case insensitive: WHERE LOWER(name) = LOWER(...).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS groups_lower_name_idx
+    ON groups (LOWER(name));
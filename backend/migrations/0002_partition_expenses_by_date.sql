@@ -0,0 +1,204 @@
+--
+-- Range partitions expenses, expense_shares and expense_items by expense_date,
+-- one partition per month, so date bounded queries ("last week", "this month")
+-- only touch the partitions for those months.
+--
+-- A partitioned table's unique keys must contain the partition key, so
+-- expenses is keyed on (expense_id, expense_date) and the tables that point at
+-- an expense carry its expense_date as well. Writers must now set
+-- expense_date on expense_shares, expense_items and expense_receipts rows.
+--
+-- Rows dated outside every monthly partition land in the table's _default
+-- partition. create_expense_partitions() adds the monthly partitions;
+-- the backend calls it on startup and then every few hours for the coming
+-- months (repository/database.py).
+--
+
+CREATE OR REPLACE FUNCTION create_expense_partitions(start_month DATE, months INTEGER)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start    DATE;
+    month_end      DATE;
+    parent         TEXT;
+    partition_name TEXT;
+    in_default     BOOLEAN;
+    created        INTEGER := 0;
+BEGIN
+    FOR i IN 0 .. months - 1 LOOP
+        month_start := (date_trunc('month', start_month) + make_interval(months => i))::DATE;
+        month_end := (month_start + INTERVAL '1 month')::DATE;
+
+        FOREACH parent IN ARRAY ARRAY['expenses', 'expense_shares', 'expense_items'] LOOP
+            partition_name := format('%s_p%s', parent, to_char(month_start, 'YYYY_MM'));
+            CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+            -- A new partition cannot take over rows already sitting in the
+            -- default partition; those months stay in the default until the
+            -- rows are moved by hand.
+            EXECUTE format(
+                'SELECT EXISTS (SELECT 1 FROM %I WHERE expense_date >= %L AND expense_date < %L)',
+                parent || '_default', month_start, month_end
+            ) INTO in_default;
+            IF in_default THEN
+                RAISE NOTICE 'Not creating %: %_default has rows for that month', partition_name, parent;
+                CONTINUE;
+            END IF;
+
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, parent, month_start, month_end
+            );
+            created := created + 1;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END;
+$$;
+
+--
+-- Move the unpartitioned tables aside. Their constraint and index names are
+-- released so the new tables can reuse them, and the id sequences are kept.
+--
+ALTER TABLE expense_receipts DROP CONSTRAINT expense_receipts_expense_id_fkey;
+
+ALTER TABLE expense_shares RENAME TO expense_shares_unpartitioned;
+ALTER TABLE expense_shares_unpartitioned RENAME CONSTRAINT expense_shares_pkey TO expense_shares_unpartitioned_pkey;
+DROP INDEX IF EXISTS expense_shares_user_id_idx;
+
+ALTER TABLE expense_items RENAME TO expense_items_unpartitioned;
+ALTER TABLE expense_items_unpartitioned RENAME CONSTRAINT expense_items_pkey TO expense_items_unpartitioned_pkey;
+ALTER SEQUENCE expense_items_item_id_seq OWNED BY NONE;
+DROP INDEX IF EXISTS expense_items_expense_id_idx;
+
+ALTER TABLE expenses RENAME TO expenses_unpartitioned;
+ALTER TABLE expenses_unpartitioned RENAME CONSTRAINT expenses_pkey TO expenses_unpartitioned_pkey;
+ALTER SEQUENCE expenses_expense_id_seq OWNED BY NONE;
+DROP INDEX IF EXISTS expenses_group_id_expense_date_idx;
+DROP INDEX IF EXISTS expenses_payer_id_expense_date_idx;
+
+--
+-- Partitioned tables, column for column the same as in db.sql, plus
+-- expense_date on the dependent tables. Foreign keys are added once the rows
+-- are copied, so each is validated in one pass instead of row by row.
+--
+CREATE TABLE expenses (
+    expense_id    BIGINT NOT NULL DEFAULT nextval('expenses_expense_id_seq'),
+    group_id      BIGINT NOT NULL,
+    payer_id      BIGINT NOT NULL,
+    amount        NUMERIC(12,2) NOT NULL,
+    currency      CHAR(3) NOT NULL DEFAULT 'INR',
+    description   TEXT,
+    expense_date  DATE NOT NULL,
+    location      TEXT,
+    type          expense_type NOT NULL DEFAULT 'expense',
+    created_at    TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (expense_id, expense_date)
+) PARTITION BY RANGE (expense_date);
+ALTER SEQUENCE expenses_expense_id_seq OWNED BY expenses.expense_id;
+
+CREATE TABLE expense_shares (
+    expense_id   BIGINT NOT NULL,
+    user_id      BIGINT NOT NULL,
+    share_amount NUMERIC(12,2) NOT NULL,
+    -- expense_date: The parent expense's date, which decides the partition.
+    expense_date DATE NOT NULL,
+    PRIMARY KEY (expense_id, user_id, expense_date)
+) PARTITION BY RANGE (expense_date);
+
+CREATE TABLE expense_items (
+    item_id      BIGINT NOT NULL DEFAULT nextval('expense_items_item_id_seq'),
+    expense_id   BIGINT NOT NULL,
+    name         TEXT NOT NULL,
+    quantity     NUMERIC(12,2) DEFAULT 1,
+    unit_price   NUMERIC(12,2) NOT NULL,
+    total_price  NUMERIC(12,2) GENERATED ALWAYS AS (quantity * unit_price) STORED,
+    -- expense_date: The parent expense's date, which decides the partition.
+    expense_date DATE NOT NULL,
+    PRIMARY KEY (item_id, expense_date)
+) PARTITION BY RANGE (expense_date);
+ALTER SEQUENCE expense_items_item_id_seq OWNED BY expense_items.item_id;
+
+CREATE TABLE expenses_default PARTITION OF expenses DEFAULT;
+CREATE TABLE expense_shares_default PARTITION OF expense_shares DEFAULT;
+CREATE TABLE expense_items_default PARTITION OF expense_items DEFAULT;
+
+-- Monthly partitions for every month that has expenses, through three
+-- months from now.
+SELECT create_expense_partitions(
+    start_month,
+    (EXTRACT(YEAR FROM age(date_trunc('month', now()), start_month)) * 12
+     + EXTRACT(MONTH FROM age(date_trunc('month', now()), start_month)))::INTEGER + 4
+)
+FROM (
+    SELECT date_trunc('month', LEAST(COALESCE(MIN(expense_date), now()), now()))::DATE AS start_month
+    FROM expenses_unpartitioned
+) AS bounds;
+
+--
+-- Copy the existing rows across and drop the old tables.
+--
+INSERT INTO expenses (expense_id, group_id, payer_id, amount, currency, description, expense_date, location, type, created_at)
+SELECT expense_id, group_id, payer_id, amount, currency, description, expense_date, location, type, created_at
+FROM expenses_unpartitioned;
+
+INSERT INTO expense_shares (expense_id, user_id, share_amount, expense_date)
+SELECT es.expense_id, es.user_id, es.share_amount, e.expense_date
+FROM expense_shares_unpartitioned es
+JOIN expenses_unpartitioned e ON e.expense_id = es.expense_id;
+
+INSERT INTO expense_items (item_id, expense_id, name, quantity, unit_price, expense_date)
+SELECT ei.item_id, ei.expense_id, ei.name, ei.quantity, ei.unit_price, e.expense_date
+FROM expense_items_unpartitioned ei
+JOIN expenses_unpartitioned e ON e.expense_id = ei.expense_id;
+
+ALTER TABLE expense_receipts ADD COLUMN expense_date DATE;
+UPDATE expense_receipts er
+SET expense_date = e.expense_date
+FROM expenses_unpartitioned e
+WHERE e.expense_id = er.expense_id;
+ALTER TABLE expense_receipts ALTER COLUMN expense_date SET NOT NULL;
+
+DROP TABLE expense_shares_unpartitioned;
+DROP TABLE expense_items_unpartitioned;
+DROP TABLE expenses_unpartitioned;
+
+ALTER TABLE expenses
+    ADD CONSTRAINT expenses_group_id_fkey FOREIGN KEY (group_id) REFERENCES groups (group_id),
+    ADD CONSTRAINT expenses_payer_id_fkey FOREIGN KEY (payer_id) REFERENCES users (user_id);
+
+ALTER TABLE expense_shares
+    ADD CONSTRAINT expense_shares_expense_id_fkey
+        FOREIGN KEY (expense_id, expense_date) REFERENCES expenses (expense_id, expense_date),
+    ADD CONSTRAINT expense_shares_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (user_id);
+
+ALTER TABLE expense_items
+    ADD CONSTRAINT expense_items_expense_id_fkey
+        FOREIGN KEY (expense_id, expense_date) REFERENCES expenses (expense_id, expense_date);
+
+ALTER TABLE expense_receipts
+    ADD CONSTRAINT expense_receipts_expense_id_fkey
+        FOREIGN KEY (expense_id, expense_date) REFERENCES expenses (expense_id, expense_date);
+
+--
+-- The 0001 indexes, now on the partitioned tables (and so on every
+-- partition, current and future).
+--
+CREATE INDEX expenses_group_id_expense_date_idx
+    ON expenses (group_id, expense_date DESC)
+    INCLUDE (payer_id, amount);
+
+CREATE INDEX expenses_payer_id_expense_date_idx
+    ON expenses (payer_id, expense_date DESC, expense_id DESC);
+
+CREATE INDEX expense_shares_user_id_idx
+    ON expense_shares (user_id)
+    INCLUDE (share_amount);
+
+CREATE INDEX expense_items_expense_id_idx
+    ON expense_items (expense_id);
+
+ANALYZE expenses;
+ANALYZE expense_shares;
+ANALYZE expense_items;
@@ -0,0 +1,23 @@
+--
+-- Columns for writing bills extracted from receipt images
+-- (process_live_receipt in the agents).
+--
+-- expense_receipts.content_hash identifies the images a bill was extracted
+-- from: a SHA-256 of the frames without their metadata, in any order, as the
+-- agents' extraction cache keys them. It is unique, so saving the same
+-- receipt twice finds the expense the first save created instead of adding
+-- another, while two receipts that only look alike stay two expenses;
+-- receipts entered without images leave it NULL. expense_receipts is not partitioned, so a plain
+-- unique index works.
+--
+-- expense_items.category is the item type the extraction assigns
+-- (groceries, utilities, ...). Adding a nullable column without a default
+-- only touches the catalog, on every partition at once.
+--
+
+ALTER TABLE expense_receipts ADD COLUMN content_hash TEXT;
+
+CREATE UNIQUE INDEX expense_receipts_content_hash_key
+    ON expense_receipts (content_hash);
+
+ALTER TABLE expense_items ADD COLUMN category TEXT;
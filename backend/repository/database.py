@@ -1,49 +1,367 @@
 import os
-import threading
-from psycopg2.extras import RealDictCursor
-from psycopg2 import pool
-from typing import Union
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from typing import AsyncIterable, AsyncIterator, Iterable, Union
 from fastapi import FastAPI
+from repository.cache import TTLCache
+from repository.migrations import migrate
 
-class BlockingConnectionPool(pool.SimpleConnectionPool):
-    def __init__(self, minconn: int, maxconn: int, *args, **kwargs):
-        super().__init__(minconn, maxconn, *args, **kwargs)
-        # semaphore count = how many connections total we can hand out
-        self._sem = threading.BoundedSemaphore(maxconn)
+GET_USER_BY_EMAIL = """
+    SELECT user_id
+    FROM users
+    WHERE email = %s
+"""
 
-    def getconn(self, *args, **kwargs):
-        # block here if no tokens available
-        self._sem.acquire()
-        try:
-            return super().getconn(*args, **kwargs)
-        except Exception:
-            # if something goes wrong, release our semaphore slot
-            self._sem.release()
-            raise
+GET_LOGIN_BY_EMAIL = """
+    SELECT user_id, personal_group_id
+    FROM users
+    WHERE email = %s
+"""
+
+# Whether this server has everything up to a given WAL position. On the
+# primary pg_last_wal_replay_lsn() is NULL and its own position is used.
+REPLAYED_UP_TO = """
+    SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn()) >= %s::pg_lsn AS caught_up
+"""
+
+# How long a read may wait for the replica to replay the session's last
+# write before it goes to the primary instead.
+REPLICA_MAX_WAIT = float(os.getenv('DB_REPLICA_MAX_WAIT_MS', 200)) / 1000
+REPLICA_POLL_INTERVAL = 0.01
+
+# How far ahead monthly expense partitions are kept, and how often that is
+# checked. A check runs months before a partition is needed, so a missed one
+# or two (a restart, the database briefly down) cost nothing.
+PARTITION_MONTHS_AHEAD = int(os.getenv('DB_PARTITION_MONTHS_AHEAD', 3))
+PARTITION_CHECK_INTERVAL = float(os.getenv('DB_PARTITION_CHECK_INTERVAL', 6 * 3600))
+# Any constant works; it only has to be the same for every process that
+# creates partitions in this database.
+PARTITION_LOCK_ID = 7301127
+
+# Resolves a login to (user_id, personal_group_id) in one statement. For a new
+# email both ids are drawn from their sequences up front, so the user row can
+# point at its personal group in the same INSERT; the foreign keys between
+# the two rows are checked at the end of the statement, once both exist.
+UPSERT_LOGIN = """
+    WITH existing AS (
+        SELECT user_id, personal_group_id
+        FROM users
+        WHERE email = %(email)s
+    ), new_ids AS (
+        SELECT nextval(pg_get_serial_sequence('users', 'user_id')) AS user_id,
+               nextval(pg_get_serial_sequence('groups', 'group_id')) AS group_id
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+    ), new_user AS (
+        INSERT INTO users (user_id, name, email, password_hash, personal_group_id)
+        SELECT user_id, %(name)s, %(email)s, %(password_hash)s, group_id
+        FROM new_ids
+        ON CONFLICT (email) DO NOTHING
+        RETURNING user_id, personal_group_id
+    ), new_group AS (
+        INSERT INTO groups (group_id, name, description, created_by)
+        SELECT personal_group_id, 'Personal Group', 'Auto-created personal workspace', user_id
+        FROM new_user
+    )
+    SELECT user_id, personal_group_id, false AS created FROM existing
+    UNION ALL
+    SELECT user_id, personal_group_id, true AS created FROM new_user
+"""
+
+# Set based counterpart of UPSERT_LOGIN for rows COPY'd into user_import.
+# Duplicate emails within a batch collapse to one user; emails that already
+# have an account are returned with created = false.
+PROVISION_IMPORTED_USERS = """
+    WITH src AS (
+        SELECT DISTINCT ON (email) name, email, password_hash
+        FROM user_import
+        ORDER BY email
+    ), seqs AS MATERIALIZED (
+        SELECT pg_get_serial_sequence('users', 'user_id')::regclass AS users_seq,
+               pg_get_serial_sequence('groups', 'group_id')::regclass AS groups_seq
+    ), new_ids AS (
+        SELECT src.name, src.email, src.password_hash,
+               nextval(seqs.users_seq) AS user_id,
+               nextval(seqs.groups_seq) AS group_id
+        FROM src, seqs
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.email = src.email)
+    ), new_users AS (
+        INSERT INTO users (user_id, name, email, password_hash, personal_group_id)
+        SELECT user_id, name, email, password_hash, group_id
+        FROM new_ids
+        ON CONFLICT (email) DO NOTHING
+        RETURNING user_id, email, personal_group_id
+    ), new_groups AS (
+        INSERT INTO groups (group_id, name, description, created_by)
+        SELECT personal_group_id, 'Personal Group', 'Auto-created personal workspace', user_id
+        FROM new_users
+    )
+    SELECT email, user_id, personal_group_id, true AS created FROM new_users
+    UNION ALL
+    SELECT u.email, u.user_id, u.personal_group_id, false AS created
+    FROM users u
+    JOIN src ON src.email = u.email
+"""
+
+# email -> {'user_id', 'personal_group_id'}. Both ids are fixed once a user
+# exists, so entries never go stale; the TTL only bounds memory.
+login_cache = TTLCache(
+    max_entries=int(os.getenv('LOGIN_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('LOGIN_CACHE_TTL', 900)),
+)
 
-    def putconn(self, conn, *args, **kwargs):
+# Statements prepared on every pooled connection as soon as it is opened, so
+# the first login served by a fresh connection does not pay for parse/plan.
+WARMUP_STATEMENTS = [
+    (GET_USER_BY_EMAIL, ('',)),
+    (GET_LOGIN_BY_EMAIL, ('',)),
+]
+
+class PoolMetrics:
+    """
+    Running counters for connection checkouts from the pool.
+
+    wait time:         how long callers queued for a free connection.
+    checkout duration: how long a connection was held before being returned.
+    saturation:        connections in use / pool max size.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.checkout_total = 0.0
+        self.checkout_max = 0.0
+
+    def on_checkout(self, waited: float):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def on_checkin(self, held: float):
+        self.in_use -= 1
+        self.checkout_total += held
+        self.checkout_max = max(self.checkout_max, held)
+
+    def snapshot(self) -> dict:
+        checkouts = self.checkouts or 1
+        return {
+            'checkouts': self.checkouts,
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'max_size': self.max_size,
+            'saturation': self.in_use / self.max_size,
+            'peak_saturation': self.peak_in_use / self.max_size,
+            'wait_avg_ms': 1000 * self.wait_total / checkouts,
+            'wait_max_ms': 1000 * self.wait_max,
+            'checkout_avg_ms': 1000 * self.checkout_total / checkouts,
+            'checkout_max_ms': 1000 * self.checkout_max,
+        }
+
+class InstrumentedConnectionPool(AsyncConnectionPool):
+    """
+    asyncio-aware connection pool. Callers waiting for a connection suspend
+    on the event loop instead of blocking the worker thread, and every
+    checkout is recorded in `metrics`.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics(self.max_size)
+        self._checked_out: dict[int, float] = {}
+
+    async def getconn(self, timeout: Union[float, None] = None) -> AsyncConnection:
+        requested_at = time.perf_counter()
+        conn = await super().getconn(timeout=timeout)
+        acquired_at = time.perf_counter()
+        self._checked_out[id(conn)] = acquired_at
+        self.metrics.on_checkout(acquired_at - requested_at)
+        return conn
+
+    async def putconn(self, conn: AsyncConnection) -> None:
+        acquired_at = self._checked_out.pop(id(conn), None)
         try:
-            super().putconn(conn, *args, **kwargs)
+            await super().putconn(conn)
         finally:
-            # always release our slot so others can acquire
-            self._sem.release()
+            if acquired_at is not None:
+                self.metrics.on_checkin(time.perf_counter() - acquired_at)
 
-async def init_db(app: FastAPI):
-    app.state.db_pool = BlockingConnectionPool(
-        minconn=1,
-        maxconn=10,
-        database=os.getenv('DB_NAME', 'notfound'), 
-        user=os.getenv('DB_SUPER_USER', 'notfound'), 
-        password=os.getenv('DB_PASSWORD', 'notfound'), 
-        host=os.getenv('DB_HOST', 'localhost'), 
-        port=os.getenv('DB_PORT', 5432)
+async def _warm_up_connection(conn: AsyncConnection):
+    # Runs once per new connection, before the pool hands it out.
+    for statement, params in WARMUP_STATEMENTS:
+        await conn.execute(statement, params, prepare=True)
+    await conn.commit()
+
+def connection_kwargs() -> dict:
+    return {
+        'dbname': os.getenv('DB_NAME', 'notfound'),
+        'user': os.getenv('DB_SUPER_USER', 'notfound'),
+        'password': os.getenv('DB_PASSWORD', 'notfound'),
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': os.getenv('DB_PORT', 5432),
+        # The app's queries are small lookups. With expenses split into
+        # monthly partitions, a query that is not date bounded plans an
+        # Append over every partition, which crosses the parallel cost
+        # thresholds; launching the workers then costs more than the query.
+        'options': f"-c max_parallel_workers_per_gather={os.getenv('DB_PARALLEL_WORKERS_PER_GATHER', 0)}",
+    }
+
+def replica_connection_kwargs() -> Union[dict, None]:
+    """
+    Connection settings for the read replica, or None when DB_REPLICA_HOST is
+    not set. Database and credentials default to the primary's.
+    """
+    if not os.getenv('DB_REPLICA_HOST'):
+        return None
+    return {
+        **connection_kwargs(),
+        'dbname': os.getenv('DB_REPLICA_NAME', os.getenv('DB_NAME', 'notfound')),
+        'host': os.getenv('DB_REPLICA_HOST'),
+        'port': os.getenv('DB_REPLICA_PORT', os.getenv('DB_PORT', 5432)),
+    }
+
+def _create_pool(kwargs: dict, prefix: str) -> InstrumentedConnectionPool:
+    return InstrumentedConnectionPool(
+        min_size=int(os.getenv(f'{prefix}_MIN_SIZE', 4)),
+        max_size=int(os.getenv(f'{prefix}_MAX_SIZE', 10)),
+        timeout=float(os.getenv(f'{prefix}_TIMEOUT', 30)),
+        open=False,
+        configure=_warm_up_connection,
+        kwargs={
+            **kwargs,
+            # Prepare every statement server side on first use.
+            'prepare_threshold': 0,
+            'row_factory': dict_row,
+        },
     )
 
+async def init_db(app: FastAPI):
+    # Bring the schema up to date before any pooled connection prepares
+    # statements against it. Opt in: a migration can rewrite big tables
+    # (0002 copies every expense), which is for `python -m
+    # repository.migrations` at deploy time, not for every worker's start.
+    if os.getenv('DB_MIGRATE_ON_STARTUP', '0') == '1':
+        await migrate(**connection_kwargs())
+
+    pool = _create_pool(connection_kwargs(), 'DB_POOL')
+    # Fill the pool up to min_size before the app starts taking requests.
+    await pool.open(wait=True)
+    app.state.db_pool = pool
+
+    # Read-only work goes to the replica when there is one; see
+    # read_connection().
+    app.state.db_replica_pool = None
+    replica_kwargs = replica_connection_kwargs()
+    if replica_kwargs is not None:
+        replica_pool = _create_pool(replica_kwargs, 'DB_REPLICA_POOL')
+        await replica_pool.open(wait=True)
+        app.state.db_replica_pool = replica_pool
+
+    await create_expense_partitions(pool)
+    app.state.partition_task = asyncio.create_task(_keep_expense_partitions(pool))
+
+async def create_expense_partitions(db_pool: InstrumentedConnectionPool, months_ahead: Union[int, None] = None) -> int:
+    """
+    Makes sure the monthly expense partitions exist from the current month
+    through `months_ahead` months from now (DB_PARTITION_MONTHS_AHEAD,
+    default 3), so new expenses never fall through to the default partition.
+    Returns the number of partitions created.
+
+    Workers doing this at the same time are serialised with an advisory
+    lock, so only one of them creates a given partition.
+    """
+    if months_ahead is None:
+        months_ahead = PARTITION_MONTHS_AHEAD
+    async with db_pool.connection() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_ID,))
+            cur = await conn.execute(
+                "SELECT create_expense_partitions(date_trunc('month', now())::date, %s) AS created",
+                (months_ahead + 1,),
+            )
+            created = (await cur.fetchone())['created']
+    if created:
+        print(f"Created {created} expense partitions")
+    return created
+
+async def _keep_expense_partitions(db_pool: InstrumentedConnectionPool):
+    # A long running process would otherwise outlive the partitions made at
+    # startup, and the default partition, once it holds rows for a month,
+    # keeps that month's partition from ever being created.
+    while True:
+        await asyncio.sleep(PARTITION_CHECK_INTERVAL)
+        try:
+            await create_expense_partitions(db_pool)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Creating expense partitions failed: {e}")
+
 async def shutdown_db(app: FastAPI):
-    app.state.db_pool.closeall()
+    app.state.partition_task.cancel()
+    try:
+        await app.state.partition_task
+    except asyncio.CancelledError:
+        pass
+    if app.state.db_replica_pool is not None:
+        await app.state.db_replica_pool.close()
+    await app.state.db_pool.close()
+
+def get_pool_metrics(db_pool: InstrumentedConnectionPool) -> dict:
+    """
+    Returns the checkout metrics along with psycopg's own pool counters.
+    """
+    return {**db_pool.metrics.snapshot(), 'pool': db_pool.get_stats()}
+
+async def current_wal_lsn(conn: AsyncConnection) -> str:
+    """
+    The primary's WAL position. Taken after a write commits, it is the point
+    a replica has to reach before it can serve that write back.
+    """
+    cur = await conn.execute("SELECT pg_current_wal_lsn()::text AS lsn")
+    return (await cur.fetchone())['lsn']
+
+async def _replica_caught_up(conn: AsyncConnection, min_lsn: str) -> bool:
+    deadline = time.monotonic() + REPLICA_MAX_WAIT
+    while True:
+        cur = await conn.execute(REPLAYED_UP_TO, (min_lsn,))
+        caught_up = (await cur.fetchone())['caught_up']
+        # End the snapshot so the next poll, and the caller, see new data.
+        await conn.commit()
+        if caught_up or time.monotonic() >= deadline:
+            return caught_up
+        await asyncio.sleep(REPLICA_POLL_INTERVAL)
 
-def create_user(
-    db_pool: BlockingConnectionPool,
+@asynccontextmanager
+async def read_connection(
+    db_pool: InstrumentedConnectionPool,
+    replica_pool: Union[InstrumentedConnectionPool, None],
+    min_lsn: Union[str, None] = None
+) -> AsyncIterator[AsyncConnection]:
+    """
+    Yields a connection for read-only work. It comes from the replica pool
+    when there is one, and from the primary otherwise.
+
+    `min_lsn` is the session's last write (current_wal_lsn() after its
+    commit). The replica is used only once it has replayed that far, waiting
+    up to DB_REPLICA_MAX_WAIT_MS, so a session always reads its own writes.
+    """
+    if replica_pool is not None:
+        async with replica_pool.connection() as conn:
+            if min_lsn is None or await _replica_caught_up(conn, min_lsn):
+                yield conn
+                return
+    async with db_pool.connection() as conn:
+        yield conn
+
+async def create_user(
+    db_pool: InstrumentedConnectionPool,
     user_name: str,
     user_email: str,
     access_token: str,
@@ -51,22 +369,21 @@ def create_user(
 ) -> str:
     """
     Inserts a new user and a “Personal Group” for them, in one atomic transaction.
-    
+
     Args:
       user_name:    full name of the user
       user_email:   their email address
       access_token: the OAuth token (we're storing this as password_hash here)
       google_wallet_cred:  Wallet credential string
-      
+
     Returns:
       dict with 'user_id' and 'group_id' of the newly created records.
     """
-    conn = db_pool.getconn()
-    try:
-        # psycopg2 will automatically start a transaction on first execute
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    # The pool's connection context commits on success and rolls back on error.
+    async with db_pool.connection() as conn:
+        async with conn.cursor() as cur:
             # 1) Insert user, returning user_id
-            cur.execute(
+            await cur.execute(
                 """
                 INSERT INTO users (name, email, password_hash, google_wallet_cred)
                 VALUES (%s, %s, %s, %s)
@@ -74,11 +391,11 @@ def create_user(
                 """,
                 (user_name, user_email, access_token, google_wallet_cred)
             )
-            fetchone = cur.fetchone()
+            fetchone = await cur.fetchone()
             if fetchone != None: user_id = fetchone['user_id']
 
             # 2) Insert the personal group for them
-            cur.execute(
+            await cur.execute(
                 """
                 INSERT INTO groups (name, description, created_by)
                 VALUES (%s, %s, %s)
@@ -88,11 +405,11 @@ def create_user(
                  "Auto-created personal workspace",
                  user_id)
             )
-            fetchone = cur.fetchone()
+            fetchone = await cur.fetchone()
             if fetchone != None: group_id = fetchone['group_id']
 
             # 3) Update user.personal_group_id
-            cur.execute(
+            await cur.execute(
                 """
                 UPDATE users
                 SET personal_group_id = %s
@@ -101,35 +418,128 @@ def create_user(
                 (group_id, user_id)
             )
 
-        # commit if all went well
-        conn.commit()
         return user_id
 
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        db_pool.putconn(conn)
-
-def get_user_by_email(
-    db_pool: BlockingConnectionPool,
+async def get_user_by_email(
+    db_pool: InstrumentedConnectionPool,
     user_email: str
 ) -> Union[str, None]:
     """
     Fetches a user record by email. Returns a dict of user fields or None if not found.
     """
-    conn = db_pool.getconn()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
+    async with db_pool.connection() as conn:
+        cur = await conn.execute(GET_USER_BY_EMAIL, (user_email,), prepare=True)
+        user = await cur.fetchone()
+        return user['user_id'] if user else None
+
+async def upsert_user_login(
+    db_pool: InstrumentedConnectionPool,
+    user_name: str,
+    user_email: str,
+    access_token: str,
+    replica_pool: Union[InstrumentedConnectionPool, None] = None
+) -> dict:
+    """
+    Returns the user for this email, creating the user and their personal
+    group first if needed, in a single statement and round trip.
+
+    With a replica pool, returning users are looked up there and only new
+    (or not yet replicated) emails reach the primary, where the upsert finds
+    any user the replica has not caught up with.
+
+    Returns:
+      dict with 'user_id' and 'personal_group_id'.
+    """
+    cached = login_cache.get(user_email)
+    if cached is not None:
+        return cached
+
+    if replica_pool is not None:
+        async with replica_pool.connection() as conn:
+            cur = await conn.execute(GET_LOGIN_BY_EMAIL, (user_email,), prepare=True)
+            row = await cur.fetchone()
+        if row is not None:
+            user = {'user_id': row['user_id'], 'personal_group_id': row['personal_group_id']}
+            login_cache.set(user_email, user)
+            return user
+
+    params = {'email': user_email, 'name': user_name, 'password_hash': access_token}
+    async with db_pool.connection() as conn:
+        cur = await conn.execute(UPSERT_LOGIN, params, prepare=True)
+        row = await cur.fetchone()
+        if row is None:
+            # Lost a race with a concurrent first login for the same email;
+            # the other transaction has committed by now, so this finds it.
+            await conn.commit()
+            cur = await conn.execute(UPSERT_LOGIN, params, prepare=True)
+            row = await cur.fetchone()
+
+    user = {'user_id': row['user_id'], 'personal_group_id': row['personal_group_id']}
+    login_cache.set(user_email, user)
+    return user
+
+async def provision_users(
+    db_pool: InstrumentedConnectionPool,
+    rows: Union[Iterable[tuple[str, str, str]], AsyncIterable[tuple[str, str, str]]]
+) -> dict[str, dict]:
+    """
+    Bulk counterpart of upsert_user_login for partner imports. Streams
+    (name, email, access_token) rows into a staging table with COPY, then
+    creates every missing user and personal group set based, all in one
+    transaction on one connection.
+
+    Returns:
+      dict mapping each email to its 'user_id', 'personal_group_id' and
+      whether it was 'created' by this call.
+    """
+    async with db_pool.connection() as conn:
+        await conn.execute(
+            """
+            CREATE TEMP TABLE user_import (
+                name          TEXT NOT NULL,
+                email         TEXT NOT NULL,
+                password_hash TEXT NOT NULL
+            ) ON COMMIT DROP
+            """,
+            prepare=False
+        )
+        async with conn.cursor() as cur:
+            async with cur.copy("COPY user_import (name, email, password_hash) FROM STDIN") as copy:
+                if isinstance(rows, AsyncIterable):
+                    async for row in rows:
+                        await copy.write_row(row)
+                else:
+                    for row in rows:
+                        await copy.write_row(row)
+
+        await conn.execute("ANALYZE user_import", prepare=False)
+        cur = await conn.execute(PROVISION_IMPORTED_USERS, prepare=False)
+        mapping = {
+            row['email']: {
+                'user_id': row['user_id'],
+                'personal_group_id': row['personal_group_id'],
+                'created': row['created'],
+            }
+            for row in await cur.fetchall()
+        }
+
+        # Emails claimed by a concurrent transaction mid-import are neither
+        # inserted nor visible to the statement's snapshot; pick them up now.
+        cur = await conn.execute("SELECT count(DISTINCT email) AS emails FROM user_import", prepare=False)
+        if (await cur.fetchone())['emails'] > len(mapping):
+            cur = await conn.execute(
                 """
-                SELECT *
-                FROM users
-                WHERE email = %s
+                SELECT u.email, u.user_id, u.personal_group_id
+                FROM users u
+                JOIN (SELECT DISTINCT email FROM user_import) i ON i.email = u.email
                 """,
-                (user_email,)
+                prepare=False
             )
-            user = cur.fetchone()
-            return user['user_id'] if user else None
-    finally:
-        db_pool.putconn(conn)
\ No newline at end of file
+            for row in await cur.fetchall():
+                mapping.setdefault(row['email'], {
+                    'user_id': row['user_id'],
+                    'personal_group_id': row['personal_group_id'],
+                    'created': False,
+                })
+
+    return mapping
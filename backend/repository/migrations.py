@@ -0,0 +1,196 @@
+"""
+Versioned migrations for the Postgres schema.
+
+db.sql is the baseline: it is loaded into an empty database and recorded as
+version 0. Every later change lives in migrations/NNNN_<name>.sql and is
+applied once, in version order, and recorded in schema_migrations.
+
+A migration runs in a single transaction unless its first line is
+
+    -- migrate: no-transaction
+
+in which case each statement runs on its own in autocommit mode, which is
+what CREATE INDEX CONCURRENTLY needs. Such migrations should be written to be
+safe to re-run (IF NOT EXISTS), since a failure part way through leaves the
+earlier statements applied. A concurrent index build that failed leaves an
+INVALID index behind, which IF NOT EXISTS would then skip for good; before
+each CREATE INDEX CONCURRENTLY, an invalid index of that name is dropped so
+the build starts over.
+
+Run from backend/:
+
+    python -m repository.migrations            # apply pending migrations
+    python -m repository.migrations --status   # list applied / pending
+"""
+import os
+import re
+import sys
+import asyncio
+from psycopg import AsyncConnection
+from typing import Union
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(BACKEND_DIR, 'db.sql')
+MIGRATIONS_DIR = os.path.join(BACKEND_DIR, 'migrations')
+
+NO_TRANSACTION_HEADER = '-- migrate: no-transaction'
+MIGRATION_FILE = re.compile(r'^(\d{4})_([\w-]+)\.sql$')
+CONCURRENT_INDEX = re.compile(
+    r'^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?("?[\w.]+"?)',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# An index left behind, unusable, by a CREATE INDEX CONCURRENTLY that failed.
+INVALID_INDEX = """
+    SELECT NOT i.indisvalid
+    FROM pg_index i
+    WHERE i.indexrelid = to_regclass(%s)
+"""
+
+# Any constant works; it only has to be the same for every process that
+# runs migrations against this database.
+MIGRATION_LOCK_ID = 7301126
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version    INTEGER PRIMARY KEY,
+        name       TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT now()
+    )
+"""
+
+class Migration:
+    def __init__(self, version: int, name: str, path: str):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def read(self) -> str:
+        with open(self.path, encoding='utf-8') as file:
+            return file.read()
+
+    @property
+    def transactional(self) -> bool:
+        return not self.read().lstrip().startswith(NO_TRANSACTION_HEADER)
+
+def discover_migrations(directory: str = MIGRATIONS_DIR) -> list[Migration]:
+    migrations: list[Migration] = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+def split_statements(sql: str) -> list[str]:
+    """
+    Splits a migration into statements on semicolons that end a line. Good
+    enough for DDL files; statements with a body ($$ ... $$) belong in a
+    transactional migration, which is sent as one script.
+    """
+    statements = []
+    for statement in re.split(r';\s*$', sql, flags=re.MULTILINE):
+        code = '\n'.join(line for line in statement.splitlines() if not line.strip().startswith('--'))
+        if code.strip():
+            statements.append(statement.strip())
+    return statements
+
+async def _applied_versions(conn: AsyncConnection) -> set[int]:
+    cur = await conn.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in await cur.fetchall()}
+
+async def _apply_baseline(conn: AsyncConnection):
+    cur = await conn.execute("SELECT to_regclass('users') IS NOT NULL")
+    has_schema = (await cur.fetchone())[0]
+    async with conn.transaction():
+        if not has_schema:
+            with open(BASELINE_PATH, encoding='utf-8') as file:
+                await conn.execute(file.read())
+            print("Loaded baseline schema from db.sql")
+        # A database created from db.sql before migrations existed is
+        # adopted as-is.
+        await conn.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (0, 'baseline') ON CONFLICT DO NOTHING"
+        )
+
+async def _apply(conn: AsyncConnection, migration: Migration):
+    sql = migration.read()
+    if migration.transactional:
+        async with conn.transaction():
+            await conn.execute(sql)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name),
+            )
+    else:
+        for statement in split_statements(sql):
+            await _drop_invalid_index(conn, statement)
+            await conn.execute(statement)
+        await conn.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (migration.version, migration.name),
+        )
+
+async def _drop_invalid_index(conn: AsyncConnection, statement: str):
+    code = '\n'.join(line for line in statement.splitlines() if not line.strip().startswith('--'))
+    match = CONCURRENT_INDEX.search(code)
+    if match is None:
+        return
+    cur = await conn.execute(INVALID_INDEX, (match.group(1),))
+    row = await cur.fetchone()
+    if row is not None and row[0]:
+        print(f"Dropping invalid index {match.group(1)} left by an earlier failed build")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+async def migrate(conninfo: Union[str, None] = None, **kwargs) -> list[int]:
+    """
+    Applies the baseline and every pending migration. Returns the versions
+    that were applied. Concurrent callers (several workers starting at once)
+    are serialised with an advisory lock, so each migration runs once.
+    """
+    applied_now: list[int] = []
+    # prepare_threshold=None: migrations are one-off statements, and a
+    # migration may change the very tables a prepared plan would refer to.
+    async with await AsyncConnection.connect(conninfo or '', autocommit=True, prepare_threshold=None, **kwargs) as conn:
+        await conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            await conn.execute(CREATE_MIGRATIONS_TABLE)
+            applied = await _applied_versions(conn)
+            if 0 not in applied:
+                await _apply_baseline(conn)
+
+            for migration in discover_migrations():
+                if migration.version in applied:
+                    continue
+                print(f"Applying migration {migration.version:04d}_{migration.name}")
+                await _apply(conn, migration)
+                applied_now.append(migration.version)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    return applied_now
+
+async def migration_status(conninfo: Union[str, None] = None, **kwargs) -> list[tuple[int, str, bool]]:
+    async with await AsyncConnection.connect(conninfo or '', autocommit=True, **kwargs) as conn:
+        await conn.execute(CREATE_MIGRATIONS_TABLE)
+        applied = await _applied_versions(conn)
+    status = [(0, 'baseline', 0 in applied)]
+    for migration in discover_migrations():
+        status.append((migration.version, migration.name, migration.version in applied))
+    return status
+
+async def _main(argv: list[str]):
+    from repository.database import connection_kwargs
+
+    if '--status' in argv:
+        for version, name, applied in await migration_status(**connection_kwargs()):
+            print(f"{version:04d}_{name}: {'applied' if applied else 'pending'}")
+        return
+
+    applied = await migrate(**connection_kwargs())
+    print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+
+if __name__ == '__main__':
+    asyncio.run(_main(sys.argv[1:]))
@@ -1,10 +1,11 @@
 import os
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import RedirectResponse
 from fastapi.exceptions import HTTPException
-from services.sessions import init_session
-from services.oauth import get_credentials, get_login_redirect_url
-from repository.database import get_user_by_email, create_user, init_db, shutdown_db
+from services.sessions import init_session, start_session_cache, close_redis, session_cache
+from services.static_assets import StaticAssetCache
+from services.oauth import get_credentials, get_login_redirect_url, init_oauth, shutdown_oauth
+from repository.database import upsert_user_login, init_db, shutdown_db, get_pool_metrics, login_cache
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 import uvicorn
@@ -13,26 +14,36 @@ load_dotenv()
 
 CLIENT_BASE_URL: str = os.getenv("CLIENT_BASE_URL", '')
 
+static_assets = StaticAssetCache(os.path.dirname(os.path.abspath(__file__)))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db(app)
+    await init_oauth(app)
+    await start_session_cache()
     yield
+    await shutdown_oauth(app)
     await shutdown_db(app)
+    await close_redis()
 
 app = FastAPI(lifespan=lifespan)
 
 app.middleware("http")(init_session)
 
 @app.get("/home")
-async def home_page():
-    file_path = './testUI.html'
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return HTMLResponse(content=file.read())
-    except FileNotFoundError:
-        print(f"Error: The file at '{file_path}' was not found.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+async def home_page(request: Request):
+    return static_assets.response(request, 'testUI.html')
+
+@app.get("/metrics/db")
+async def db_metrics():
+    metrics = {**get_pool_metrics(app.state.db_pool), 'login_cache': login_cache.stats()}
+    if app.state.db_replica_pool is not None:
+        metrics['replica'] = get_pool_metrics(app.state.db_replica_pool)
+    return metrics
+
+@app.get("/metrics/sessions")
+async def session_metrics():
+    return session_cache.stats()
 
 class RequestData(BaseModel):
     prompt: str
@@ -52,12 +63,11 @@ async def auth_callback(request: Request, code: str = '', error: str = ''):
     if not code:
         raise HTTPException(status_code=400, detail="Missing authorization code")
     
-    creds = get_credentials(code=code)
-    user_id = get_user_by_email(db_pool=app.state.db_pool, user_email=creds['email'])
-    if user_id == None:
-        user_id = create_user(db_pool=app.state.db_pool, user_name=creds['name'], user_email=creds['email'], access_token=creds['access_token'])
-    
-    request.state.session['user_id'] = user_id
+    creds = await get_credentials(http_client=app.state.http_client, code=code)
+    user = await upsert_user_login(db_pool=app.state.db_pool, user_name=creds['name'], user_email=creds['email'], access_token=creds['access_token'], replica_pool=app.state.db_replica_pool)
+
+    request.state.session['user_id'] = user['user_id']
+    request.state.session['personal_group_id'] = user['personal_group_id']
 
     return RedirectResponse(CLIENT_BASE_URL + os.getenv('DASHBOARD_ENDPOINT', '/'))
 
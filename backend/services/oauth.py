@@ -1,21 +1,122 @@
 import os
-import requests
+import re
+import time
+import asyncio
+import jwt
+import httpx
+from typing import Union
+from fastapi import FastAPI
 from fastapi.exceptions import HTTPException
 import urllib.parse
 
-GOOGLE_CLIENT_ID = "**"
-GOOGLE_CLIENT_SECRET = "**"
-REDIRECT_URI = "http://localhost:8000/auth/google/callback"
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "**")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", "**")
+REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/google/callback")
 
-AUTH_URL = "https://accounts.google.com/o/oauth2/v2/auth"
-TOKEN_URL = "https://oauth2.googleapis.com/token"
-USERINFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
+# Overridable so the flow can run against services/oauth_stub.py offline.
+AUTH_URL = os.getenv("GOOGLE_AUTH_URL", "https://accounts.google.com/o/oauth2/v2/auth")
+TOKEN_URL = os.getenv("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
+USERINFO_URL = os.getenv("GOOGLE_USERINFO_URL", "https://www.googleapis.com/oauth2/v2/userinfo")
+CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+
+ID_TOKEN_ISSUERS = ["https://accounts.google.com", "accounts.google.com"]
 
 SCOPES = ['openid',
           'https://www.googleapis.com/auth/userinfo.email',
           'https://www.googleapis.com/auth/userinfo.profile']
 
-def get_credentials(code: str):
+class GoogleSigningKeys:
+    """
+    Cache of Google's ID token signing keys (JWKS).
+
+    Keys are kept for as long as the certs response's Cache-Control max-age
+    allows. A token signed with an unknown `kid` means Google rotated its
+    keys, so the set is refetched then too, at most once per
+    `min_refresh_interval` seconds.
+    """
+    def __init__(self, certs_url: str, min_refresh_interval: float = 60):
+        self._certs_url = certs_url
+        self._min_refresh_interval = min_refresh_interval
+        self._keys: dict[str, jwt.PyJWK] = dict()
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self, kid: str) -> bool:
+        return kid in self._keys and time.monotonic() < self._expires_at
+
+    async def refresh(self, http_client: httpx.AsyncClient):
+        resp = await http_client.get(self._certs_url)
+        resp.raise_for_status()
+        keys = dict()
+        for jwk in resp.json().get('keys', []):
+            if jwk.get('kid'):
+                keys[jwk['kid']] = jwt.PyJWK(jwk)
+
+        max_age = re.search(r'max-age=(\d+)', resp.headers.get('cache-control', ''))
+        now = time.monotonic()
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + (int(max_age.group(1)) if max_age else 3600)
+
+    async def get(self, http_client: httpx.AsyncClient, kid: str) -> jwt.PyJWK:
+        if not self._fresh(kid):
+            async with self._lock:
+                rotated = kid not in self._keys and time.monotonic() - self._fetched_at >= self._min_refresh_interval
+                expired = time.monotonic() >= self._expires_at
+                if not self._fresh(kid) and (rotated or expired):
+                    try:
+                        await self.refresh(http_client)
+                    except httpx.HTTPError as e:
+                        # Keep verifying with the keys we have until Google is reachable.
+                        print(f"Failed to refresh Google signing keys: {e}")
+        if kid not in self._keys:
+            raise HTTPException(status_code=400, detail="ID token signed with an unknown key")
+        return self._keys[kid]
+
+signing_keys = GoogleSigningKeys(CERTS_URL)
+
+async def init_oauth(app: FastAPI):
+    # One keep-alive client for every call to Google, so logins reuse the
+    # TCP/TLS connection instead of opening a new one per request.
+    app.state.http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(10.0),
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=120),
+    )
+    try:
+        await signing_keys.refresh(app.state.http_client)
+    except httpx.HTTPError as e:
+        print(f"Could not prefetch Google signing keys: {e}")
+
+async def shutdown_oauth(app: FastAPI):
+    await app.state.http_client.aclose()
+
+async def verify_id_token(http_client: httpx.AsyncClient, id_token: str) -> dict:
+    """
+    Verifies the ID token's signature, audience, issuer and expiry locally and
+    returns its claims.
+    """
+    try:
+        header = jwt.get_unverified_header(id_token)
+        key = await signing_keys.get(http_client, header.get('kid', ''))
+        return jwt.decode(
+            id_token,
+            key=key,
+            algorithms=['RS256'],
+            audience=GOOGLE_CLIENT_ID,
+            issuer=ID_TOKEN_ISSUERS,
+            leeway=30,
+        )
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid ID token: {e}")
+
+def _email_verified(userinfo: dict) -> bool:
+    # email_verified in ID tokens (a string in some older ones), verified_email
+    # from the v2 userinfo endpoint.
+    verified = userinfo.get("email_verified", userinfo.get("verified_email"))
+    return verified is True or verified == "true"
+
+async def get_credentials(http_client: httpx.AsyncClient, code: str):
     token_data = {
         "code": code,
         "client_id": GOOGLE_CLIENT_ID,
@@ -24,7 +125,7 @@ def get_credentials(code: str):
         "grant_type": "authorization_code",
     }
 
-    token_resp = requests.post(TOKEN_URL, data=token_data)
+    token_resp = await http_client.post(TOKEN_URL, data=token_data)
     if token_resp.status_code != 200:
         raise HTTPException(status_code=400, detail="Failed to get token")
 
@@ -32,19 +133,30 @@ def get_credentials(code: str):
     access_token = tokens["access_token"]
     refresh_token = tokens.get("refresh_token")
 
-    userinfo_resp = requests.get(
-        USERINFO_URL,
-        headers={"Authorization": f"Bearer {access_token}"}
-    )
+    userinfo: Union[dict, None] = None
+    if tokens.get("id_token"):
+        userinfo = await verify_id_token(http_client, tokens["id_token"])
+
+    if userinfo is None or "email" not in userinfo:
+        # Only reached when Google omits the ID token or its email claim.
+        userinfo_resp = await http_client.get(
+            USERINFO_URL,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+
+        if userinfo_resp.status_code != 200:
+            raise HTTPException(status_code=400, detail="Failed to fetch user info")
 
-    if userinfo_resp.status_code != 200:
-        raise HTTPException(status_code=400, detail="Failed to fetch user info")
+        userinfo = userinfo_resp.json()
 
-    userinfo = userinfo_resp.json()
+    # Users are found or created by email, so an address Google has not
+    # verified must not log anyone in.
+    if not _email_verified(userinfo):
+        raise HTTPException(status_code=400, detail="Email address is not verified")
 
     return {
         "email": userinfo["email"],
-        "name": userinfo["name"],
+        "name": userinfo.get("name", userinfo["email"]),
         "access_token": access_token,
         "refresh_token": refresh_token,
         "picture": userinfo.get("picture"),
@@ -59,4 +171,4 @@ def get_login_redirect_url() -> str:
         "access_type": "offline",
         "prompt": "consent"
     }
-    return f"{AUTH_URL}?{urllib.parse.urlencode(params)}"
\ No newline at end of file
+    return f"{AUTH_URL}?{urllib.parse.urlencode(params)}"
@@ -0,0 +1,86 @@
+"""
+Local stand-in for Google's OAuth endpoints, for running the login flow
+offline. Start it and point the backend at it:
+
+    uvicorn services.oauth_stub:app --port 8099
+
+    GOOGLE_AUTH_URL=http://localhost:8099/authorize
+    GOOGLE_TOKEN_URL=http://localhost:8099/token
+    GOOGLE_CERTS_URL=http://localhost:8099/certs
+
+The authorization code doubles as the user: code "alice" logs in as
+alice@example.com. POST /rotate switches to a new signing key, the way
+Google rotates its keys.
+"""
+import time
+import uuid
+import jwt
+import urllib.parse
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Form
+from fastapi.responses import JSONResponse, RedirectResponse
+
+ISSUER = "https://accounts.google.com"
+CERTS_MAX_AGE = 300
+
+app = FastAPI()
+
+class SigningKey:
+    def __init__(self):
+        self.kid = uuid.uuid4().hex
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def jwk(self) -> dict:
+        jwk = RSAAlgorithm.to_jwk(self.private_key.public_key(), as_dict=True)
+        return {**jwk, 'kid': self.kid, 'use': 'sig', 'alg': 'RS256'}
+
+# Newest first. The previous key stays published so tokens already issued
+# keep verifying during a rotation.
+keys: list[SigningKey] = [SigningKey()]
+
+@app.get("/authorize")
+async def authorize(redirect_uri: str, state: str = '', login_hint: str = 'test-user'):
+    params = {'code': login_hint}
+    if state:
+        params['state'] = state
+    return RedirectResponse(f"{redirect_uri}?{urllib.parse.urlencode(params)}")
+
+@app.post("/token")
+async def token(code: str = Form(...), client_id: str = Form(...), grant_type: str = Form('authorization_code')):
+    if grant_type != 'authorization_code' or not code:
+        return JSONResponse({'error': 'invalid_grant'}, status_code=400)
+    now = int(time.time())
+    claims = {
+        'iss': ISSUER,
+        'aud': client_id,
+        'azp': client_id,
+        'sub': str(uuid.uuid5(uuid.NAMESPACE_DNS, code).int)[:21],
+        'email': f"{code}@example.com",
+        'email_verified': True,
+        'name': code.replace('.', ' ').title(),
+        'iat': now,
+        'exp': now + 3600,
+    }
+    id_token = jwt.encode(claims, keys[0].private_key, algorithm='RS256', headers={'kid': keys[0].kid})
+    return {
+        'access_token': f"stub-access-{uuid.uuid4().hex}",
+        'refresh_token': f"stub-refresh-{uuid.uuid4().hex}",
+        'expires_in': 3600,
+        'token_type': 'Bearer',
+        'scope': 'openid email profile',
+        'id_token': id_token,
+    }
+
+@app.get("/certs")
+async def certs():
+    return JSONResponse(
+        {'keys': [key.jwk() for key in keys]},
+        headers={'Cache-Control': f"public, max-age={CERTS_MAX_AGE}, must-revalidate, no-transform"},
+    )
+
+@app.post("/rotate")
+async def rotate():
+    keys.insert(0, SigningKey())
+    del keys[2:]
+    return {'kid': keys[0].kid}
@@ -0,0 +1,137 @@
+import os
+import gzip
+import time
+import hashlib
+import mimetypes
+from typing import Union
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request, Response
+from fastapi.exceptions import HTTPException
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are not worth compressing.
+MIN_COMPRESS_SIZE = 256
+
+class StaticAsset:
+    """
+    One file held in memory, along with its precompressed variants and the
+    validators used for conditional requests.
+    """
+    def __init__(self, path: str):
+        stat = os.stat(path)
+        with open(path, 'rb') as file:
+            body = file.read()
+
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.checked_at = time.monotonic()
+        self.media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.media_type.startswith('text/'):
+            self.media_type += '; charset=utf-8'
+        self.last_modified = formatdate(int(stat.st_mtime), usegmt=True)
+
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # encoding -> (body, etag). Each representation gets its own strong ETag.
+        self.variants: dict[str, tuple[bytes, str]] = {'identity': (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants['gzip'] = (compressed, f'"{digest}-gz"')
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants['br'] = (compressed, f'"{digest}-br"')
+
+    def etags(self) -> set[str]:
+        return {etag for _, etag in self.variants.values()}
+
+class StaticAssetCache:
+    """
+    Serves files from `root` out of memory. A file is read and compressed
+    once, then again only when its mtime changes; the mtime is checked at
+    most every `check_interval` seconds.
+    """
+    def __init__(self, root: str, check_interval: float = 1.0, cache_control: str = 'no-cache'):
+        self.root = os.path.abspath(root)
+        self.check_interval = check_interval
+        self.cache_control = cache_control
+        self._assets: dict[str, StaticAsset] = dict()
+
+    def get(self, name: str) -> StaticAsset:
+        path = os.path.abspath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            raise HTTPException(status_code=404, detail="Not found")
+
+        asset = self._assets.get(path)
+        try:
+            if asset is None:
+                asset = self._assets[path] = StaticAsset(path)
+            elif time.monotonic() - asset.checked_at >= self.check_interval:
+                if os.stat(path).st_mtime != asset.mtime:
+                    asset = self._assets[path] = StaticAsset(path)
+                else:
+                    asset.checked_at = time.monotonic()
+        except FileNotFoundError:
+            self._assets.pop(path, None)
+            print(f"Error: The file at '{path}' was not found.")
+            raise HTTPException(status_code=404, detail="Not found")
+        return asset
+
+    def response(self, request: Request, name: str) -> Response:
+        asset = self.get(name)
+        encoding = _negotiate_encoding(request.headers.get('accept-encoding', ''), asset)
+        body, etag = asset.variants[encoding]
+        headers = {
+            'ETag': etag,
+            'Last-Modified': asset.last_modified,
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+
+        if _not_modified(request, asset):
+            return Response(status_code=304, headers=headers)
+
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+def _not_modified(request: Request, asset: StaticAsset) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since.
+        if if_none_match.strip() == '*':
+            return True
+        candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return bool(candidates & asset.etags())
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(asset.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _negotiate_encoding(accept_encoding: str, asset: StaticAsset) -> str:
+    accepted: dict[str, float] = dict()
+    for entry in accept_encoding.split(','):
+        coding, _, params = entry.strip().partition(';')
+        quality: Union[float, None] = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = None
+        if coding and quality:
+            accepted[coding.lower()] = quality
+
+    best, best_quality = 'identity', 0.0
+    for encoding in ('br', 'gzip'):
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if encoding in asset.variants and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best